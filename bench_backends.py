@@ -0,0 +1,106 @@
+import time
+import argparse
+import cv2
+import numpy as np
+from inference_backend import load_backend, warmup, calibration_frames, box_iou, MODEL_WEIGHTS, MODEL_IMGSZ, CALIBRATION_DIR
+
+# Сравнение бэкендов инференса на кадрах с наших камер:
+#   python bench_backends.py --frames /data/filtered --backends pytorch,onnx,openvino --int8 --threads 4
+# Выводит задержку на кадр (p50/p95), пропускную способность и согласие детекций с PyTorch.
+
+
+def match_count(reference, candidate, iou_threshold):
+    # жадное сопоставление боксов одного класса с IoU >= порога
+    ref_cls, _, ref_xyxy = reference
+    cand_cls, _, cand_xyxy = candidate
+    if not len(ref_cls) or not len(cand_cls):
+        return 0
+    iou = box_iou(ref_xyxy, cand_xyxy)
+    iou[ref_cls[:, None] != cand_cls[None, :]] = 0
+    matched = 0
+    while True:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        if iou[i, j] < iou_threshold:
+            return matched
+        matched += 1
+        iou[i, :] = 0
+        iou[:, j] = 0
+
+
+def above(outputs, conf):
+    return [(c[s >= conf], s[s >= conf], b[s >= conf]) for c, s, b in outputs]
+
+
+def run_backend(backend, frames, batch):
+    latencies = []
+    outputs = []
+    started = time.perf_counter()
+    for start in range(0, len(frames), batch):
+        chunk = frames[start:start + batch]
+        t0 = time.perf_counter()
+        outputs.extend(backend.predict(chunk))
+        latencies.append((time.perf_counter() - t0) / len(chunk))
+    return outputs, latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкендов инференса YOLO")
+    parser.add_argument("--frames", default=CALIBRATION_DIR,
+                        help="папка с кадрами камер; на них же INT8-калибровка, если модели ещё нет в кеше")
+    parser.add_argument("--limit", type=int, default=50, help="сколько кадров взять")
+    parser.add_argument("--backends", default="pytorch,onnx,openvino")
+    parser.add_argument("--int8", action="store_true", help="добавить INT8-варианты onnx/openvino")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--imgsz", type=int, default=MODEL_IMGSZ)
+    parser.add_argument("--weights", default=MODEL_WEIGHTS)
+    parser.add_argument("--conf", type=float, default=0.25, help="порог уверенности для сравнения детекций")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU для совпадения боксов")
+    args = parser.parse_args()
+
+    frames = [f for f in (cv2.imread(p) for p in calibration_frames(args.frames, args.limit)) if f is not None]
+    if not frames:
+        print(f"[-] В {args.frames} нет кадров.")
+        return
+    print(f"[*] Кадров: {len(frames)}, imgsz={args.imgsz}, batch={args.batch}, threads={args.threads or 'auto'}")
+
+    variants = [(name, False) for name in args.backends.split(",")]
+    if args.int8:
+        variants += [(name, True) for name in args.backends.split(",") if name in ("onnx", "openvino")]
+    if ("pytorch", False) not in variants:
+        variants.insert(0, ("pytorch", False))
+
+    reference = None
+    rows = []
+    for name, int8 in variants:
+        label = f"{name}{'-int8' if int8 else ''}"
+        t0 = time.perf_counter()
+        backend = load_backend(name, args.weights, args.imgsz, int8, args.threads, calibration_dir=args.frames)
+        if backend.name != name:
+            print(f"[-] {label}: бэкенд недоступен, пропускаем.")
+            continue
+        warmup(backend, args.imgsz)
+        load_time = time.perf_counter() - t0
+
+        outputs, latencies, total = run_backend(backend, frames, args.batch)
+        outputs = above(outputs, args.conf)
+        if reference is None:
+            reference = outputs
+
+        ref_boxes = sum(len(r[0]) for r in reference)
+        boxes = sum(len(o[0]) for o in outputs)
+        matched = sum(match_count(r, o, args.iou) for r, o in zip(reference, outputs))
+        precision = matched / boxes if boxes else 1.0
+        recall = matched / ref_boxes if ref_boxes else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        same_labels = np.mean([set(r[0].tolist()) == set(o[0].tolist()) for r, o in zip(reference, outputs)])
+        ms = np.array(latencies) * 1000
+        rows.append((label, load_time, np.percentile(ms, 50), np.percentile(ms, 95), len(frames) / total, f1, same_labels))
+
+    print(f"\n{'бэкенд':<16}{'загрузка,с':>11}{'p50,мс':>9}{'p95,мс':>9}{'кадр/с':>9}{'F1 с pt':>9}{'метки':>8}")
+    for label, load_time, p50, p95, fps, f1, same in rows:
+        print(f"{label:<16}{load_time:>11.1f}{p50:>9.1f}{p95:>9.1f}{fps:>9.2f}{f1:>9.3f}{same:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
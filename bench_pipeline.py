@@ -0,0 +1,495 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from email import policy
+import cv2
+import numpy as np
+from inference_backend import calibration_frames
+from metrics import STAGE_SECONDS, count_files
+import bench_standins
+
+# Сквозной замер конвейера без внешних сервисов: синтетические тревожные письма регистратора кладутся
+# в локальный IMAP, fetch_mail.py и detect_cars.py запускаются как в контейнерах (DATA_DIR — временная папка),
+# уведомления принимают локальные SMTP и Telegram Bot API (bench_standins.py):
+#   python bench_pipeline.py steady --rate 2 --duration 60
+#   python bench_pipeline.py burst --burst 30 --bursts 3 --interval 20
+#   python bench_pipeline.py outage --rate 1 --duration 90 --outage-start 20 --outage-length 30
+# По умолчанию бэкенд synthetic (bench_standins.SyntheticBackend без модели, --infer-ms — время прохода
+# на кадр); с --backend pytorch и --frames /data/filtered — настоящая модель на кадрах камер.
+# Выводит задержку письмо -> уведомление (p50/p99) по каналам, кадров/с, пиковую память процессов и
+# время этапов из /metrics; --results дописывает строку JSON, чтобы сравнивать прогоны между собой.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 0.5
+SYNTHETIC_BACKEND = "bench_standins:SyntheticBackend"  # подставляется детектору при --backend synthetic
+CAPTION_RE = re.compile(r"^\*(.+?)\*: .*\n`(\S+) (\S+)`$", re.S)
+LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+# получатели из CAMERA_SETTINGS детектора
+BENCH_ENV = {
+    "GENERAL_CHAT_ID": "-1001", "TELEGRAM_CHAT_ID_1": "-1002", "TELEGRAM_CHAT_ID_2": "-1003",
+    "GENERAL_EMAIL": "ops@bench.local", "EMAIL_RECEIVER_1": "guard1@bench.local", "EMAIL_RECEIVER_2": "guard2@bench.local",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_scene(rng, width, height, stamp):
+    # серый фон с градиентом и шумом (без насыщенных цветов) и 1–2 цветных «машины» в случайных местах
+    angle = rng.uniform(0, 2 * np.pi)
+    x = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+    gray = 110 + 50 * (np.cos(angle) * x + np.sin(angle) * y)
+    frame = np.repeat(gray[:, :, None], 3, axis=2) + rng.normal(0, 4, (height, width, 1)).astype(np.float32)
+    frame = frame.clip(0, 255).astype(np.uint8)
+    for _ in range(rng.integers(1, 3)):
+        w, h = int(width * rng.uniform(0.12, 0.25)), int(height * rng.uniform(0.12, 0.25))
+        x1, y1 = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+        color = cv2.cvtColor(np.uint8([[[rng.integers(0, 180), 230, 220]]]), cv2.COLOR_HSV2BGR)[0, 0].tolist()
+        cv2.rectangle(frame, (x1, y1), (x1 + w, y1 + h), color, -1)
+    # регистратор впечатывает время в кадр, поэтому повторов содержимого не бывает
+    cv2.putText(frame, stamp, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (235, 235, 235), 2)
+    return frame
+
+
+def frame_source(args):
+    # -> функция (номер кадра, подпись) -> JPEG
+    rng = np.random.default_rng(args.seed)
+    width, height = map(int, args.size.split("x"))
+    if args.frames:
+        frames = [f for f in (cv2.imread(p) for p in calibration_frames(args.frames, args.limit)) if f is not None]
+        if not frames:
+            sys.exit(f"[-] В {args.frames} нет кадров.")
+
+        def real(index, stamp):
+            frame = frames[index % len(frames)].copy()
+            cv2.putText(frame, stamp, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (235, 235, 235), 2)
+            return cv2.imencode(".jpg", frame)[1].tobytes()
+        return real
+
+    return lambda index, stamp: cv2.imencode(".jpg", make_scene(rng, width, height, stamp))[1].tobytes()
+
+
+def make_alarm_email(camera, channel, event_time, jpegs):
+    # письмо в формате регистратора, который разбирает fetch_mail.py
+    message = MIMEMultipart()
+    message["From"] = "dvr@bench.local"
+    message["To"] = "alarm@bench.local"
+    message["Subject"] = "Motion Detected"
+    message.attach(MIMEText(
+        "This is an automatically generated e-mail from your DVR.\r\n\r\n"
+        "EVENT TYPE:    Motion Detected\r\n"
+        f"EVENT TIME:    {event_time:%Y-%m-%d,%H:%M:%S}\r\n"
+        "DVR NAME:      Embedded Net DVR\r\n"
+        "DVR S/N:       BENCH0000000000000000\r\n"
+        f"CAMERA NAME(NUM):   {camera}(D{channel})\r\n", "plain", "utf-8"))
+    for index, jpeg in enumerate(jpegs):
+        image = MIMEImage(jpeg, "jpeg")
+        image.add_header("Content-Disposition", "attachment", filename=f"ch{channel:02d}_{event_time:%Y%m%d%H%M%S}{index}.jpg")
+        message.attach(image)
+    return message.as_bytes(policy=policy.SMTP)
+
+
+def schedule(args):
+    # -> смещения отправки писем от начала прогона, с
+    if args.scenario == "burst":
+        return [burst * args.interval for burst in range(args.bursts) for _ in range(args.burst)]
+    return [i / args.rate for i in range(int(args.rate * args.duration))]
+
+
+def build_traffic(args):
+    # письма готовятся заранее, чтобы генерация кадров не попадала в замер
+    cameras = args.cameras.split(",")
+    render = frame_source(args)
+    base = datetime.now().replace(microsecond=0)
+    traffic = []
+    for n, offset in enumerate(schedule(args)):
+        camera = cameras[n % len(cameras)]
+        event_time = base + timedelta(seconds=n)
+        stamp = f"{event_time:%Y-%m-%d %H:%M:%S}"
+        jpegs = [render(n * args.attachments + i, f"{stamp} #{i}") for i in range(args.attachments)]
+        key = (camera, f"{event_time:%Y-%m-%d}", f"{event_time:%H:%M:%S}")
+        traffic.append((offset, key, make_alarm_email(camera, cameras.index(camera) + 1, event_time, jpegs)))
+    return traffic
+
+
+def scrape(ports):
+    # сумма метрик всех процессов: {(имя, ((метка, значение), ...)): значение}
+    samples = {}
+    for port in ports:
+        try:
+            text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2).read().decode()
+        except OSError:
+            continue
+        for line in text.splitlines():
+            if not line or line.startswith("#"):
+                continue
+            name_labels, value = line.rsplit(" ", 1)
+            name, _, labels = name_labels.partition("{")
+            key = (name, tuple(sorted(LABEL_RE.findall(labels))))
+            samples[key] = samples.get(key, 0.0) + float(value)
+    return samples
+
+
+def metric_sum(samples, name, **labels):
+    wanted = set(labels.items())
+    return sum(value for (sample, sample_labels), value in samples.items()
+               if sample == name and wanted <= set(sample_labels))
+
+
+def stage_table(samples):
+    # гистограммы этапов -> {этап: (count, p50, p99)}
+    buckets = {}
+    for (name, labels), value in samples.items():
+        if name == "fotomon_stage_seconds_bucket":
+            labels = dict(labels)
+            buckets.setdefault(labels["stage"], {})[labels["le"]] = value
+    stages = {}
+    for stage, cumulative in buckets.items():
+        bounds = [f"{upper:g}" for upper in STAGE_SECONDS.buckets] + ["+Inf"]
+        counts = np.diff([0] + [cumulative.get(bound, 0) for bound in bounds]).tolist()
+        total = cumulative.get("+Inf", 0)
+        if total:
+            stages[stage] = (int(total), STAGE_SECONDS.quantile(0.5, counts, total), STAGE_SECONDS.quantile(0.99, counts, total))
+    return stages
+
+
+def group_rss(pgid):
+    # VmRSS всех процессов группы (сервис вместе с обработчиками), байт
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{entry}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class MemorySampler:
+    def __init__(self, processes):
+        self.processes = processes  # имя сервиса -> Popen
+        self.peak = {name: 0 for name in processes}
+        self.last = dict(self.peak)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            for name, process in self.processes.items():
+                rss = group_rss(process.pid)
+                self.last[name] = rss
+                self.peak[name] = max(self.peak[name], rss)
+
+
+def service_env(args, data_dir, imap, smtp, telegram, metrics_ports):
+    env = dict(os.environ, **BENCH_ENV)
+    env.update({
+        "PYTHONUNBUFFERED": "1",
+        "DATA_DIR": data_dir,
+        "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": str(imap.server_address[1]), "USE_SSL": "false",
+        "EMAIL_ACCOUNT": "alarm@bench.local", "EMAIL_PASSWORD": "bench", "IMAP_MODE": args.imap_mode,
+        "SMTP_SERVER_OUT": "127.0.0.1", "EMAIL_PORT_OUT": str(smtp.server_address[1]), "SMTP_STARTTLS": "false",
+        "EMAIL_ACCOUNT_OUT": "detector@bench.local", "EMAIL_PASSWORD_OUT": "bench",
+        "TELEGRAM_BOT_TOKEN": "0:bench", "TELEGRAM_API_URL": telegram.url,
+        "INFER_BACKEND": SYNTHETIC_BACKEND if args.backend == "synthetic" else args.backend,
+        "INFER_SYNTHETIC_MS": str(args.infer_ms),
+        "DETECT_WORKERS": str(args.workers), "METRICS_LOG_INTERVAL": "0",
+    })
+    if args.frames:
+        # кадры камер повторяются по кругу: окно дедупликации сокращается, чтобы повтор не отбрасывался
+        env["DEDUP_WINDOW"] = "1"
+    for item in args.env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return ({**env, "METRICS_PORT": str(metrics_ports["fetcher"])},
+            {**env, "METRICS_PORT": str(metrics_ports["detector"])})
+
+
+def launch(script, env, log_path):
+    # своя группа процессов: при остановке гасятся и обработчики детектора
+    log = open(log_path, "wb")
+    return subprocess.Popen([sys.executable, script], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def terminate(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def wait_ready(args, data_dir, imap, processes, timeout):
+    # детектор готов, когда все обработчики загрузили модель и завели пульс; сборщик — когда открыл ящик
+    deadline = time.time() + timeout
+    processing = os.path.join(data_dir, "processing")
+    while time.time() < deadline:
+        for name, process in processes.items():
+            if process.poll() is not None:
+                sys.exit(f"[-] {name} завершился с кодом {process.returncode}, см. {data_dir}/{name}.log")
+        try:
+            beating = sum(os.path.exists(os.path.join(processing, d, ".heartbeat")) for d in os.listdir(processing))
+        except FileNotFoundError:
+            beating = 0
+        if beating >= args.workers and imap.mailbox.selects:
+            return
+        time.sleep(POLL_INTERVAL)
+    sys.exit(f"[-] Сервисы не запустились за {timeout} с, см. журналы в {data_dir}")
+
+
+def outage_timeline(args):
+    # -> [(смещение, включить?)] для сценария outage
+    if args.scenario != "outage":
+        return []
+    return [(args.outage_start, True), (args.outage_start + args.outage_length, False)]
+
+
+def feed(traffic, mailbox, appended, started):
+    for offset, key, raw in traffic:
+        delay = started + offset - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        appended[key] = time.time()
+        mailbox.append(raw, appended[key])
+
+
+def first_notifications(telegram, smtp):
+    # -> {"telegram": {ключ события: время}, "email": {...}}
+    first = {"telegram": {}, "email": {}}
+    with telegram.lock:
+        for received_at, method, chat_id, captions, uploads in telegram.received:
+            for caption in captions:
+                match = CAPTION_RE.match(caption or "")
+                if match:
+                    first["telegram"].setdefault(match.groups(), received_at)
+    with smtp.lock:
+        for received_at, recipients, subject, filenames in smtp.received:
+            for filename in filenames:
+                parts = filename.split("_")
+                if len(parts) >= 4:
+                    first["email"].setdefault((parts[0], parts[1], parts[2].replace("-", ":")), received_at)
+    return first
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.array(values)
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    print(f"[*] Готовим письма: сценарий {args.scenario}, камеры {args.cameras}, вложений {args.attachments}...")
+    traffic = build_traffic(args)
+    frames_total = len(traffic) * args.attachments
+    print(f"[*] Писем: {len(traffic)}, кадров: {frames_total}, "
+          f"{sum(len(raw) for _, _, raw in traffic) / 2 ** 20:.1f} МБ")
+
+    data_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    imap = bench_standins.start(bench_standins.ImapStandIn(), "bench-imap")
+    smtp = bench_standins.start(bench_standins.SmtpStandIn(), "bench-smtp")
+    telegram = bench_standins.start(bench_standins.TelegramStandIn(delay=args.telegram_delay / 1000), "bench-telegram")
+    services = {"imap": imap, "smtp": smtp, "telegram": telegram}
+    metrics_ports = {"fetcher": free_port(), "detector": free_port()}
+    # при нескольких обработчиках у каждого свой порт метрик: METRICS_PORT+1+номер (detect_cars.supervise)
+    detector_ports = [metrics_ports["detector"]] + [metrics_ports["detector"] + 1 + i for i in range(args.workers)]
+    fetcher_env, detector_env = service_env(args, data_dir, imap, smtp, telegram, metrics_ports)
+
+    processes = {}
+    try:
+        processes["detector"] = launch("detect_cars.py", detector_env, os.path.join(data_dir, "detector.log"))
+        processes["fetcher"] = launch("fetch_mail.py", fetcher_env, os.path.join(data_dir, "fetcher.log"))
+        wait_ready(args, data_dir, imap, processes, args.startup_timeout)
+        sampler = MemorySampler(processes).start()
+        print(f"[*] Сервисы запущены (DATA_DIR={data_dir}), подаём письма...")
+
+        appended = {}
+        started = time.time()
+        feeder = threading.Thread(target=feed, args=(traffic, imap.mailbox, appended, started), daemon=True)
+        feeder.start()
+        timeline = outage_timeline(args)
+        outage_names = [name for name in args.outage_services.split(",") if name in services]
+
+        processed_at = None
+        last_notification = started
+        notified = 0
+        samples = {}
+        while time.time() - started < args.timeout:
+            time.sleep(POLL_INTERVAL)
+            now = time.time() - started
+            while timeline and timeline[0][0] <= now:
+                _, down = timeline.pop(0)
+                for name in outage_names:
+                    services[name].outage = down
+                print(f"[*] {now:.1f} с: {'недоступны' if down else 'снова доступны'}: {', '.join(outage_names)}")
+
+            samples = scrape(detector_ports + [metrics_ports["fetcher"]])
+            done = (metric_sum(samples, "fotomon_images_processed_total")
+                    + metric_sum(samples, "fotomon_images_deduplicated_total"))
+            if processed_at is None and not feeder.is_alive() and done >= frames_total:
+                processed_at = time.time()
+            received = len(telegram.received) + len(smtp.received)
+            if received != notified:
+                notified, last_notification = received, time.time()
+            queues_empty = not any(os.path.isdir(path) and count_files(path, ".json") for path in
+                                   (os.path.join(data_dir, "telegram-queue"), os.path.join(data_dir, "mail-spool")))
+            # события в окне NOTIFY_COALESCE_WINDOW и в отправке ещё дадут уведомления, settle их не ждёт
+            pending = metric_sum(samples, "fotomon_notify_pending")
+            if (processed_at and not timeline and queues_empty and not pending
+                    and time.time() - last_notification >= args.settle):
+                break
+        else:
+            print(f"[-] Прогон не завершился за {args.timeout} с, отчёт по полученному.")
+        sampler.stop()
+    finally:
+        for process in processes.values():
+            terminate(process)
+        for server in services.values():
+            bench_standins.stop(server)
+
+    report = make_report(args, traffic, appended, started, processed_at, telegram, smtp, samples, sampler)
+    print_report(report, samples)
+    if args.results:
+        with open(args.results, "a") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+        print(f"[+] Результат дописан в {args.results}")
+    if args.keep:
+        print(f"[*] Данные и журналы прогона: {data_dir}")
+    else:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def make_report(args, traffic, appended, started, processed_at, telegram, smtp, samples, sampler):
+    first = first_notifications(telegram, smtp)
+    latency = {}
+    delivered = {}
+    for channel, times in list(first.items()) + [("any", None)]:
+        if channel == "any":
+            times = {key: min(t[key] for t in first.values() if key in t) for key in set().union(*first.values())}
+        values = [times[key] - appended[key] for key in times if key in appended]
+        latency[channel] = percentiles(values)
+        delivered[channel] = len(values)
+    processed = metric_sum(samples, "fotomon_images_processed_total")
+    duration = (processed_at or time.time()) - started
+    return {
+        "ts": round(time.time(), 3), "git": git_revision(), "scenario": args.scenario,
+        "params": {name: getattr(args, name) for name in ("rate", "duration", "burst", "bursts", "interval",
+                                                          "outage_start", "outage_length", "outage_services", "cameras",
+                                                          "attachments", "size", "backend", "infer_ms", "workers",
+                                                          "frames", "imap_mode", "telegram_delay", "env")},
+        "emails": len(traffic), "frames": len(traffic) * args.attachments,
+        "processed": {result: metric_sum(samples, "fotomon_images_processed_total", result=result)
+                      for result in ("found", "rejected", "skipped", "cached")},
+        "deduplicated": metric_sum(samples, "fotomon_images_deduplicated_total"),
+        "suppressed": metric_sum(samples, "fotomon_alerts_suppressed_total"),
+        "events_notified": delivered, "latency_s": latency,
+        "images_per_sec": processed / duration if duration > 0 else None,
+        "rss_peak_mb": {name: round(value / 2 ** 20, 1) for name, value in sampler.peak.items()},
+        "stages": {stage: {"count": count, "p50": p50, "p99": p99} for stage, (count, p50, p99) in stage_table(samples).items()},
+    }
+
+
+def print_report(report, samples):
+    processed = report["processed"]
+    print(f"\n[*] Писем {report['emails']}, кадров {report['frames']}: с объектами {processed['found']:.0f}, "
+          f"без {processed['rejected']:.0f}, без изменений {processed['skipped']:.0f}, из индекса {processed['cached']:.0f}, "
+          f"дубликатов {report['deduplicated']:.0f}, без уведомления (на месте) {report['suppressed']:.0f}")
+    print(f"[*] Пропускная способность: {report['images_per_sec'] or 0:.2f} кадр/с")
+    print(f"[*] Пиковая память: " + ", ".join(f"{name} {mb:.0f} МБ" for name, mb in report["rss_peak_mb"].items()))
+
+    print(f"\n{'канал':<10}{'событий':>9}{'p50,с':>9}{'p99,с':>9}{'max,с':>9}")
+    for channel, stats in report["latency_s"].items():
+        if stats:
+            print(f"{channel:<10}{report['events_notified'][channel]:>9}{stats['p50']:>9.2f}{stats['p99']:>9.2f}{stats['max']:>9.2f}")
+        else:
+            print(f"{channel:<10}{0:>9}{'-':>9}{'-':>9}{'-':>9}")
+
+    print(f"\n{'этап':<14}{'раз':>8}{'p50,мс':>10}{'p99,мс':>10}")
+    for stage, stats in sorted(report["stages"].items()):
+        print(f"{stage:<14}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+
+    calls = {labels: value for (name, labels), value in samples.items() if name == "fotomon_telegram_calls_total"}
+    if calls:
+        print("\n[*] Вызовы Telegram: " + ", ".join(
+            f"{dict(labels)['method']} {dict(labels)['result']}: {value:.0f}" for labels, value in sorted(calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк конвейера на синтетических письмах")
+    parser.add_argument("scenario", choices=["steady", "burst", "outage"])
+    parser.add_argument("--rate", type=float, default=1, help="писем в секунду (steady, outage)")
+    parser.add_argument("--duration", type=float, default=60, help="длительность подачи, с (steady, outage)")
+    parser.add_argument("--burst", type=int, default=20, help="писем в всплеске (burst)")
+    parser.add_argument("--bursts", type=int, default=3, help="число всплесков (burst)")
+    parser.add_argument("--interval", type=float, default=30, help="пауза между всплесками, с (burst)")
+    parser.add_argument("--outage-start", type=float, default=15, help="начало недоступности, с от старта (outage)")
+    parser.add_argument("--outage-length", type=float, default=30, help="длительность недоступности, с (outage)")
+    parser.add_argument("--outage-services", default="telegram,smtp", help="что отключать: telegram,smtp,imap")
+    parser.add_argument("--cameras", default="vorota1,vorota2,dvr5", help="имена камер в письмах (как в CAMERA_SETTINGS)")
+    parser.add_argument("--attachments", type=int, default=3, help="кадров в письме")
+    parser.add_argument("--size", default="1280x720", help="размер синтетических кадров")
+    parser.add_argument("--frames", help="папка с кадрами камер вместо синтетических")
+    parser.add_argument("--limit", type=int, default=200, help="сколько кадров взять из --frames")
+    parser.add_argument("--backend", default="synthetic", help="INFER_BACKEND детектора")
+    parser.add_argument("--infer-ms", type=float, default=0, help="время прохода synthetic-бэкенда на кадр, мс")
+    parser.add_argument("--workers", type=int, default=1, help="DETECT_WORKERS")
+    parser.add_argument("--imap-mode", default="idle", choices=["idle", "noop", "poll"])
+    parser.add_argument("--telegram-delay", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE для обоих сервисов, можно повторять")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=5, help="тишина после последнего уведомления до конца прогона, с")
+    parser.add_argument("--timeout", type=float, default=900, help="предел длительности прогона, с")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="ожидание загрузки модели, с")
+    parser.add_argument("--results", help="файл JSON lines для истории прогонов")
+    parser.add_argument("--keep", action="store_true", help="не удалять DATA_DIR с журналами сервисов")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import time
+import argparse
+import numpy as np
+from inference_backend import calibration_frames
+from roi import roi_plan
+import detect_cars
+from detect_cars import CAMERA_SETTINGS, init_model, load_frame, parse_filename, run_model, filter_detections
+
+# Полный кадр против зон интереса (roi/imgsz из CAMERA_SETTINGS) на кадрах каждой камеры:
+#   python bench_roi.py --frames /data/filtered --limit 200
+# Выводит пикселей на кадр, задержку p50, ускорение и число найденных нужных объектов в зоне.
+
+model = None
+
+
+def full_frame(frames, settings):
+    return [model.predict([frame])[0] for frame in frames]
+
+
+def with_roi(frames, settings):
+    return [run_model([frame], [settings])[0] for frame in frames]
+
+
+def timed(function, frames, settings):
+    latencies = []
+    outputs = []
+    for frame in frames:
+        t0 = time.perf_counter()
+        outputs.extend(function([frame], settings))
+        latencies.append(time.perf_counter() - t0)
+    return outputs, np.array(latencies) * 1000
+
+
+def found_in_zone(outputs, frames, settings):
+    # нужные объекты после порогов камеры; для полного кадра — только с центром в зоне, как у ROI
+    total = 0
+    for (classes, confidences, xyxy), frame in zip(outputs, frames):
+        plan = roi_plan(settings, frame.shape[1], frame.shape[0])
+        if plan is not None and len(xyxy):
+            keep = plan.inside(xyxy)
+            classes, confidences, xyxy = classes[keep], confidences[keep], xyxy[keep]
+        detection = filter_detections(classes, confidences, xyxy, settings)
+        if detection.found:
+            total += len(detection.boxes)
+    return total
+
+
+def pixels(frame, settings):
+    plan = roi_plan(settings, frame.shape[1], frame.shape[0])
+    imgsz = settings.get("imgsz", model.imgsz)
+    return (len(plan.tiles) if plan else 1) * imgsz * imgsz
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк инференса по зонам интереса камер")
+    parser.add_argument("--frames", default=detect_cars.FILTERED,
+                        help="папка с кадрами камер; на них же INT8-калибровка, если модели ещё нет в кеше")
+    parser.add_argument("--limit", type=int, default=200, help="сколько кадров взять")
+    args = parser.parse_args()
+
+    global model
+    model = init_model(args.frames)
+
+    cameras = {}
+    for path in calibration_frames(args.frames, args.limit):
+        parsed = parse_filename(os.path.basename(path))
+        frame, _ = load_frame(path)
+        if parsed is not None and frame is not None:
+            cameras.setdefault(parsed[0], []).append(frame)
+    if not cameras:
+        print(f"[-] В {args.frames} нет кадров.")
+        return
+
+    rows = []
+    for camera_name, frames in sorted(cameras.items()):
+        settings = CAMERA_SETTINGS.get(camera_name, CAMERA_SETTINGS["default"])
+        full_outputs, full_ms = timed(full_frame, frames, settings)
+        roi_outputs, roi_ms = timed(with_roi, frames, settings)
+        rows.append((camera_name, len(frames), model.imgsz ** 2, np.mean([pixels(f, settings) for f in frames]),
+                     np.percentile(full_ms, 50), np.percentile(roi_ms, 50), full_ms.sum() / roi_ms.sum(),
+                     found_in_zone(full_outputs, frames, settings), found_in_zone(roi_outputs, frames, settings)))
+
+    print(f"\n{'камера':<12}{'кадров':>7}{'Мпикс':>7}{'Мпикс roi':>10}{'p50,мс':>9}{'p50 roi':>9}"
+          f"{'ускор.':>8}{'объектов':>10}{'в roi':>7}")
+    for camera_name, count, full_px, roi_px, full_p50, roi_p50, speedup, full_found, roi_found in rows:
+        print(f"{camera_name:<12}{count:>7}{full_px / 1e6:>7.2f}{roi_px / 1e6:>10.2f}{full_p50:>9.1f}{roi_p50:>9.1f}"
+              f"{speedup:>7.2f}x{full_found:>10}{roi_found:>7}")
+
+
+if __name__ == "__main__":
+    main()
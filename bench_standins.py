@@ -0,0 +1,458 @@
+import os
+import re
+import json
+import time
+import email
+import select
+import socket
+import imaplib
+import threading
+import socketserver
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+
+# Локальные заменители внешних сервисов для bench_pipeline.py: IMAP-ящик с IDLE, SMTP-приёмник
+# и Telegram Bot API. Всё в памяти, на 127.0.0.1 и свободных портах. У каждого сервера флаг outage —
+# имитация недоступности: IMAP рвёт соединения, SMTP отвечает 451, Telegram — 502.
+# SyntheticBackend подменяет модель в процессе детектора, без весов.
+
+INFER_SYNTHETIC_MS = float(os.getenv("INFER_SYNTHETIC_MS", "0"))  # время прохода SyntheticBackend на кадр
+IDLE_POLL = 0.01  # как часто IDLE-соединение проверяет ящик на новые письма
+NEWLINE = b"\n"
+ITEM_RE = re.compile(r'BODY\.PEEK\[[^\]]*\]|BODY\[[^\]]*\]|[A-Z0-9.]+', re.IGNORECASE)
+
+
+def parse_uid_set(text, last_uid):
+    # "1:3,7,9:*" -> множество UID
+    uids = set()
+    for piece in text.split(","):
+        start, _, end = piece.partition(":")
+        start = last_uid if start == "*" else int(start)
+        end = start if not end else last_uid if end == "*" else int(end)
+        uids.update(range(min(start, end), max(start, end) + 1))
+    return uids
+
+
+def body_structure(part, prefix="", sections=None):
+    # BODYSTRUCTURE части письма (RFC 3501) и её тела в sections: {"1": байты, "2": ...}
+    if part.is_multipart():
+        children = "".join(body_structure(child, f"{prefix}{index}.", sections)
+                           for index, child in enumerate(part.get_payload(), 1))
+        return f'({children} "{part.get_content_subtype().upper()}" ("BOUNDARY" "{part.get_boundary()}") NIL NIL NIL)'
+
+    body = part.get_payload().encode("ascii", errors="replace")
+    if sections is not None:
+        sections[prefix[:-1] or "1"] = body
+    main_type = part.get_content_maintype().upper()
+    params = " ".join(f'"{name.upper()}" "{value}"' for name, value in (part.get_params() or [])[1:])
+    encoding = (part.get("Content-Transfer-Encoding") or "7bit").upper()
+    lines = f" {body.count(NEWLINE)}" if main_type == "TEXT" else ""
+    disposition = "NIL"
+    if part.get_content_disposition():
+        filename = part.get_filename()
+        disposition_params = f'("FILENAME" "{filename}")' if filename else "NIL"
+        disposition = f'("{part.get_content_disposition().upper()}" {disposition_params})'
+    return (f'("{main_type}" "{part.get_content_subtype().upper()}" {f"({params})" if params else "NIL"} NIL NIL '
+            f'"{encoding}" {len(body)}{lines} NIL {disposition} NIL NIL)')
+
+
+class Mailbox:
+    def __init__(self):
+        self.messages = []  # по порядку номеров: {"uid", "raw", "flags", "date", "structure", "sections"}
+        self.next_uid = 1
+        self.selects = 0  # сколько раз клиенты открывали ящик — признак, что сборщик подключился
+        self.lock = threading.Lock()
+
+    def append(self, raw, when=None):
+        message = email.message_from_bytes(raw)
+        sections = {}
+        structure = body_structure(message, sections=sections)
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append({"uid": uid, "raw": raw, "flags": set(), "date": when or time.time(),
+                                  "structure": structure, "sections": sections})
+        return uid
+
+    def __len__(self):
+        with self.lock:
+            return len(self.messages)
+
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.connections.add(self.request)
+        self.known = 0
+
+    def finish(self):
+        self.server.connections.discard(self.request)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send(self, data):
+        self.wfile.write(data.encode() if isinstance(data, str) else data)
+        self.wfile.flush()
+
+    def handle(self):
+        if self.server.outage:
+            return
+        try:
+            self.send("* OK [CAPABILITY IMAP4rev1 IDLE] bench IMAP ready\r\n")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                tag, _, rest = line.decode(errors="replace").strip().partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                if command == "UID":
+                    command, _, args = args.partition(" ")
+                    command = "UID " + command.upper()
+                if not self.command(tag, command, args):
+                    return
+        except OSError:
+            return
+
+    def exists(self):
+        count = len(self.server.mailbox)
+        if count != self.known:
+            self.known = count
+            self.send(f"* {count} EXISTS\r\n")
+
+    def command(self, tag, command, args):
+        mailbox = self.server.mailbox
+        if command == "CAPABILITY":
+            self.send(f"* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK CAPABILITY completed\r\n")
+        elif command == "LOGIN":
+            self.send(f"{tag} OK LOGIN completed\r\n")
+        elif command in ("SELECT", "EXAMINE"):
+            with mailbox.lock:
+                mailbox.selects += 1
+                self.known = len(mailbox.messages)
+                next_uid = mailbox.next_uid
+            self.send(f"* {self.known} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"* OK [UIDNEXT {next_uid}] next UID\r\n{tag} OK [READ-WRITE] SELECT completed\r\n")
+        elif command in ("NOOP", "CHECK"):
+            self.exists()
+            self.send(f"{tag} OK {command} completed\r\n")
+        elif command == "UID SEARCH":
+            with mailbox.lock:
+                uids = [str(m["uid"]) for m in mailbox.messages
+                        if "UNSEEN" not in args.upper() or "\\Seen" not in m["flags"]]
+            self.send(f"* SEARCH{''.join(' ' + uid for uid in uids)}\r\n{tag} OK SEARCH completed\r\n")
+        elif command == "UID FETCH":
+            uid_set, _, items = args.partition(" ")
+            self.fetch(tag, uid_set, ITEM_RE.findall(items))
+        elif command == "UID STORE":
+            uid_set, _, rest = args.partition(" ")
+            mode, _, flags = rest.partition(" ")
+            flags = set(flags.strip("()").split())
+            with mailbox.lock:
+                uids = parse_uid_set(uid_set, mailbox.next_uid - 1)
+                for message in mailbox.messages:
+                    if message["uid"] in uids:
+                        if mode.upper().startswith("-"):
+                            message["flags"] -= flags
+                        else:
+                            message["flags"] |= flags
+            self.send(f"{tag} OK STORE completed\r\n")
+        elif command == "EXPUNGE":
+            with mailbox.lock:
+                removed = [n for n, m in enumerate(mailbox.messages, 1) if "\\Deleted" in m["flags"]]
+                mailbox.messages = [m for m in mailbox.messages if "\\Deleted" not in m["flags"]]
+                self.known = len(mailbox.messages)
+            # по убыванию номеров: каждый EXPUNGE не сдвигает номера следующих
+            self.send("".join(f"* {n} EXPUNGE\r\n" for n in reversed(removed)) + f"{tag} OK EXPUNGE completed\r\n")
+        elif command == "IDLE":
+            self.idle(tag)
+        elif command == "LOGOUT":
+            self.send(f"* BYE bench IMAP\r\n{tag} OK LOGOUT completed\r\n")
+            return False
+        else:
+            self.send(f"{tag} BAD unsupported command\r\n")
+        return True
+
+    def fetch(self, tag, uid_set, items):
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            uids = parse_uid_set(uid_set, mailbox.next_uid - 1)
+            selected = [(n, m) for n, m in enumerate(mailbox.messages, 1) if m["uid"] in uids]
+        out = []
+        for n, message in selected:
+            response = f"* {n} FETCH (UID {message['uid']}".encode()
+            for item in items:
+                name = item.upper()
+                if name == "UID":
+                    continue
+                if name == "INTERNALDATE":
+                    response += f" INTERNALDATE {imaplib.Time2Internaldate(message['date'])}".encode()
+                elif name == "FLAGS":
+                    response += f" FLAGS ({' '.join(sorted(message['flags']))})".encode()
+                elif name == "RFC822.SIZE":
+                    response += f" RFC822.SIZE {len(message['raw'])}".encode()
+                elif name == "BODYSTRUCTURE":
+                    response += f" BODYSTRUCTURE {message['structure']}".encode()
+                elif name == "RFC822":
+                    message["flags"].add("\\Seen")
+                    response += f" RFC822 {{{len(message['raw'])}}}\r\n".encode() + message["raw"]
+                elif name.startswith(("BODY[", "BODY.PEEK[")):
+                    section = name[name.index("[") + 1:-1]
+                    body = message["raw"] if section == "" else message["sections"].get(section, b"")
+                    if not name.startswith("BODY.PEEK"):
+                        message["flags"].add("\\Seen")
+                    response += f" BODY[{section}] {{{len(body)}}}\r\n".encode() + body
+            out.append(response + b")\r\n")
+        self.send(b"".join(out) + f"{tag} OK FETCH completed\r\n".encode())
+
+    def idle(self, tag):
+        # RFC 2177: о новых письмах сообщаем сразу, выходим по DONE
+        self.send("+ idling\r\n")
+        while True:
+            if self.server.outage:
+                raise OSError("outage")
+            self.exists()
+            if select.select([self.request], [], [], IDLE_POLL)[0]:
+                line = self.rfile.readline()
+                if not line:
+                    raise OSError("connection closed")
+                if line.strip().upper() == b"DONE":
+                    self.send(f"{tag} OK IDLE terminated\r\n")
+                    return
+
+
+class ImapStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), ImapHandler)
+        self.mailbox = Mailbox()
+        self.connections = set()
+        self._outage = False
+
+    @property
+    def outage(self):
+        return self._outage
+
+    @outage.setter
+    def outage(self, value):
+        # недоступность ящика: открытые соединения обрываются, новые закрываются сразу
+        self._outage = value
+        if value:
+            for connection in list(self.connections):
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def send(self, text):
+        self.wfile.write(f"{text}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            self.send("220 bench SMTP ready")
+            recipients = []
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command, _, args = line.decode(errors="replace").strip().partition(" ")
+                command = command.upper()
+                if command == "EHLO":
+                    self.send("250-bench\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 52428800")
+                elif command == "HELO":
+                    self.send("250 bench")
+                elif command == "AUTH":
+                    mechanism, _, initial = args.partition(" ")
+                    if mechanism.upper() == "LOGIN":
+                        for prompt in ("VXNlcm5hbWU6", "UGFzc3dvcmQ6"):
+                            self.send(f"334 {prompt}")
+                            self.rfile.readline()
+                    elif not initial:
+                        self.send("334 ")
+                        self.rfile.readline()
+                    self.send("235 2.7.0 Authentication successful")
+                elif command == "MAIL":
+                    if self.server.outage:
+                        self.send("451 4.3.0 Temporary failure")
+                        continue
+                    recipients = []
+                    self.send("250 2.1.0 OK")
+                elif command == "RCPT":
+                    recipients.append(args.partition(":")[2].strip().strip("<>"))
+                    self.send("250 2.1.5 OK")
+                elif command == "DATA":
+                    self.send("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data_line = self.rfile.readline()
+                        if not data_line or data_line in (b".\r\n", b".\n"):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    self.server.receive(recipients, b"".join(lines))
+                    self.send("250 2.0.0 OK queued")
+                elif command in ("RSET", "NOOP"):
+                    self.send("250 2.0.0 OK")
+                elif command == "QUIT":
+                    self.send("221 2.0.0 Bye")
+                    return
+                else:
+                    self.send("502 5.5.2 Command not recognized")
+        except OSError:
+            return
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), SmtpHandler)
+        self.outage = False
+        self.received = []  # (время, получатели, тема, имена вложений)
+        self.lock = threading.Lock()
+
+    def receive(self, recipients, data):
+        received_at = time.time()
+        message = email.message_from_bytes(data)
+        filenames = [part.get_filename() for part in message.walk() if part.get_filename()]
+        with self.lock:
+            self.received.append((received_at, list(recipients), message.get("Subject", ""), filenames))
+
+
+def parse_form(content_type, body):
+    # тело POST от requests -> (поля, файлы)
+    if content_type.startswith("multipart/form-data"):
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        fields = {}
+        files = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is not None:
+                files[name] = part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_payload(decode=True).decode("utf-8", errors="replace")
+        return fields, files
+    return {name: values[0] for name, values in parse_qs(body.decode()).items()}, {}
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего Bot API
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        if server.outage:
+            self.reply(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+            return
+        method = self.path.rsplit("/", 1)[-1]
+        fields, files = parse_form(self.headers.get("Content-Type", ""), body)
+        chat_id = fields.get("chat_id")
+        if method == "sendPhoto":
+            captions = [fields.get("caption", "")]
+            result = server.message(chat_id, fields.get("photo") if "photo" not in files else None)
+        elif method == "sendMediaGroup":
+            media = json.loads(fields.get("media", "[]"))
+            captions = [item.get("caption", "") for item in media]
+            result = [server.message(chat_id, None if item["media"].startswith("attach://") else item["media"])
+                      for item in media]
+        elif method == "sendMessage":
+            captions = [fields.get("text", "")]
+            result = server.message(chat_id, None, photo=False)
+        else:
+            self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+            return
+        server.record(method, chat_id, captions, len(files))
+        self.reply(200, {"ok": True, "result": result})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        super().__init__((host, port), TelegramHandler)
+        self.delay = delay
+        self.outage = False
+        self.received = []  # (время, метод, чат, подписи, загружено файлов)
+        self.lock = threading.Lock()
+        self._message_id = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def message(self, chat_id, file_id, photo=True):
+        # file_id из запроса возвращается как есть, загруженному фото выдаётся новый
+        with self.lock:
+            self._message_id += 1
+            message_id = self._message_id
+        result = {"message_id": message_id, "chat": {"id": chat_id}, "date": int(time.time())}
+        if photo:
+            result["photo"] = [{"file_id": file_id or f"bench-photo-{message_id}", "width": 1280, "height": 720}]
+        return result
+
+    def record(self, method, chat_id, captions, uploads):
+        with self.lock:
+            self.received.append((time.time(), method, chat_id, captions, uploads))
+
+class SyntheticBackend:
+    # заменитель модели детектора (INFER_BACKEND=bench_standins:SyntheticBackend): «машины» — насыщенные
+    # по цвету прямоугольники на сером фоне синтетических кадров, проход занимает INFER_SYNTHETIC_MS на кадр
+    name = "synthetic"
+    names = {0: "person", 1: "bicycle", 2: "car", 3: "motorcycle", 4: "airplane", 5: "bus", 6: "train", 7: "truck", 8: "boat"}
+    scale = 4  # поиск пятен на уменьшенном кадре
+    min_area = 64  # пикселей уменьшенного кадра
+
+    def __init__(self, imgsz=640, delay_ms=INFER_SYNTHETIC_MS):
+        self.imgsz = imgsz
+        self.delay = delay_ms / 1000
+
+    def predict(self, frames, imgsz=None):
+        started = time.perf_counter()
+        outputs = []
+        for frame in frames:
+            small = cv2.resize(frame, (frame.shape[1] // self.scale, frame.shape[0] // self.scale),
+                               interpolation=cv2.INTER_AREA)
+            hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+            mask = ((hsv[:, :, 1] > 150) & (hsv[:, :, 2] > 80)).astype(np.uint8)
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+            stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+            xyxy = np.empty((len(stats), 4), dtype=np.float32)
+            xyxy[:, :2] = stats[:, :2] * self.scale
+            xyxy[:, 2:] = (stats[:, :2] + stats[:, 2:4]) * self.scale
+            outputs.append((np.full(len(stats), 2, dtype=np.intp), np.full(len(stats), 0.9, dtype=np.float32), xyxy))
+        remaining = self.delay * len(frames) - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        return outputs
+
+
+def start(server, name):
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,174 @@
+import os
+import time
+import fcntl
+import socket
+import threading
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+PROCESSING = os.path.join(DATA_DIR, "processing")  # файлы, взятые обработчиками: PROCESSING/<id обработчика>/
+HEARTBEAT_INTERVAL = float(os.getenv("CLAIM_HEARTBEAT_INTERVAL", "10"))
+CLAIM_STALE_AFTER = float(os.getenv("CLAIM_STALE_AFTER", "120"))  # обработчик без пульса дольше — считается упавшим
+HEARTBEAT_FILE = ".heartbeat"
+LEADER_LOCK = ".leader.lock"
+# -----------------
+
+
+def worker_name(index=0):
+    # имя стабильно между перезапусками контейнера, поэтому свои незавершённые файлы находятся сразу
+    return f"{socket.gethostname()}-{index}"
+
+
+def return_files(directory, inbox):
+    # вернуть в INBOX всё, что лежит в папке обработчика; -> сколько файлов возвращено
+    returned = 0
+    try:
+        with os.scandir(directory) as entries:
+            names = [entry.name for entry in entries if entry.is_file() and entry.name != HEARTBEAT_FILE]
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        try:
+            os.rename(os.path.join(directory, name), os.path.join(inbox, name))
+            returned += 1
+        except FileNotFoundError:
+            pass  # файл уже вернул другой обработчик
+    return returned
+
+
+# файл из INBOX берётся переименованием в личную папку обработчика: rename атомарен
+# в пределах одной файловой системы, поэтому из нескольких обработчиков файл получает ровно один
+class WorkerClaims:
+    def __init__(self, worker_id, inbox, root=PROCESSING):
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.directory = os.path.join(root, worker_id)
+        self.heartbeat_path = os.path.join(self.directory, HEARTBEAT_FILE)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        returned = return_files(self.directory, self.inbox)
+        if returned:
+            print(f"[!] {self.worker_id}: {returned} незавершённых файлов возвращено в {self.inbox}.")
+        self.beat()
+        self._thread = threading.Thread(target=self._run, name="claim-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def beat(self):
+        # папку могло убрать восстановление, если процесс надолго замирал
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.heartbeat_path, "a"):
+            pass
+        os.utime(self.heartbeat_path)
+
+    def claim(self, path):
+        # -> новый путь файла или None, если его уже взял другой обработчик
+        target = os.path.join(self.directory, os.path.basename(path))
+        for attempt in range(2):
+            try:
+                os.rename(path, target)
+                return target
+            except FileNotFoundError:
+                if attempt or not os.path.exists(path):
+                    return None
+                self.beat()
+
+    def release(self, path):
+        # вернуть взятый файл в INBOX (ошибка обработки), если он ещё не перемещён дальше
+        try:
+            os.rename(path, os.path.join(self.inbox, os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except OSError as e:
+                print(f"[-] {self.worker_id}: не удалось обновить пульс: {e}")
+
+
+def recover_stale_claims(inbox, root=PROCESSING, stale_after=CLAIM_STALE_AFTER, now=None):
+    # файлы упавших обработчиков (пульс старше stale_after) возвращаются в INBOX
+    now = time.time() if now is None else now
+    try:
+        with os.scandir(root) as entries:
+            directories = [entry.path for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    for directory in directories:
+        heartbeat = os.path.join(directory, HEARTBEAT_FILE)
+        try:
+            beat = os.stat(heartbeat if os.path.exists(heartbeat) else directory).st_mtime
+        except FileNotFoundError:
+            continue
+        if now - beat < stale_after:
+            continue
+        returned = return_files(directory, inbox)
+        if returned:
+            print(f"[!] Обработчик {os.path.basename(directory)} не отвечает, {returned} файлов возвращено в {inbox}.")
+        try:
+            os.remove(os.path.join(directory, HEARTBEAT_FILE))
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # обработчик ожил и успел взять новый файл
+
+
+# ведущий процесс среди детекторов на общем /data: возвращает файлы упавших обработчиков и
+# выполняет разовые задачи (повтор очереди Telegram). Блокировка снимается ядром при смерти
+# процесса, и роль переходит к следующему
+class ClaimMaintenance:
+    def __init__(self, inbox, on_leader=None, root=PROCESSING, interval=HEARTBEAT_INTERVAL):
+        self.inbox = inbox
+        self.on_leader = on_leader
+        self.root = root
+        self.interval = interval
+        self.leader = False
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="claim-maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def try_lead(self):
+        lock_file = open(os.path.join(self.root, LEADER_LOCK), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.leader = True
+        print("[*] Процесс стал ведущим: восстановление файлов и очередь Telegram.")
+        if self.on_leader is not None:
+            self.on_leader()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.leader or self.try_lead():
+                    recover_stale_claims(self.inbox, self.root)
+            except OSError as e:
+                print(f"[-] Ошибка обслуживания {self.root}: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+DEDUP_HASH = os.getenv("DEDUP_HASH", "phash").lower()  # phash или dhash
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "4"))  # макс. расстояние Хэмминга между хешами дубликатов
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "600"))  # сколько секунд кадр считается «недавним»
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "2000"))  # хешей на камеру, сверх — вытесняются самые старые
+DEDUP_STATE = os.path.join(DATA_DIR, "dedup-index.json")
+# -----------------
+
+
+def phash(gray):
+    # перцептивный хеш: знаки низкочастотных DCT-коэффициентов относительно медианы -> 64-битное число
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dhash(gray):
+    # разностный хеш: знак градиента по горизонтали на сетке 9x8
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+# multi-index hashing: 64 бита делятся на max_distance + 1 сегментов. Если хеши отличаются
+# не больше чем на max_distance бит, хотя бы один сегмент совпадает точно (принцип Дирихле),
+# поэтому кандидаты ищутся по точному совпадению сегментов, а не перебором всех хешей
+class HashIndex:
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        count = min(max_distance + 1, 64)
+        bounds = [round(i * 64 / count) for i in range(count + 1)]
+        self.segments = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.segments]
+        self.entries = OrderedDict()  # хеш -> время первого появления, от старых к новым
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _keys(self, value):
+        for table, (shift, mask) in zip(self.tables, self.segments):
+            yield table, (value >> shift) & mask
+
+    def find(self, value):
+        # ближайший хеш в пределах max_distance или None
+        best = None
+        best_distance = self.max_distance + 1
+        for table, key in self._keys(value):
+            for candidate in table.get(key, ()):
+                distance = (candidate ^ value).bit_count()
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def add(self, value, timestamp):
+        # время первого появления сохраняется: хеш уходит из индекса через окно после него
+        if value in self.entries:
+            return
+        for table, key in self._keys(value):
+            table.setdefault(key, set()).add(value)
+        self.entries[value] = timestamp
+
+    def remove(self, value):
+        if self.entries.pop(value, None) is None:
+            return
+        for table, key in self._keys(value):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[key]
+
+    def evict(self, oldest_allowed, max_entries):
+        while self.entries:
+            value, timestamp = next(iter(self.entries.items()))
+            if timestamp >= oldest_allowed and len(self.entries) <= max_entries:
+                break
+            self.remove(value)
+
+
+# индекс недавних кадров по камерам, переживает перезапуск сборщика почты
+class DuplicateIndex:
+    def __init__(self, path=DEDUP_STATE, window=DEDUP_WINDOW, max_entries=DEDUP_MAX_ENTRIES,
+                 max_distance=DEDUP_MAX_DISTANCE, hash_name=DEDUP_HASH):
+        self.path = path
+        self.window = window
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hash_name = hash_name
+        self.hash_function = HASH_FUNCTIONS.get(hash_name, phash)
+        self.cameras = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def _camera(self, camera_name):
+        if camera_name not in self.cameras:
+            self.cameras[camera_name] = HashIndex(self.max_distance)
+        return self.cameras[camera_name]
+
+    def frame_hash(self, gray):
+        return self.hash_function(gray)
+
+    def find(self, camera_name, value, pending=(), now=None):
+        # похожий хеш этой камеры в окне DEDUP_WINDOW или среди pending (ещё не записанные кадры того же
+        # письма) -> найденный хеш или None. Индекс не пополняется: это делает commit после сохранения
+        now = time.time() if now is None else now
+        for other in pending:
+            if (other ^ value).bit_count() <= self.max_distance:
+                return other
+        with self._lock:
+            index = self._camera(camera_name)
+            index.evict(now - self.window, self.max_entries)
+            return index.find(value)
+
+    def commit(self, camera_name, values, now=None):
+        # хеши сохранённых кадров. Повтор сцены окно не продлевает: статичная сцена снова
+        # дойдёт до детектора через DEDUP_WINDOW после первого кадра
+        now = time.time() if now is None else now
+        with self._lock:
+            index = self._camera(camera_name)
+            for value in values:
+                index.add(value, now)
+            self.dirty = True
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[-] Не удалось загрузить индекс дубликатов {self.path}: {e}")
+            return
+        if state.get("hash") != self.hash_name:
+            return
+        oldest_allowed = time.time() - self.window
+        for camera_name, entries in state.get("cameras", {}).items():
+            index = self._camera(camera_name)
+            for value, timestamp in entries:
+                if timestamp >= oldest_allowed:
+                    index.add(int(value, 16), timestamp)
+            index.evict(oldest_allowed, self.max_entries)
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            state = {
+                "hash": self.hash_name,
+                "cameras": {camera_name: [[f"{value:016x}", timestamp] for value, timestamp in index.entries.items()]
+                            for camera_name, index in self.cameras.items()},
+            }
+            self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[-] Не удалось сохранить индекс дубликатов {self.path}: {e}")
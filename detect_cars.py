@@ -1,10 +1,29 @@
 import os
 import time
 import shutil
+import signal
+import sqlite3
+import logging
+import threading
+import multiprocessing
 import cv2
-import requests
-import json
-from ultralytics import YOLO
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+from inference_backend import load_backend, warmup, MODEL_WEIGHTS, INFER_INT8, CALIBRATION_DIR
+from roi import roi_plan
+from motion_gate import MotionGate, MOTION_GATE, MOTION_MIN_AREA
+from inbox_watcher import InboxWatcher
+from claims import WorkerClaims, ClaimMaintenance, worker_name, PROCESSING
+from detection_store import DetectionStore, DETECTION_CACHE, content_digest, settings_fingerprint
+from telegram_notify import send_telegram_event, pending_jobs, close_dispatcher, TelegramQueueWorker, TELEGRAM_QUEUE
+from notify_coalescer import NotificationCoalescer
+from object_tracker import ObjectTracker, OBJECT_TRACKING
+from storage import shard_path, StorageMaintenance
+from metrics import (start_metrics, count_files, METRICS_PORT, STAGE_SECONDS, IMAGES_PROCESSED, ALERTS_SUPPRESSED,
+                     NOTIFICATIONS, INBOX_DEPTH, TELEGRAM_QUEUE_DEPTH, NOTIFY_PENDING)
+
+log = logging.getLogger("detect_cars")
 
 # --- Пороговые значения по классам ---
 # Ключ = ID класса YOLO, значение = минимальный порог уверенности
@@ -21,20 +40,25 @@ DEFAULT_CONFIDENCE = 0.3  # fallback для классов без явного 
 
 # --- попытка импортировать почтовый модуль ---
 try:
-    from mailer import send_mail
+    from mailer import queue_mail, get_outbox
 except ImportError:
-    def send_mail(subject, body, recipients=None, attachments=None):
+    get_outbox = None
+
+    def queue_mail(subject, body, recipients=None, attachments=None, send=True):
         print(f"[!] Почтовый модуль не найден. Письмо '{subject}' не отправлено.")
         return
 
 # --- НАСТРОЙКИ TELEGRAM ---
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GENERAL_CHAT_ID = os.getenv("GENERAL_CHAT_ID")
 
 # --- КОНФИГУРАЦИЯ КАМЕР ---
+# "roi" — зоны интереса (прямоугольники [x1, y1, x2, y2] или многоугольники [[x, y], ...],
+# в долях кадра или в пикселях), модель видит только их; "imgsz" — размер входа модели для камеры.
 CAMERA_SETTINGS = {
     "vorota1": {
         "desired_classes": [1, 2, 3, 5, 6, 7, 8],
+#        "roi": [[0.2, 0.35, 0.9, 1.0]],
+#        "imgsz": 480,
         "send_email": False,
         "email_receivers": [os.getenv("GENERAL_EMAIL")],
         "send_telegram": True,
@@ -50,6 +74,8 @@ CAMERA_SETTINGS = {
     },
     "vorota3": {
         "desired_classes": [0, 2, 5],
+#        "roi": [[[0.0, 0.5], [0.6, 0.3], [1.0, 0.45], [1.0, 1.0], [0.0, 1.0]]],
+#        "imgsz": 480,
 #        "send_email": False,
         "email_receivers": [],
         "send_telegram": False,
@@ -72,166 +98,490 @@ print("EMAIL_RECEIVER_2:", os.getenv("EMAIL_RECEIVER_2"))
 
 
 # --- Папки ---
-INBOX = "/data/inbox"
-FILTERED = "/data/filtered"
-REJECTED = "/data/rejected"
-TELEGRAM_QUEUE = "/data/telegram-queue"
-
-for folder in [INBOX, FILTERED, REJECTED, TELEGRAM_QUEUE]:
+# общий том fetcher и detector; другой каталог — для локального прогона без контейнеров
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+INBOX = os.path.join(DATA_DIR, "inbox")
+# кадры раскладываются по камерам и дням: <папка>/<камера>/<ГГГГ-ММ-ДД>/ (storage.py)
+FILTERED = os.path.join(DATA_DIR, "filtered")
+REJECTED = os.path.join(DATA_DIR, "rejected")
+SKIPPED = os.path.join(DATA_DIR, "skipped")  # кадры без изменений сцены, модель их не видела
+
+# --- Пакетная обработка ---
+# сколько файлов из INBOX прогонять через YOLO за один проход
+BATCH_SIZE = max(int(os.getenv("DETECT_BATCH_SIZE", "4")), 1)
+# сколько секунд ждать добора пакета, если файлов меньше BATCH_SIZE
+BATCH_WAIT = float(os.getenv("DETECT_BATCH_WAIT", "2"))
+# пакет уходит в модель, как только очередь молчит столько секунд (кадры одного письма приходят подряд)
+BATCH_IDLE = float(os.getenv("DETECT_BATCH_IDLE", "0.2"))
+# сколько процессов-обработчиков со своей моделью запускать в контейнере. Уведомления объединяются
+# внутри процесса: если кадры одного письма разобрали разные обработчики, альбомов будет несколько
+DETECT_WORKERS = max(int(os.getenv("DETECT_WORKERS", "1")), 1)
+# сколько ждать обработчики при остановке (отправка накопленных уведомлений)
+WORKER_STOP_TIMEOUT = 20
+
+for folder in [INBOX, FILTERED, REJECTED, SKIPPED, TELEGRAM_QUEUE, PROCESSING]:
     os.makedirs(folder, exist_ok=True)
 
-# --- инициализация YOLO ---
-model = YOLO("yolov8m.pt")
+# --- YOLO загружается один раз в каждом процессе-обработчике (бэкенд выбирается через INFER_BACKEND) ---
+model = None
+THRESHOLD_LUT = None
+
+
+def init_model(calibration_dir=CALIBRATION_DIR):
+    global model, THRESHOLD_LUT
+    if model is not None:
+        return model
+    model = load_backend(calibration_dir=calibration_dir)
+    warmup(model)
+    for camera_imgsz in {s["imgsz"] for s in CAMERA_SETTINGS.values() if s.get("imgsz")} - {model.imgsz}:
+        warmup(model, camera_imgsz)
 
-# =============================
-def send_telegram_notification(photo_path, camera_name, event_date, event_time, detected_labels, chat_ids):
-    if not TELEGRAM_BOT_TOKEN or not chat_ids:
-        print(f"[-] Ошибка: токен или ID чатов для камеры {camera_name} не настроены.")
-        return
+    # таблица порогов по ID класса: один векторный lookup вместо dict.get на каждый бокс
+    THRESHOLD_LUT = np.full(len(model.names), DEFAULT_CONFIDENCE, dtype=np.float32)
+    for cls_id, threshold in CLASS_THRESHOLDS.items():
+        if cls_id < len(THRESHOLD_LUT):
+            THRESHOLD_LUT[cls_id] = threshold
+    return model
+
+
+FRAME_COLOR = (0, 255, 200)
+LINE_THICKNESS = 1
+
+# результат детекции одного кадра: оставленные боксы и готовый аннотированный JPEG
+# digest — хеш содержимого кадра, cached — результат взят из индекса детекций без прохода модели
+Detection = namedtuple("Detection", ["found", "boxes", "classes", "confidences", "labels", "annotated", "skipped",
+                                     "digest", "cached"], defaults=[False, None, False])
+NOT_FOUND = Detection(False, None, None, None, [], None)
+UNCHANGED = NOT_FOUND._replace(skipped=True)
+
+# --- детектор изменений сцены перед YOLO (MOTION_GATE) ---
+motion_gate = MotionGate() if MOTION_GATE else None
+
+# --- треки объектов: о машине, стоящей на прежнем месте, повторно не уведомляем ---
+tracker = ObjectTracker() if OBJECT_TRACKING else None
+
+# --- индекс детекций (SQLite), открывается в каждом обработчике ---
+detection_store = None
+
+
+def get_detection_store():
+    global detection_store
+    if detection_store is None:
+        detection_store = DetectionStore()
+    return detection_store
+
+def parse_filename(filename):
+    # имя файла: camera_date_time_index.ext
+    parts = filename.split('_')
+    if len(parts) < 4:
+        return None
+    return parts[0], parts[1], parts[2]
+
+
+@lru_cache(maxsize=None)
+def desired_lut(desired_classes):
+    lut = np.zeros(len(THRESHOLD_LUT), dtype=bool)
+    for cls_id in desired_classes:
+        if 0 <= cls_id < len(lut):
+            lut[cls_id] = True
+    return lut
+
+
+def load_frame(path):
+    # кадр декодируется один раз и дальше идёт и в модель, и в аннотацию; -> (кадр, хеш содержимого)
+    with STAGE_SECONDS.time(stage="decode"):
+        with open(path, "rb") as f:
+            data = f.read()
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), content_digest(data)
+
+
+def class_label(cls_id):
+    return model.names.get(int(cls_id), f"class_{cls_id}")
+
+
+def unique_labels(classes):
+    # метки в порядке первого появления, без повторов
+    _, first_index = np.unique(classes, return_index=True)
+    return [class_label(cls_id) for cls_id in classes[np.sort(first_index)]]
+
+
+def run_model(frames, settings_list):
+    # кадры режутся по зонам интереса камер, вырезы группируются по imgsz камеры:
+    # один прямой проход на группу -> по каждому кадру массивы (cls, conf, xyxy) в координатах кадра
+    plans = []
+    groups = {}
+    for n, (frame, settings) in enumerate(zip(frames, settings_list)):
+        plan = roi_plan(settings, frame.shape[1], frame.shape[0])
+        plans.append(plan)
+        crops = plan.crops(frame) if plan else [(frame, (0, 0))]
+        groups.setdefault(settings.get("imgsz", model.imgsz), []).extend((n, crop, offset) for crop, offset in crops)
+
+    pieces = [[] for _ in frames]
+    for imgsz, group in groups.items():
+        results = model.predict([crop for _, crop, _ in group], imgsz)
+        for (n, _, offset), result in zip(group, results):
+            pieces[n].append((result, offset))
+
+    outputs = []
+    for plan, frame_pieces in zip(plans, pieces):
+        results, offsets = zip(*frame_pieces)
+        outputs.append(plan.merge(results, offsets) if plan else results[0])
+    return outputs
+
+
+def filter_detections(classes, confidences, xyxy, camera_settings):
+    desired = desired_lut(tuple(camera_settings.get("desired_classes", [])))
+    mask = desired[classes] & (confidences >= THRESHOLD_LUT[classes])
+    if not mask.any():
+        return NOT_FOUND
+
+    kept_classes = classes[mask]
+    return Detection(True, xyxy[mask].astype(np.int32), kept_classes, confidences[mask], unique_labels(kept_classes), None)
+
+
+def annotate_frame(frame, boxes, ext):
+    with STAGE_SECONDS.time(stage="annotate"):
+        for x1, y1, x2, y2 in boxes.tolist():
+            cv2.rectangle(frame, (x1, y1), (x2, y2), FRAME_COLOR, LINE_THICKNESS)
+        ok, buffer = cv2.imencode(ext or ".jpg", frame)
+    return buffer.tobytes() if ok else None
+
+
+def gate_frame(camera_name, frame, settings):
+    # решение детектора изменений; в зоне интереса камеры, если она задана
+    plan = roi_plan(settings, frame.shape[1], frame.shape[0])
+    return motion_gate.check(camera_name, frame, plan.bounds if plan else None,
+                             settings.get("motion_min_area", MOTION_MIN_AREA))
 
-    telegram_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-    caption = f"*{camera_name}*: {', '.join(detected_labels)}\n`{event_date} {event_time.replace('-', ':')}`"
 
-    for chat_id in chat_ids:
+def detection_fingerprint(settings):
+    # всё, от чего зависит результат кадра: модель, пороги и настройки камеры для детекции
+    return settings_fingerprint({
+        "backend": model.name, "weights": MODEL_WEIGHTS, "int8": INFER_INT8 and model.name != "pytorch",
+        "thresholds": CLASS_THRESHOLDS, "default_confidence": DEFAULT_CONFIDENCE,
+        "imgsz": settings.get("imgsz", model.imgsz), "desired_classes": sorted(settings.get("desired_classes", [])),
+        "roi": settings.get("roi"), "tiles": settings.get("tiles"),
+    })
+
+
+def cached_detection(camera_name, settings, digest, frame, ext):
+    try:
+        cached = get_detection_store().lookup(digest, camera_name, detection_fingerprint(settings))
+    except sqlite3.Error as e:
+        print(f"[-] Ошибка чтения индекса детекций: {e}")
+        return None
+    if cached is None:
+        return None
+    found, classes, confidences, boxes, labels = cached
+    if not found:
+        return NOT_FOUND._replace(digest=digest, cached=True)
+    return Detection(True, boxes, classes, confidences, labels, annotate_frame(frame, boxes, ext), False, digest, True)
+
+
+def store_detections(jobs, detections):
+    # результаты прохода модели по пакету — одной транзакцией; кадры из кеша и пропущенные не пишутся
+    records = []
+    for (filename, _, camera_name, event_date, event_time, settings), detection in zip(jobs, detections):
+        if detection.digest is None or detection.cached or detection.skipped:
+            continue
+        box_labels = [class_label(cls_id) for cls_id in detection.classes] if detection.found else []
+        records.append((detection.digest, camera_name, detection_fingerprint(settings), event_date, event_time,
+                        filename, detection.found,
+                        detection.labels, detection.classes, detection.confidences, detection.boxes, box_labels))
+    if not records:
+        return
+    try:
+        get_detection_store().add_many(records)
+    except sqlite3.Error as e:
+        print(f"[-] Ошибка записи в индекс детекций: {e}")
+
+
+def detect_batch(image_paths, settings_list, camera_names=None):
+    # пороги камер применяются к каждому кадру отдельно после общего прохода модели;
+    # с camera_names уже виденные кадры берутся из индекса детекций, а кадры без изменений
+    # сцены пропускаются мимо модели (кроме выборочной проверки)
+    detections = [NOT_FOUND] * len(image_paths)
+    frames = []
+    indices = []
+    digests = {}
+    gate_records = {}
+    for i, path in enumerate(image_paths):
         try:
-            with open(photo_path, "rb") as photo_file:
-                files = {'photo': photo_file}
-                data = {
-                    'chat_id': chat_id,
-                    'caption': caption,
-                    'parse_mode': 'Markdown'
-                }
-                response = requests.post(telegram_api_url, files=files, data=data)
-                if response.status_code == 200:
-                    print(f"[+] Уведомление для {camera_name} отправлено в чат {chat_id}.")
-                else:
-                    print(f"[-] Ошибка Telegram ({chat_id}): {response.text}")
-                    save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, [chat_id])
-        except Exception as e:
-            print(f"[-] Ошибка Telegram ({chat_id}): {e}")
-            save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, [chat_id])
-
-# ========================
-def save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, chat_ids):
-    queue_file_name = f"{os.path.basename(photo_path)}_{int(time.time())}.json"
-    queue_file_path = os.path.join(TELEGRAM_QUEUE, queue_file_name)
-
-    data_to_save = {
-        "photo_path": photo_path,
-        "camera_name": camera_name,
-        "event_date": event_date,
-        "event_time": event_time,
-        "detected_labels": detected_labels,
-        "chat_ids": chat_ids
-    }
+            frame, digest = load_frame(path)
+        except OSError as e:
+            print(f"[-] Ошибка чтения {path}: {e}")
+            continue
+        if frame is None:
+            print(f"[-] Не удалось декодировать изображение {path}.")
+            continue
+        digests[i] = digest
+        if DETECTION_CACHE and camera_names is not None:
+            cached = cached_detection(camera_names[i], settings_list[i], digest, frame, os.path.splitext(path)[1])
+            if cached is not None:
+                log.debug("[*] %s: кадр уже обрабатывался, результат из индекса детекций.", os.path.basename(path))
+                detections[i] = cached
+                continue
+        if motion_gate is not None and camera_names is not None:
+            record = gate_frame(camera_names[i], frame, settings_list[i])
+            record["file"] = os.path.basename(path)
+            gate_records[i] = record
+            if not record["changed"] and not record["audit"]:
+                detections[i] = UNCHANGED
+                continue
+        frames.append(frame)
+        indices.append(i)
 
-    with open(queue_file_path, 'w') as f:
-        json.dump(data_to_save, f)
+    infer_frames(image_paths, settings_list, detections, frames, indices)
+    for i in indices:
+        detections[i] = detections[i]._replace(digest=digests[i])
 
-    print(f"[!] Уведомление сохранено в очередь: {queue_file_path}")
+    # журнал решений: по "found" у проверенных моделью кадров считаются пропущенные события
+    for i, record in gate_records.items():
+        if record["changed"] or record["audit"]:
+            record["found"] = detections[i].found
+            if not record["changed"] and detections[i].found:
+                print(f"[!] Выборочная проверка: на неизменившемся кадре {record['file']} найдены объекты.")
+        motion_gate.log(camera_names[i], record)
+    return detections
 
 
-def has_desired_objects(image_path, camera_settings):
+def infer_frames(image_paths, settings_list, detections, frames, indices):
+    if not frames:
+        return
+
     try:
-        results = model(image_path, conf=0.1, imgsz=640)  # базовый очень низкий порог
-        desired_classes = camera_settings.get("desired_classes", [])
-        found_objects = False
-        detected_labels = []
-
-        for r in results:
-            for box in r.boxes:
-                cls_id = int(box.cls[0].item())
-                conf = float(box.conf[0].item())
-                threshold = CLASS_THRESHOLDS.get(cls_id, DEFAULT_CONFIDENCE)
-
-                if cls_id in desired_classes and conf >= threshold:
-                    found_objects = True
-                    label = model.names.get(cls_id, f"class_{cls_id}")
-                    if label not in detected_labels:
-                        detected_labels.append(label)
-
-        return found_objects, results, detected_labels
+        with STAGE_SECONDS.time(stage="inference"):
+            outputs = run_model(frames, [settings_list[i] for i in indices])
     except Exception as e:
-        print(f"[-] Ошибка обработки {image_path}: {e}")
-        return False, None, []
+        if len(frames) == 1:
+            print(f"[-] Ошибка обработки {image_paths[indices[0]]}: {e}")
+            return
+        print(f"[-] Ошибка пакетной обработки ({len(frames)} файлов): {e}. Обрабатываем по одному.")
+        for i, frame in zip(indices, frames):
+            infer_frames(image_paths, settings_list, detections, [frame], [i])
+        return
 
+    for i, frame, (classes, confidences, xyxy) in zip(indices, frames, outputs):
+        detection = filter_detections(classes, confidences, xyxy, settings_list[i])
+        if detection.found:
+            ext = os.path.splitext(image_paths[i])[1]
+            detection = detection._replace(annotated=annotate_frame(frame, detection.boxes, ext))
+        detections[i] = detection
 
-if __name__ == "__main__":
-    print("[*] Запущен мониторинг папки INBOX...")
-    while True:
-        for filename in os.listdir(INBOX):
-            path = os.path.join(INBOX, filename)
-            if not os.path.isfile(path):
+
+def has_desired_objects(image_path, camera_settings):
+    init_model()
+    return detect_batch([image_path], [camera_settings])[0]
+
+
+def collect_batch(watcher):
+    # первый файл ждём из очереди наблюдателя, затем добираем пакет до BATCH_SIZE, пока файлы
+    # идут без пауз дольше BATCH_IDLE, и не дольше BATCH_WAIT секунд: одиночный кадр не ждёт добора
+    path = watcher.get(timeout=1)
+    if path is None:
+        return []
+    batch = [path]
+    deadline = time.monotonic() + BATCH_WAIT
+    while len(batch) < BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        path = watcher.get(timeout=min(remaining, BATCH_IDLE))
+        if path is None:
+            break
+        batch.append(path)
+    return batch
+
+
+def handle_detection(filename, path, camera_name, event_date, event_time, settings, detection):
+    detected_labels = detection.labels
+    if detection.found:
+        name, ext = os.path.splitext(filename)
+        annotated_filename = f"{name}_with_detections{ext}"
+        output_path = shard_path(FILTERED, annotated_filename)
+        if detection.annotated is not None:
+            with open(output_path, "wb") as f:
+                f.write(detection.annotated)
+        else:
+            print(f"[-] Не удалось закодировать аннотированный кадр {filename}, сохраняем оригинал.")
+            shutil.copy(path, output_path)
+        shutil.move(path, shard_path(FILTERED, filename))
+
+        detected_text = ", ".join(set(detected_labels))
+        log.info("[+] Объекты '%s' найдены на %s.", detected_text, camera_name)
+
+        event_key = (camera_name, event_date, event_time)
+        new = tracker.update(camera_name, detection.classes, detection.boxes) if tracker else None
+        if new is not None and not new.any() and not notifier.has(event_key):
+            log.info("[*] Объекты '%s' на %s на прежних местах, уведомление не отправляется.", detected_text, camera_name)
+            ALERTS_SUPPRESSED.inc()
+        elif settings.get("send_email", False) is True or settings.get("send_telegram", False):
+            # кадры одного письма с камеры уходят одним уведомлением (deliver_event); в метках — только новые объекты
+            new_labels = detected_labels if new is None else unique_labels(detection.classes[new])
+            notifier.add(event_key, (output_path, detection.annotated), new_labels, settings)
+
+    elif detection.skipped:
+        shutil.move(path, shard_path(SKIPPED, filename))
+        log.debug("[-] Сцена %s не изменилась, кадр пропущен без детекции.", camera_name)
+
+    else:
+        save_path = shard_path(REJECTED, filename)
+        shutil.move(path, save_path)
+        log.debug("[-] Нет объектов для %s. Файл перемещён.", camera_name)
+
+
+def deliver_event(key, frames, detected_labels, settings):
+    # одно событие камеры: письмо со всеми кадрами и один альбом в каждый чат, метки — объединение по кадрам
+    camera_name, event_date, event_time = key
+    paths = [path for path, _ in frames]
+    detected_text = ", ".join(detected_labels)
+
+    if settings.get("send_email", False) is True:
+         subject = f"Обнаружены объекты на камере (условно): {camera_name}"
+         body = f"{camera_name} условно найдены: {detected_text}."
+         email_receivers = [r for r in settings.get("email_receivers", []) if r and r.strip()]  # Проверяем, что адрес не пустой
+         if email_receivers:
+     # Письмо собирается один раз, каждому получателю уходит отдельный конверт (в фоне)
+            # отправляет ведущий процесс (start_leader_jobs), обработчик только кладёт письмо в спул
+            queue_mail(subject, body, recipients=email_receivers, attachments=paths, send=False)
+            NOTIFICATIONS.inc(channel="email")
+
+    if settings.get("send_telegram", False):
+        telegram_chat_ids = settings.get("telegram_chat_ids")
+        send_telegram_event(frames, camera_name, event_date, event_time, detected_labels, telegram_chat_ids)
+        NOTIFICATIONS.inc(channel="telegram")
+
+
+notifier = NotificationCoalescer(deliver_event)
+
+
+def process_batch(paths, watcher, claims):
+    jobs = []
+    for path in paths:
+        filename = os.path.basename(path)
+        # файл забирается из INBOX в папку обработчика; None — его уже взял другой обработчик
+        claimed = claims.claim(path)
+        watcher.done(path)
+        if claimed is None:
+            continue
+        path = claimed
+        # переименование сохраняет mtime: сколько кадр пролежал в INBOX от записи сборщиком
+        try:
+            STAGE_SECONDS.observe(max(time.time() - os.path.getmtime(path), 0.0), stage="inbox_wait")
+        except OSError:
+            pass
+
+        log.debug("[+] Обнаружен новый файл: %s", filename)
+
+        try:
+            parsed = parse_filename(filename)
+            if parsed is None:
+                print(f"[-] Пропускаем файл с некорректным именем: {filename}")
+                shutil.move(path, shard_path(REJECTED, filename, os.path.getmtime(path)))
+                continue
+
+            camera_name, event_date, event_time = parsed
+            settings = CAMERA_SETTINGS.get(camera_name, CAMERA_SETTINGS["default"])
+            jobs.append((filename, path, camera_name, event_date, event_time, settings))
+        except Exception as e:
+            print(f"[-] Ошибка обработки {path}: {e}")
+            claims.release(path)
+
+    if not jobs:
+        return
+
+    detections = detect_batch([job[1] for job in jobs], [job[5] for job in jobs], [job[2] for job in jobs])
+    store_detections(jobs, detections)
+    for job, detection in zip(jobs, detections):
+        try:
+            handle_detection(*job, detection)
+        except Exception as e:
+            print(f"[-] Ошибка обработки {job[1]}: {e}")
+            claims.release(job[1])
+            continue
+        result = "skipped" if detection.skipped else "found" if detection.found else "rejected"
+        IMAGES_PROCESSED.inc(result="cached" if detection.cached else result)
+    if motion_gate is not None:
+        motion_gate.save()
+
+
+def start_leader_jobs():
+    # повтор очереди Telegram, отправка спула писем и обслуживание хранилища — в одном процессе на весь /data
+    TELEGRAM_QUEUE_DEPTH.set_function(lambda: count_files(TELEGRAM_QUEUE, ".json"))
+    TelegramQueueWorker().start()
+    StorageMaintenance().start()
+    if get_outbox is not None:
+        get_outbox()
+
+
+def run_worker(worker_id, metrics_port=METRICS_PORT):
+    # обработчик: своя модель, свой наблюдатель INBOX, файлы берутся атомарным переименованием
+    start_metrics(f"detector {worker_id}", metrics_port)
+    NOTIFY_PENDING.set_function(lambda: notifier.pending() + pending_jobs())
+    init_model()
+    claims = WorkerClaims(worker_id, INBOX).start()
+    watcher = InboxWatcher(INBOX).start()
+    stopping = stop_on_signals()
+    while not stopping.is_set():
+        batch = collect_batch(watcher)
+        if batch:
+            with STAGE_SECONDS.time(stage="batch"):
+                process_batch(batch, watcher, claims)
+
+    # кадры уже разложены по папкам, события в окне объединения есть только в памяти: отправляем сейчас
+    print(f"[*] {worker_id}: остановка, отправляем накопленные уведомления...")
+    watcher.stop()
+    notifier.stop()
+    close_dispatcher()
+    claims.stop()
+
+
+def stop_on_signals():
+    # SIGTERM (docker stop, supervise) и SIGINT завершают цикл обработчика, а не процесс сразу
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+    return stopping
+
+
+def supervise(workers):
+    # обработчики запускаются через spawn (без копии памяти родителя) и перезапускаются при падении;
+    # потоки инференса делятся между ними, лимит Telegram у всех процессов общий (файл в DATA_DIR)
+    if int(os.getenv("INFER_THREADS", "0")) == 0:
+        os.environ["INFER_THREADS"] = str(max((os.cpu_count() or 1) // workers, 1))
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = stop_on_signals()
+    while not stopping.is_set():
+        for index in range(workers):
+            process = processes.get(index)
+            if process is not None and process.is_alive():
                 continue
+            if process is not None:
+                print(f"[-] Обработчик {index} завершился с кодом {process.exitcode}, перезапускаем.")
+            # у каждого обработчика свой порт метрик: METRICS_PORT+1, +2, ...; у родителя — METRICS_PORT
+            metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+            process = context.Process(target=run_worker, args=(worker_name(index), metrics_port),
+                                      name=f"detector-{index}", daemon=True)
+            process.start()
+            processes[index] = process
+        stopping.wait(5)
+
+    # обработчикам — SIGTERM: каждый отправит накопленные уведомления и выйдет
+    for process in processes.values():
+        process.terminate()
+    deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+    for process in processes.values():
+        process.join(max(deadline - time.monotonic(), 0))
 
-            print(f"[+] Обнаружен новый файл: {filename}")
-
-            try:
-                parts = filename.split('_')
-                if len(parts) < 4:
-                    print(f"[-] Пропускаем файл с некорректным именем: {filename}")
-                    shutil.move(path, os.path.join(REJECTED, filename))
-                    continue
-
-                camera_name = parts[0]
-                event_date = parts[1]
-                event_time = parts[2]
-
-                settings = CAMERA_SETTINGS.get(camera_name, CAMERA_SETTINGS["default"])
-                found, detection_results, detected_labels = has_desired_objects(path, settings)
-
-                if found:
-                    annotated_image = cv2.imread(path)
-                    frame_color = (0, 255, 200)
-                    line_thickness = 1
-
-                    for r in detection_results:
-                        for box in r.boxes:
-                            cls_id = int(box.cls[0].item())
-                            conf = float(box.conf[0].item())
-                            threshold = CLASS_THRESHOLDS.get(cls_id, DEFAULT_CONFIDENCE)
-                            if cls_id in settings.get("desired_classes", []) and conf >= threshold:
-                                x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                                cv2.rectangle(annotated_image, (x1, y1), (x2, y2), frame_color, line_thickness)
-
-                    name, ext = os.path.splitext(filename)
-                    annotated_filename = f"{name}_with_detections{ext}"
-                    output_path = os.path.join(FILTERED, annotated_filename)
-                    cv2.imwrite(output_path, annotated_image)
-                    shutil.move(path, os.path.join(FILTERED, filename))
-
-                    detected_text = ", ".join(set(detected_labels))
-                    print(f"[+] Объекты '{detected_text}' найдены на {camera_name}.")
-
-                    if settings.get("send_email", False) is True:
-                         subject = f"Обнаружены объекты на камере (условно): {camera_name}"
-                         body = f"{camera_name} условно найдены: {detected_text}."
-                         email_receivers = settings.get("email_receivers", [])
-                         if email_receivers:
-                     # Отправляем отдельное письмо каждому получателю
-                            for receiver in email_receivers:
-                                if receiver and receiver.strip():  # Проверяем, что адрес не пустой
-                                    send_mail(subject, body, recipients=[receiver], attachments=[output_path])
-
-
-            #        if settings.get("send_email", False) is True:
-            #            subject = f"Обнаружены объекты на камере (условно): {camera_name}"
-            #            body = f"{camera_name} условно найдены: {detected_text}."
-            #            email_receivers = settings.get("email_receivers", [])
-            #            if email_receivers:
-            #                send_mail(subject, body, recipients=email_receivers, attachments=[output_path])
-
-                    if settings.get("send_telegram", False):
-                        telegram_chat_ids = settings.get("telegram_chat_ids")
-                        send_telegram_notification(output_path, camera_name, event_date, event_time, detected_labels, telegram_chat_ids)
-
-                else:
-                    save_path = os.path.join(REJECTED, filename)
-                    shutil.move(path, save_path)
-                    print(f"[-] Нет объектов для {camera_name}. Файл перемещён.")
-
-            except Exception as e:
-                print(f"[-] Ошибка обработки {path}: {e}")
-
-        time.sleep(10)
 
+if __name__ == "__main__":
+    print(f"[*] Запущен мониторинг папки INBOX (пакет до {BATCH_SIZE} файлов, ожидание {BATCH_WAIT} с, "
+          f"обработчиков: {DETECT_WORKERS})...")
+    INBOX_DEPTH.set_function(lambda: count_files(INBOX))
+    ClaimMaintenance(INBOX, on_leader=start_leader_jobs).start()
+    if DETECT_WORKERS > 1:
+        start_metrics("detector")
+        supervise(DETECT_WORKERS)
+    else:
+        run_worker(worker_name())
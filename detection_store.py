@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+from storage import normalize_date
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+DETECTION_DB = os.path.join(DATA_DIR, "detections.sqlite3")
+DETECTION_CACHE = os.getenv("DETECTION_CACHE", "true").lower() == "true"  # не гонять через модель уже виденные кадры
+DB_TIMEOUT = 30  # ожидание блокировки записи другим обработчиком
+# -----------------
+
+# результат кадра хранится для пары (камера, fingerprint): одинаковые байты с другой камеры или после
+# смены классов, зоны интереса, порогов или модели — отдельная запись, а не чужой кеш.
+# event_day — дата события (ГГГГ-ММ-ДД) для выборок по дням; processed_at — время обработки кадра
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL,
+    camera TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    event_date TEXT,
+    event_time TEXT,
+    event_day TEXT NOT NULL,
+    filename TEXT,
+    found INTEGER NOT NULL,
+    labels TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    UNIQUE (digest, camera, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS detections_camera_time ON detections (camera, processed_at);
+CREATE INDEX IF NOT EXISTS detections_time ON detections (processed_at);
+CREATE INDEX IF NOT EXISTS detections_camera_day ON detections (camera, event_day);
+
+CREATE TABLE IF NOT EXISTS boxes (
+    detection_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    x1 INTEGER NOT NULL,
+    y1 INTEGER NOT NULL,
+    x2 INTEGER NOT NULL,
+    y2 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_detection ON boxes (detection_id);
+CREATE INDEX IF NOT EXISTS boxes_label ON boxes (label, detection_id);
+"""
+
+
+def content_digest(data):
+    # ключ кеша — хеш содержимого: повторно доставленный или возвращённый в INBOX кадр узнаётся под любым именем
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def settings_fingerprint(settings):
+    # настройки, от которых зависит результат детекции (словарь, сериализуемый в JSON) -> короткий хеш
+    data = json.dumps(settings, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# результаты детекции по хешу содержимого кадра. WAL: обработчики пишут, а запросы читают
+# одновременно, без блокировки друг друга
+class DetectionStore:
+    def __init__(self, path=DETECTION_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=DB_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, digest, camera, fingerprint):
+        # -> (found, classes, confidences, boxes, labels) или None, если кадр этой камеры
+        # с этими настройками детекции не встречался
+        row = self.conn.execute("SELECT id, found, labels FROM detections WHERE digest = ? AND camera = ? AND fingerprint = ?",
+                                (digest, camera, fingerprint)).fetchone()
+        if row is None:
+            return None
+        detection_id, found, labels = row
+        rows = self.conn.execute("SELECT class_id, confidence, x1, y1, x2, y2 FROM boxes WHERE detection_id = ? ORDER BY rowid",
+                                 (detection_id,)).fetchall()
+        table = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        return (bool(found), table[:, 0].astype(np.intp), table[:, 1].astype(np.float32),
+                table[:, 2:].astype(np.int32), labels.split(",") if labels else [])
+
+    def add_many(self, records):
+        # records: (digest, camera, fingerprint, event_date, event_time, filename, found, labels, classes, confidences,
+        # boxes, box_labels); весь пакет кадров пишется одной транзакцией
+        now = time.time()
+        with self.conn:
+            for (digest, camera, fingerprint, event_date, event_time, filename, found, labels,
+                 classes, confidences, boxes, box_labels) in records:
+                self.conn.execute("DELETE FROM boxes WHERE detection_id IN "
+                                  "(SELECT id FROM detections WHERE digest = ? AND camera = ? AND fingerprint = ?)",
+                                  (digest, camera, fingerprint))
+                detection_id = self.conn.execute(
+                    "INSERT OR REPLACE INTO detections (digest, camera, fingerprint, event_date, event_time, event_day, "
+                    "filename, found, labels, processed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (digest, camera, fingerprint, event_date, event_time, normalize_date(event_date, now), filename,
+                     int(found), ",".join(labels), now)).lastrowid
+                if found:
+                    self.conn.executemany("INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+                        (detection_id, int(cls_id), label, float(confidence), *map(int, box))
+                        for cls_id, label, confidence, box in zip(classes, box_labels, confidences, boxes)])
+
+    def query(self, camera=None, label=None, since=None, until=None, found=True, limit=None, day_from=None, day_to=None):
+        # -> строки (processed_at, camera, event_date, event_time, filename, labels, боксов метки label);
+        # since/until — время обработки кадра (секунды), day_from/day_to — даты события ГГГГ-ММ-ДД включительно
+        conditions = []
+        params = []
+        if camera:
+            conditions.append("d.camera = ?")
+            params.append(camera)
+        if since is not None:
+            conditions.append("d.processed_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("d.processed_at < ?")
+            params.append(until)
+        if day_from:
+            conditions.append("d.event_day >= ?")
+            params.append(day_from)
+        if day_to:
+            conditions.append("d.event_day <= ?")
+            params.append(day_to)
+        if found is not None:
+            conditions.append("d.found = ?")
+            params.append(int(found))
+        if label:
+            sql = ("SELECT d.processed_at, d.camera, d.event_date, d.event_time, d.filename, d.labels, COUNT(*) "
+                   "FROM boxes b JOIN detections d ON d.id = b.detection_id WHERE b.label = ?")
+            params.insert(0, label)
+            sql += "".join(f" AND {c}" for c in conditions) + " GROUP BY d.id"
+        else:
+            sql = ("SELECT d.processed_at, d.camera, d.event_date, d.event_time, d.filename, d.labels, NULL "
+                   "FROM detections d")
+            sql += " WHERE " + " AND ".join(conditions) if conditions else ""
+        sql += " ORDER BY d.processed_at"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self.conn.execute(sql, params)
+
+
+def parse_since(value):
+    # "7d", "12h", "30m" — назад от текущего момента, иначе дата "YYYY-MM-DD"
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([dhm])", value)
+    if match:
+        return time.time() - float(match.group(1)) * {"d": 86400, "h": 3600, "m": 60}[match.group(2)]
+    return time.mktime(time.strptime(value, "%Y-%m-%d"))
+
+
+def main():
+    # python detection_store.py --camera vorota2 --label truck --since 7d
+    # python detection_store.py --camera vorota2 --day-from 2026-01-01 --day-to 2026-01-07
+    parser = argparse.ArgumentParser(description="Поиск по индексу детекций")
+    parser.add_argument("--camera")
+    parser.add_argument("--label", help="метка класса YOLO, например truck")
+    parser.add_argument("--since", help="по времени обработки кадра: 7d, 12h или YYYY-MM-DD")
+    parser.add_argument("--until", help="по времени обработки кадра: 7d, 12h или YYYY-MM-DD")
+    parser.add_argument("--day-from", help="по дате события из письма, YYYY-MM-DD включительно")
+    parser.add_argument("--day-to", help="по дате события из письма, YYYY-MM-DD включительно")
+    parser.add_argument("--all", action="store_true", help="включая кадры без объектов")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--db", default=DETECTION_DB)
+    args = parser.parse_args()
+
+    store = DetectionStore(args.db)
+    rows = store.query(args.camera, args.label, parse_since(args.since) if args.since else None,
+                       parse_since(args.until) if args.until else None, None if args.all else True, args.limit,
+                       args.day_from, args.day_to)
+    total = 0
+    for processed_at, camera, event_date, event_time, filename, labels, count in rows:
+        total += 1
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(processed_at))
+        boxes = f" ({count} шт.)" if count else ""
+        print(f"{when}  {camera:<10} {event_date} {event_time}  {labels or '-'}{boxes}  {filename}")
+    print(f"[*] Найдено кадров: {total}")
+
+
+if __name__ == "__main__":
+    main()
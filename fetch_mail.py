@@ -3,220 +3,680 @@ import email
 import os
 import time
 import re
+import select
+import socket
+import ssl
+import binascii
+import quopri
+import mimetypes
 import uuid
 import html
+import logging
 import cv2
 import numpy as np
+from dedup_index import DuplicateIndex
+from metrics import start_metrics, STAGE_SECONDS, EMAILS_FETCHED, IMAGES_SAVED, IMAGES_DEDUPLICATED
+
+log = logging.getLogger("fetch_mail")
 
 # --- НАСТРОЙКИ ---
 EMAIL_ACCOUNT = os.getenv("EMAIL_ACCOUNT")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 IMAP_SERVER = os.getenv("IMAP_SERVER")
 USE_SSL = os.getenv("USE_SSL", "False").lower() == "true"
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993" if USE_SSL else "143"))
 MAX_ATTACHMENTS = min(int(os.getenv("MAX_ATTACHMENTS", "3")), 5)
-SAVE_PATH = "/data/inbox"
-IMAGE_SIMILARITY_THRESHOLD = 0.98
+SAVE_PATH = os.path.join(os.getenv("DATA_DIR", "/data"), "inbox")
+FETCH_CHUNK_SIZE = max(int(os.getenv("IMAP_FETCH_CHUNK", "20")), 1)  # писем за один FETCH
+# режим работы: idle — постоянное соединение и IMAP IDLE (без поддержки сервером — NOOP),
+# noop — постоянное соединение с опросом NOOP, poll — переподключение каждые FETCH_INTERVAL секунд
+IMAP_MODE = os.getenv("IMAP_MODE", "idle").lower()
+FETCH_INTERVAL = int(os.getenv("FETCH_INTERVAL", "60"))
+IDLE_TIMEOUT = int(os.getenv("IMAP_IDLE_TIMEOUT", "300"))  # не дольше 29 минут (RFC 2177)
+NOOP_INTERVAL = float(os.getenv("IMAP_NOOP_INTERVAL", "2"))
+IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", "60"))  # ожидание ответа сервера; молчание дольше — обрыв соединения
+RECONNECT_MIN = 1
+RECONNECT_MAX = 300
+# true — скачивать по BODYSTRUCTURE только текст и первые MAX_ATTACHMENTS изображений
+LEAN_FETCH = os.getenv("IMAP_LEAN_FETCH", "true").lower() == "true"
+DECODE_CHUNK = 64 * 1024
 # -----------------
 
+UID_RE = re.compile(rb'UID (\d+)')
+FETCH_START_RE = re.compile(rb'^\d+ \(')
+LITERAL_RE = re.compile(rb'(\S+) (\{\d+\})$')
+CAMERA_RE = re.compile(r'CAMERA NAME\(NUM\):[ \t]*([^(\r\n]*)')
+EVENT_TIME_RE = re.compile(r'EVENT TIME:[ \t]*([^,\r\n]*),([^,\r\n]*)')
+BR_RE = re.compile(r'(?i)<br\s*/?>')
+TAG_RE = re.compile('<.*?>', re.IGNORECASE)
+
 os.makedirs(SAVE_PATH, exist_ok=True)
 
-def get_image_histogram(image_data):
-    try:
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            print(f"[-] Не удалось декодировать изображение.")
-            return None
-        hist = cv2.calcHist([img], [0], None, [256], [0, 256])
-        hist = cv2.normalize(hist, hist).flatten()
-        return hist
-    except Exception as e:
-        print(f"[-] Ошибка при вычислении гистограммы: {e}")
-        return None
+duplicate_index = DuplicateIndex()
 
-def is_image_similar(current_image_data, processed_histograms):
-    current_hist = get_image_histogram(current_image_data)
-    if current_hist is None:
-        return True
-    for prev_hist in processed_histograms:
-        if prev_hist is None:
-            continue
-        similarity = cv2.compareHist(current_hist, prev_hist, cv2.HISTCMP_CORREL)
-        if similarity > IMAGE_SIMILARITY_THRESHOLD:
-            return True
-    return False
+def duplicate_check(camera_name, gray, pending):
+    # межписьменный индекс перцептивных хешей по камере: повтор той же сцены не дойдёт до детектора.
+    # -> (хеш, дубликат ли) или (None, None), если кадр не декодируется; pending — хеши уже принятых
+    # кадров письма, в индекс они попадают только после сохранения всего письма (commit_frames)
+    if gray is None:
+        return None, None
+    value = duplicate_index.frame_hash(gray)
+    return value, duplicate_index.find(camera_name or "unknown_cam", value, pending) is not None
+
+def commit_frames(camera_name, hashes):
+    duplicate_index.commit(camera_name or "unknown_cam", hashes)
 
 def clean_and_normalize_html(raw_html):
     if not raw_html or not isinstance(raw_html, str):
         return ""
-    normalized_html = re.sub(r'(?i)<br\s*/?>', '\n', raw_html)
-    cleanr = re.compile('<.*?>', re.IGNORECASE)
-    cleaned_text = re.sub(cleanr, '', normalized_html)
+    normalized_html = BR_RE.sub('\n', raw_html)
+    cleaned_text = TAG_RE.sub('', normalized_html)
     return html.unescape(cleaned_text)
 
-def save_attachment(part, camera_name, event_date, event_time, attachment_index):
-    filename = part.get_filename() or f"attachment_{uuid.uuid4().hex}"
-    base, ext = os.path.splitext(filename)
+def parse_event_info(email_body):
+    # -> (camera_name, event_date, event_time) из строк "CAMERA NAME(NUM):" и "EVENT TIME:"
+    camera_name = ""
+    event_date = ""
+    event_time = ""
+    camera_match = CAMERA_RE.search(email_body)
+    if camera_match:
+        camera_name = camera_match.group(1).strip()
+#        print(f"[DEBUG] Имя камеры: {camera_name}")
+    time_match = EVENT_TIME_RE.search(email_body)
+    if time_match:
+        event_date = time_match.group(1).strip()
+        event_time = time_match.group(2).strip()
+#        print(f"[DEBUG] Дата/время события: {event_date} {event_time}")
+    return camera_name, event_date, event_time
+
+def attachment_filename(camera_name, event_date, event_time, attachment_index, ext):
     clean_camera_name = re.sub(r'[^a-zA-Z0-9_]+', '', camera_name) if camera_name else "unknown_cam"
     clean_event_time = event_time.replace(':', '-') if event_time else "unknown_time"
     clean_event_date = event_date if event_date else "unknown_date"
-    new_filename = f"{clean_camera_name}_{clean_event_date}_{clean_event_time}_{attachment_index}{ext}"
+    return f"{clean_camera_name}_{clean_event_date}_{clean_event_time}_{attachment_index}{ext}"
+
+def save_attachment(part, camera_name, event_date, event_time, attachment_index):
+    filename = part.get_filename() or f"attachment_{uuid.uuid4().hex}"
+    base, ext = os.path.splitext(filename)
+    new_filename = attachment_filename(camera_name, event_date, event_time, attachment_index, ext)
     filepath = os.path.join(SAVE_PATH, new_filename)
-    with open(filepath, "wb") as f:
+    # пишем во временный файл и переименовываем: детектор не увидит недописанное вложение
+    tmp_path = os.path.join(SAVE_PATH, f".{new_filename}.part")
+    with open(tmp_path, "wb") as f:
         f.write(part.get_payload(decode=True))
+    os.replace(tmp_path, filepath)
     print(f"[+] Скачан и переименован файл: {filepath}")
     return filepath
 
-def fetch_mail():
-    mail_class = imaplib.IMAP4_SSL if USE_SSL else imaplib.IMAP4
-    mail = None
-    try:
-#        print(f"[DEBUG] Подключение к {IMAP_SERVER}, SSL={USE_SSL}, логин={EMAIL_ACCOUNT}")
-        mail = mail_class(IMAP_SERVER)
-        mail.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-#        print("[DEBUG] Успешный логин")
+def compress_uid_set(uids):
+    # [1, 2, 3, 7, 9, 10] -> "1:3,7,9:10" — короткий message set для UID-команд
+    numbers = sorted(int(uid) for uid in uids)
+    ranges = []
+    start = prev = numbers[0]
+    for n in numbers[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else f"{start}")
+        start = prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else f"{start}")
+    return ",".join(ranges)
 
-        status, _ = mail.select("inbox")
-#        print(f"[DEBUG] Выбор папки INBOX: {status}")
 
-        status, messages = mail.search(None, "UNSEEN")
-        message_ids = messages[0].split()
-#        print(f"[DEBUG] Найдено непрочитанных писем: {len(message_ids)}")
+def quote_imap_string(data):
+    return b'"' + data.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
 
-        if not message_ids:
-            print("Нет новых писем.")
-            return
 
-        messages_with_dates = []
-        for num in message_ids:
-            status, msg_data = mail.fetch(num, "(INTERNALDATE)")
-#            print(f"[DEBUG] INTERNALDATE для {num.decode()}: {msg_data}")
+def parse_fetch_response(msg_data):
+    # ответ FETCH из imaplib (кортежи (заголовок, литерал) и байтовые строки) ->
+    # {uid: {"text": ответ без тел, "literals": {b"RFC822"/b"BODY[2]": байты}}}
+    messages = []
+    current = None
+    for item in msg_data or []:
+        header, literal = item if isinstance(item, tuple) else (item, None)
+        if not isinstance(header, bytes):
+            continue
+        if current is None or FETCH_START_RE.match(header):
+            current = {"text": b"", "literals": {}}
+            messages.append(current)
+        if literal is None:
+            current["text"] += header
+            continue
+        match = LITERAL_RE.search(header)
+        name = match.group(1).lstrip(b"(").upper() if match else b""
+        if name == b"RFC822" or name.startswith((b"BODY[", b"BINARY[")):
+            current["literals"][name] = literal
+            current["text"] += header[:match.start()] if match else header
+        else:
+            # литерал внутри структуры (например, имя файла в BODYSTRUCTURE) — вставляем строкой
+            current["text"] += (header[:match.start(2)] if match else header) + quote_imap_string(literal)
+
+    responses = {}
+    for message in messages:
+        match = UID_RE.search(message["text"])
+        if match:
+            responses[match.group(1)] = message
+    return responses
 
-            if not msg_data or not msg_data[0]:
-#                print(f"[-] INTERNALDATE пуст для письма {num.decode()}")
-                continue
 
+def process_message(raw_email):
+    msg = email.message_from_bytes(raw_email)
+
+    # --- обработка тела письма ---
+    email_body = ""
+    for part in msg.walk():
+        if part.get_content_maintype() == 'text':
             try:
-                date_tuple = imaplib.Internaldate2tuple(msg_data[0])
-                if date_tuple:
-                    messages_with_dates.append({'id': num, 'date': time.mktime(date_tuple)})
-                else:
-                    print(f"[-] Не удалось распарсить дату письма {num.decode()}: {msg_data[0]}")
-                    # если не получилось — добавляем без сортировки
-                    messages_with_dates.append({'id': num, 'date': time.time()})
+                charset = part.get_content_charset()
+                payload = part.get_payload(decode=True)
+#                print(f"[DEBUG] Текстовая часть письма, charset={charset}, длина={len(payload) if payload else 0}")
+                email_body += payload.decode(charset or 'utf-8', errors='ignore')
             except Exception as e:
-                print(f"[ERROR] Ошибка парсинга INTERNALDATE письма {num.decode()}: {e}")
-                messages_with_dates.append({'id': num, 'date': time.time()})
-
-        # сортировка по дате
-        messages_with_dates.sort(key=lambda x: x['date'])
-        sorted_message_ids = [msg['id'] for msg in messages_with_dates]
-
-        for num in sorted_message_ids:
-#            print(f"[DEBUG] Обработка письма {num.decode()}")
-            status, msg_data = mail.fetch(num, "(RFC822)")
-            if not msg_data or not msg_data[0]:
-                print(f"[-] Ошибка получения письма {num.decode()}")
+                print(f"Ошибка декодирования части письма: {e}")
+
+    if "<html" in email_body.lower():
+        email_body = clean_and_normalize_html(email_body)
+        log.debug("[*] Тело письма содержит HTML → нормализовано.")
+
+    # --- поиск камеры и времени ---
+    camera_name, event_date, event_time = parse_event_info(email_body)
+
+    # --- вложения ---
+    # номер файла — позиция изображения в письме: повтор после сбоя пишет те же имена
+    hashes = []
+    duplicates = 0
+    position = 0
+    for part in msg.walk():
+        if part.get_content_maintype() == "multipart" or not part.get("Content-Disposition"):
+            continue
+        if not part.get_content_type().startswith('image/'):
+            continue
+        if position >= MAX_ATTACHMENTS:
+            print(f"[-] Достигнут лимит вложений ({MAX_ATTACHMENTS}). Пропускаем остальные.")
+            break
+        position += 1
+
+        log.debug("[*] Обработка вложения %d, type=%s", position, part.get_content_type())
+        current_image_data = part.get_payload(decode=True)
+        gray = cv2.imdecode(np.frombuffer(current_image_data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        value, duplicate = duplicate_check(camera_name, gray, hashes)
+
+        if duplicate is None:
+            print(f"[-] Не удалось декодировать изображение. Пропускаем вложение.")
+            continue
+
+        if duplicate:
+            print(f"[-] Пропускаем визуально схожее вложение (дубликат).")
+            duplicates += 1
+            continue
+        else:
+            save_attachment(part, camera_name, event_date, event_time, position)
+            hashes.append(value)
+            IMAGES_SAVED.inc()
+
+    commit_frames(camera_name, hashes)
+    IMAGES_DEDUPLICATED.inc(duplicates)
+
+
+def tokenize_imap(text):
+    # разбор ответа IMAP на вложенные списки: строки, атомы, None для NIL
+    stack = [[]]
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '(':
+            stack.append([])
+            i += 1
+        elif c == ')':
+            if len(stack) == 1:
+                break
+            item = stack.pop()
+            stack[-1].append(item)
+            i += 1
+        elif c == '"':
+            j = i + 1
+            buf = []
+            while j < n and text[j] != '"':
+                if text[j] == '\\' and j + 1 < n:
+                    j += 1
+                buf.append(text[j])
+                j += 1
+            stack[-1].append(''.join(buf))
+            i = j + 1
+        elif c.isspace():
+            i += 1
+        else:
+            j = i
+            while j < n and not text[j].isspace() and text[j] not in '()"':
+                j += 1
+            atom = text[i:j]
+            stack[-1].append(None if atom.upper() == "NIL" else atom)
+            i = j
+    return stack[0]
+
+
+def find_bodystructure(response_text):
+    text = response_text.decode("utf-8", errors="replace")
+    position = text.upper().find("BODYSTRUCTURE (")
+    if position < 0:
+        return None
+    parsed = tokenize_imap(text[position + len("BODYSTRUCTURE "):])
+    return parsed[0] if parsed and isinstance(parsed[0], list) else None
+
+
+def imap_params(value):
+    # ("name" "a.jpg" "charset" "utf-8") -> {"name": "a.jpg", "charset": "utf-8"}
+    if not isinstance(value, list):
+        return {}
+    return {str(value[i]).lower(): value[i + 1] for i in range(0, len(value) - 1, 2)}
+
+
+def walk_bodystructure(node, prefix=""):
+    # -> (номер части для BODY[...], тип, подтип, параметры, кодировка, disposition или None/False)
+    if isinstance(node[0], list):
+        # у multipart дети идут первыми, затем подтип-строка и расширения
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            index += 1
+            yield from walk_bodystructure(child, f"{prefix}{index}.")
+        return
+
+    main_type = (node[0] or "").lower()
+    sub_type = (node[1] or "").lower() if len(node) > 1 else ""
+    params = imap_params(node[2] if len(node) > 2 else None)
+    encoding = (node[5] or "7bit").lower() if len(node) > 5 else "7bit"
+    # расширенные поля: у text/* после размера идёт число строк, у message/rfc822 — ещё три поля
+    ext_start = 8 if main_type == "text" else 10 if (main_type, sub_type) == ("message", "rfc822") else 7
+    disposition = False  # False — сервер не прислал расширенные поля
+    if len(node) > ext_start + 1:
+        disposition = node[ext_start + 1]
+    part_number = prefix[:-1] if prefix else "1"
+    yield part_number, main_type, sub_type, params, encoding, disposition
+
+
+def plan_message_parts(structure):
+    # -> (текстовая часть, [части-изображения]) — только то, что нужно скачать
+    text_part = None
+    html_part = None
+    images = []
+    for part in walk_bodystructure(structure):
+        part_number, main_type, sub_type, params, encoding, disposition = part
+        if main_type == "text" and sub_type == "plain" and text_part is None:
+            text_part = part
+        elif main_type == "text" and sub_type == "html" and html_part is None:
+            html_part = part
+        elif main_type == "image" and disposition is not None and len(images) < MAX_ATTACHMENTS:
+            images.append(part)
+    return text_part or html_part, images
+
+
+def decode_transfer(payload, encoding):
+    if encoding == "base64":
+        return binascii.a2b_base64(payload.translate(None, b" \t\r\n"))
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+
+def write_decoded(payload, encoding, f):
+    # base64 декодируется кусками прямо в файл, без полной декодированной копии в памяти
+    if encoding != "base64":
+        f.write(decode_transfer(payload, encoding))
+        return
+    carry = b""
+    for start in range(0, len(payload), DECODE_CHUNK):
+        chunk = carry + payload[start:start + DECODE_CHUNK].translate(None, b" \t\r\n")
+        usable = len(chunk) - len(chunk) % 4
+        f.write(binascii.a2b_base64(chunk[:usable]))
+        carry = chunk[usable:]
+    if carry:
+        f.write(binascii.a2b_base64(carry + b"=" * (-len(carry) % 4)))
+
+
+def attachment_extension(params, disposition, main_type, sub_type):
+    filename = params.get("name")
+    if isinstance(disposition, list) and len(disposition) > 1:
+        filename = imap_params(disposition[1]).get("filename") or filename
+    ext = os.path.splitext(filename)[1] if isinstance(filename, str) else ""
+    return ext or mimetypes.guess_extension(f"{main_type}/{sub_type}") or ""
+
+
+def save_structured_message(text_part, images, literals):
+    email_body = ""
+    if text_part is not None:
+        part_number, _, sub_type, params, encoding, _ = text_part
+        payload = literals.get(f"BODY[{part_number}]".encode(), b"")
+        try:
+            email_body = decode_transfer(payload, encoding).decode(params.get("charset") or "utf-8", errors="ignore")
+        except Exception as e:
+            print(f"Ошибка декодирования части письма: {e}")
+        if sub_type == "html" or "<html" in email_body.lower():
+            email_body = clean_and_normalize_html(email_body)
+
+    camera_name, event_date, event_time = parse_event_info(email_body)
+
+    # все части проверяются до записи: письмо без одной из них остаётся на сервере целиком
+    for part_number, *_ in images:
+        if not literals.get(f"BODY[{part_number}]".encode()):
+            raise ValueError(f"вложение {part_number} не получено")
+
+    # номер файла — позиция части в BODYSTRUCTURE: повтор после сбоя пишет те же имена,
+    # а хеши попадают в индекс дубликатов только после сохранения всего письма
+    hashes = []
+    duplicates = 0
+    for position, (part_number, main_type, sub_type, params, encoding, disposition) in enumerate(images, 1):
+        payload = literals[f"BODY[{part_number}]".encode()]
+        ext = attachment_extension(params, disposition, main_type, sub_type)
+        new_filename = attachment_filename(camera_name, event_date, event_time, position, ext)
+        filepath = os.path.join(SAVE_PATH, new_filename)
+        tmp_path = os.path.join(SAVE_PATH, f".{new_filename}.part")
+        with open(tmp_path, "wb") as f:
+            write_decoded(payload, encoding, f)
+
+        value, duplicate = duplicate_check(camera_name, cv2.imread(tmp_path, cv2.IMREAD_REDUCED_GRAYSCALE_4), hashes)
+        if duplicate is None:
+            print(f"[-] Не удалось декодировать изображение. Пропускаем вложение.")
+            os.remove(tmp_path)
+            continue
+        if duplicate:
+            print(f"[-] Пропускаем визуально схожее вложение (дубликат).")
+            duplicates += 1
+            os.remove(tmp_path)
+            continue
+
+        os.replace(tmp_path, filepath)
+        hashes.append(value)
+        IMAGES_SAVED.inc()
+        print(f"[+] Скачан и переименован файл: {filepath}")
+
+    commit_frames(camera_name, hashes)
+    IMAGES_DEDUPLICATED.inc(duplicates)
+
+
+def process_structured_chunk(mail, chunk):
+    # BODYSTRUCTURE пачки писем, затем только нужные части: письма с одинаковой
+    # структурой (обычно все письма одного регистратора) забираются одним FETCH.
+    # Возвращает (обработанные UID, UID без разобранной структуры)
+    with STAGE_SECONDS.time(stage="imap_fetch"):
+        status, msg_data = mail.uid("FETCH", compress_uid_set(chunk), "(BODYSTRUCTURE)")
+    if status != "OK":
+        print(f"[-] FETCH BODYSTRUCTURE вернул {status}, письма останутся до следующего цикла.")
+        return [], []
+    structures = parse_fetch_response(msg_data)
+
+    plans = {}
+    groups = {}
+    unparsed = []
+    for uid in chunk:
+        structure = None
+        try:
+            structure = find_bodystructure(structures.get(uid, {}).get("text", b""))
+        except Exception as e:
+            print(f"[-] Ошибка разбора BODYSTRUCTURE письма {uid.decode()}: {e}")
+        if structure is None:
+            unparsed.append(uid)
+            continue
+        text_part, images = plan_message_parts(structure)
+        plans[uid] = (text_part, images)
+        sections = tuple(part[0] for part in ([text_part] if text_part else []) + images)
+        groups.setdefault(sections, []).append(uid)
+
+    # части забираются по группам, а сохраняются в исходном порядке пачки (по INTERNALDATE)
+    fetched = {}
+    for sections, uids in groups.items():
+        literals = {}
+        if sections:
+            items = " ".join(f"BODY.PEEK[{section}]" for section in sections)
+            with STAGE_SECONDS.time(stage="imap_fetch"):
+                status, msg_data = mail.uid("FETCH", compress_uid_set(uids), f"({items})")
+            if status != "OK":
+                print(f"[-] FETCH частей писем вернул {status}, письма останутся до следующего цикла.")
                 continue
+            literals = parse_fetch_response(msg_data)
+        for uid in uids:
+            fetched[uid] = (sections, literals.get(uid, {}).get("literals", {}))
+
+    processed = []
+    for uid in chunk:
+        if uid not in fetched:
+            continue
+        # на удаление — только письма, у которых получены все запрошенные части и которые сохранены без ошибок;
+        # остальные остаются в ящике до следующего цикла
+        sections, message_literals = fetched.pop(uid)
+        missing = [section for section in sections if f"BODY[{section}]".encode() not in message_literals]
+        if missing:
+            print(f"[-] Письмо {uid.decode()}: не получены части {', '.join(missing)}, повтор в следующем цикле.")
+            continue
+        try:
+            with STAGE_SECONDS.time(stage="decode"):
+                save_structured_message(*plans[uid], message_literals)
+        except Exception as e:
+            print(f"[ERROR] Ошибка обработки письма {uid.decode()}: {e}")
+            continue
+        processed.append(uid)
+    return processed, unparsed
+
+
+def process_rfc822_chunk(mail, chunk):
+    with STAGE_SECONDS.time(stage="imap_fetch"):
+        status, msg_data = mail.uid("FETCH", compress_uid_set(chunk), "(RFC822)")
+    if status != "OK":
+        print(f"[-] FETCH RFC822 вернул {status}, письма останутся до следующего цикла.")
+        return []
+    bodies = parse_fetch_response(msg_data)
+
+    processed = []
+    for uid in chunk:
+#        print(f"[DEBUG] Обработка письма {uid.decode()}")
+        raw_email = bodies.get(uid, {}).get("literals", {}).get(b"RFC822")
+        if not raw_email:
+            print(f"[-] Ошибка получения письма {uid.decode()}")
+            continue
+        try:
+            with STAGE_SECONDS.time(stage="decode"):
+                process_message(raw_email)
+        except Exception as e:
+            print(f"[ERROR] Ошибка обработки письма {uid.decode()}: {e}")
+            continue
+        processed.append(uid)
+    return processed
+
+
+def connect():
+    mail_class = imaplib.IMAP4_SSL if USE_SSL else imaplib.IMAP4
+#    print(f"[DEBUG] Подключение к {IMAP_SERVER}, SSL={USE_SSL}, логин={EMAIL_ACCOUNT}")
+    mail = mail_class(IMAP_SERVER, IMAP_PORT, timeout=IMAP_TIMEOUT)
+    mail.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
+#    print("[DEBUG] Успешный логин")
+
+    status, _ = mail.select("inbox")
+#    print(f"[DEBUG] Выбор папки INBOX: {status}")
+    return mail
+
+
+def close(mail):
+    if mail and mail.state == 'SELECTED':
+        try:
+            mail.logout()
+            log.debug("[*] Соединение закрыто.")
+        except Exception as e:
+            print(f"[-] Ошибка при закрытии IMAP: {e}")
+
+
+def process_unseen(mail):
+    with STAGE_SECONDS.time(stage="imap_search"):
+        status, messages = mail.uid("SEARCH", None, "UNSEEN")
+    message_uids = messages[0].split() if messages and messages[0] else []
+#    print(f"[DEBUG] Найдено непрочитанных писем: {len(message_uids)}")
+
+    if not message_uids:
+        print("Нет новых писем.")
+        return
 
-            raw_email = msg_data[0][1]
-            msg = email.message_from_bytes(raw_email)
-
-            # --- обработка тела письма ---
-            email_body = ""
-            for part in msg.walk():
-                if part.get_content_maintype() == 'text':
-                    try:
-                        charset = part.get_content_charset()
-                        payload = part.get_payload(decode=True)
-#                        print(f"[DEBUG] Текстовая часть письма, charset={charset}, длина={len(payload) if payload else 0}")
-                        email_body += payload.decode(charset or 'utf-8', errors='ignore')
-                    except Exception as e:
-                        print(f"Ошибка декодирования части письма: {e}")
-
-            if "<html" in email_body.lower():
-                email_body = clean_and_normalize_html(email_body)
-                print("[DEBUG] Тело письма содержит HTML → нормализовано.")
-
-            # --- поиск камеры и времени ---
-            camera_name = ""
-            event_date = ""
-            event_time = ""
-
-            lines = email_body.splitlines()
-            for line in lines:
-                print(f"[DEBUG] Строка письма: {line}")
-                if "CAMERA NAME(NUM):" in line:
-                    camera_info = line.replace("CAMERA NAME(NUM):", "").strip()
-                    camera_name = camera_info.split('(')[0].strip()
-#                    print(f"[DEBUG] Имя камеры: {camera_name}")
-                if "EVENT TIME:" in line:
-                    time_info = line.replace("EVENT TIME:", "").strip()
-                    if ',' in time_info:
-                        event_date, event_time = time_info.split(',')
-                        event_date = event_date.strip()
-                        event_time = event_time.strip()
-#                        print(f"[DEBUG] Дата/время события: {event_date} {event_time}")
-
-            # --- вложения ---
-            processed_histograms_in_email = []
-            attachment_index = 0
-            for part in msg.walk():
-                if part.get_content_maintype() == "multipart" or not part.get("Content-Disposition"):
-                    continue
-                if not part.get_content_type().startswith('image/'):
-                    continue
-                if attachment_index >= MAX_ATTACHMENTS:
-                    print(f"[-] Достигнут лимит вложений ({MAX_ATTACHMENTS}). Пропускаем остальные.")
-                    break
-
-                print(f"[DEBUG] Обработка вложения {attachment_index+1}, type={part.get_content_type()}")
-                current_image_data = part.get_payload(decode=True)
-                current_hist = get_image_histogram(current_image_data)
-
-                if current_hist is None:
-                    print(f"[-] Не удалось получить гистограмму. Пропускаем вложение.")
-                    continue
-
-                if is_image_similar(current_image_data, processed_histograms_in_email):
-                    print(f"[-] Пропускаем визуально схожее вложение (дубликат).")
-                    continue
-                else:
-                    processed_histograms_in_email.append(current_hist)
-                    attachment_index += 1
-                    save_attachment(part, camera_name, event_date, event_time, attachment_index)
-
-            # --- удаление письма ---
-            print(f"[DEBUG] Попытка пометить письмо {num.decode()} для удаления...")
-            status_delete, response_delete = mail.store(num, '+FLAGS', '\\Deleted')
-            print(f"[DEBUG] Результат пометки: {status_delete}, {response_delete}")
-
-            status_flags, response_flags = mail.fetch(num, '(FLAGS)')
-            print(f"[DEBUG] Флаги письма {num.decode()}: {response_flags[0].decode() if response_flags and response_flags[0] else 'None'}")
-            print(f"[+] Письмо {num.decode()} помечено для удаления.")
-
-        # --- expunge ---
-        print("[DEBUG] Выполняем EXPUNGE...")
-        status_expunge, response_expunge = mail.expunge()
-        print(f"[DEBUG] EXPUNGE → {status_expunge}, {response_expunge}")
-        print("[+] Все помеченные письма удалены.")
+    # INTERNALDATE всех писем — одним запросом
+    status, msg_data = mail.uid("FETCH", compress_uid_set(message_uids), "(INTERNALDATE)")
+    dates = parse_fetch_response(msg_data)
+
+    messages_with_dates = []
+    for uid in message_uids:
+        header = dates.get(uid, {}).get("text")
+        if not header:
+#            print(f"[-] INTERNALDATE пуст для письма {uid.decode()}")
+            continue
+
+        try:
+            date_tuple = imaplib.Internaldate2tuple(header)
+            if date_tuple:
+                messages_with_dates.append({'id': uid, 'date': time.mktime(date_tuple)})
+            else:
+                print(f"[-] Не удалось распарсить дату письма {uid.decode()}: {header}")
+                # если не получилось — добавляем без сортировки
+                messages_with_dates.append({'id': uid, 'date': time.time()})
+        except Exception as e:
+            print(f"[ERROR] Ошибка парсинга INTERNALDATE письма {uid.decode()}: {e}")
+            messages_with_dates.append({'id': uid, 'date': time.time()})
+
+    # сортировка по дате
+    messages_with_dates.sort(key=lambda x: (x['date'], int(x['id'])))
+    sorted_message_uids = [msg['id'] for msg in messages_with_dates]
+
+    # тела писем — пачками по FETCH_CHUNK_SIZE, пометка на удаление — одним STORE на пачку
+    for start in range(0, len(sorted_message_uids), FETCH_CHUNK_SIZE):
+        chunk = sorted_message_uids[start:start + FETCH_CHUNK_SIZE]
+        if LEAN_FETCH:
+            processed, unparsed = process_structured_chunk(mail, chunk)
+            if unparsed:
+                # структуру не удалось разобрать — забираем такие письма целиком
+                processed += process_rfc822_chunk(mail, unparsed)
+        else:
+            processed = process_rfc822_chunk(mail, chunk)
+
+        # --- удаление писем ---
+        EMAILS_FETCHED.inc(len(processed))
+        if processed:
+            status_delete, response_delete = mail.uid("STORE", compress_uid_set(processed), "+FLAGS.SILENT", "(\\Deleted)")
+            print(f"[+] Письма {len(processed)} шт. помечены для удаления: {status_delete}.")
+
+    duplicate_index.save()
+
+    # --- expunge ---
+    log.debug("[*] Выполняем EXPUNGE...")
+    status_expunge, response_expunge = mail.expunge()
+    log.debug("[*] EXPUNGE → %s, %s", status_expunge, response_expunge)
+    print("[+] Все помеченные письма удалены.")
+
+
+def fetch_mail():
+    mail = None
+    try:
+        mail = connect()
+        process_unseen(mail)
     except Exception as e:
         print(f"[ERROR] Ошибка при работе с IMAP: {e}")
     finally:
-        if mail and mail.state == 'SELECTED':
+        close(mail)
+
+
+def read_idle_line(mail):
+    # тайм-аут сокета (IMAP_TIMEOUT) — полуоткрытое соединение: без этого readline ждал бы вечно
+    try:
+        return mail.readline()
+    except socket.timeout:
+        raise imaplib.IMAP4.abort(f"сервер не ответил за {IMAP_TIMEOUT:g} с")
+
+
+def idle_wait(mail, timeout):
+    # IMAP IDLE (RFC 2177): ждём, пока сервер сообщит о новых письмах, не дольше timeout секунд.
+    # imaplib до Python 3.14 не умеет IDLE, поэтому команда отправляется вручную
+    tag = mail._new_tag()
+    mail.tagged_commands.pop(tag, None)
+    mail.send(tag + b" IDLE\r\n")
+    while True:
+        line = read_idle_line(mail)
+        if not line:
+            raise imaplib.IMAP4.abort("соединение закрыто во время IDLE")
+        if line.startswith(b"+"):
+            break
+        if line.startswith(tag):
+            raise imaplib.IMAP4.error(f"IDLE отклонён: {line.decode(errors='replace').strip()}")
+
+    sock = mail.sock
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        woken = True
+    else:
+        woken = bool(select.select([sock], [], [], timeout)[0])
+
+    # выходим из IDLE при любом событии: новые письма заберёт следующий process_unseen
+    mail.send(b"DONE\r\n")
+    while True:
+        line = read_idle_line(mail)
+        if not line:
+            raise imaplib.IMAP4.abort("соединение закрыто при выходе из IDLE")
+        if line.startswith(tag):
+            if not line[len(tag):].strip().upper().startswith(b"OK"):
+                raise imaplib.IMAP4.error(f"IDLE завершился ошибкой: {line.decode(errors='replace').strip()}")
+            return woken
+
+
+def noop_wait(mail, timeout):
+    # запасной вариант без IDLE: частый NOOP по открытому соединению
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(NOOP_INTERVAL)
+        mail.noop()
+        for code in ("EXISTS", "RECENT"):
+            _, data = mail.response(code)
+            if data and data[0] is not None:
+                return True
+    return False
+
+
+def run_persistent():
+    # одно долгоживущее соединение: IDLE там, где сервер его поддерживает, иначе NOOP;
+    # при обрыве — переподключение с нарастающей паузой
+    mail = None
+    use_idle = False
+    backoff = RECONNECT_MIN
+    while True:
+        try:
+            if mail is None:
+                mail = connect()
+                use_idle = IMAP_MODE == "idle" and "IDLE" in mail.capabilities
+                print(f"[*] IMAP-соединение установлено, режим ожидания: {'IDLE' if use_idle else 'NOOP'}.")
+
+            process_unseen(mail)
+            if use_idle:
+                idle_wait(mail, IDLE_TIMEOUT)
+            else:
+                noop_wait(mail, IDLE_TIMEOUT)
+            # пауза сбрасывается только после полного цикла: сервер, который принимает вход
+            # и сразу рвёт соединение, не должен получать переподключения раз в секунду
+            backoff = RECONNECT_MIN
+        except Exception as e:
+            print(f"[ERROR] Ошибка IMAP-соединения: {e}. Переподключение через {backoff} с.")
             try:
-                mail.logout()
-                print("[DEBUG] Соединение закрыто.")
-            except Exception as e:
-                print(f"[-] Ошибка при закрытии IMAP: {e}")
+                if mail is not None:
+                    mail.shutdown()
+            except Exception:
+                pass
+            mail = None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX)
+
 
 if __name__ == "__main__":
+    start_metrics("fetcher")
     try:
+        if IMAP_MODE in ("idle", "noop"):
+            run_persistent()
         while True:
             try:
                 fetch_mail()
             except Exception as e:
                 print(f"[ERROR] Ошибка при получении почты: {e}")
-            time.sleep(60)
+            time.sleep(FETCH_INTERVAL)
     except KeyboardInterrupt:
         print("Прервано пользователем.")
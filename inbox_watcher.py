@@ -0,0 +1,127 @@
+import os
+import queue
+import threading
+import time
+
+# --- попытка импортировать inotify (только Linux) ---
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+# --- НАСТРОЙКИ ---
+WATCH_QUEUE_SIZE = int(os.getenv("WATCH_QUEUE_SIZE", "256"))
+POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "1"))  # опрос папки, если inotify недоступен (scandir дешёвый)
+RESCAN_INTERVAL = float(os.getenv("WATCH_RESCAN_INTERVAL", "60"))  # страховочный пересмотр папки при inotify
+USE_INOTIFY = os.getenv("WATCH_INOTIFY", "true").lower() == "true"
+# -----------------
+
+
+def is_partial_file(filename):
+    # fetch_mail пишет вложения во временный ".имя.part" и переименовывает после записи
+    return filename.startswith('.') or filename.endswith('.part')
+
+
+# следит за папкой и складывает полностью записанные файлы в ограниченную очередь
+class InboxWatcher:
+    def __init__(self, path, maxsize=WATCH_QUEUE_SIZE, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.mode = None
+
+    def start(self):
+        inotify = None
+        if USE_INOTIFY and INotify is not None:
+            try:
+                inotify = INotify()
+                inotify.add_watch(self.path, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+            except OSError as e:
+                print(f"[-] inotify недоступен ({e}), используем опрос папки.")
+                inotify = None
+
+        if inotify is not None:
+            self.mode = "inotify"
+            target = self._run_inotify
+            args = (inotify,)
+        else:
+            self.mode = "poll"
+            target = self._run_poll
+            args = ()
+
+        self._thread = threading.Thread(target=target, args=args, name="inbox-watcher", daemon=True)
+        self._thread.start()
+        print(f"[*] Наблюдение за {self.path}: режим {self.mode}.")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def get(self, timeout=None):
+        # возвращает путь к следующему файлу или None по таймауту
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def done(self, path):
+        # файл обработан (перемещён из папки) — снова разрешаем его постановку в очередь
+        with self._lock:
+            self._pending.discard(os.path.basename(path))
+
+    def _offer(self, filename):
+        if is_partial_file(filename):
+            return
+        with self._lock:
+            if filename in self._pending:
+                return
+            self._pending.add(filename)
+        path = os.path.join(self.path, filename)
+        # блокируемся при переполнении очереди: детектор не успевает, события подождут
+        while not self._stop.is_set():
+            try:
+                self.queue.put(path, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _scan(self):
+        try:
+            with os.scandir(self.path) as entries:
+                names = sorted(entry.name for entry in entries if entry.is_file())
+        except OSError as e:
+            print(f"[-] Ошибка чтения {self.path}: {e}")
+            return
+        for name in names:
+            self._offer(name)
+
+    def _run_poll(self):
+        while not self._stop.is_set():
+            self._scan()
+            self._stop.wait(self.poll_interval)
+
+    def _run_inotify(self, inotify):
+        # файлы, появившиеся до запуска наблюдения
+        self._scan()
+        last_scan = time.time()
+        try:
+            while not self._stop.is_set():
+                events = inotify.read(timeout=1000)
+                for event in events:
+                    if event.mask & inotify_flags.Q_OVERFLOW:
+                        print("[!] Переполнение очереди inotify, пересматриваем папку.")
+                        self._scan()
+                        last_scan = time.time()
+                    elif event.name:
+                        self._offer(event.name)
+                if time.time() - last_scan >= RESCAN_INTERVAL:
+                    self._scan()
+                    last_scan = time.time()
+        finally:
+            inotify.close()
@@ -0,0 +1,282 @@
+import os
+import json
+import shutil
+import importlib
+import cv2
+import numpy as np
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+INFER_BACKEND = os.getenv("INFER_BACKEND", "pytorch")  # pytorch | onnx | openvino | модуль:Класс (свой бэкенд)
+MODEL_WEIGHTS = os.getenv("MODEL_WEIGHTS", "yolov8m.pt")
+MODEL_IMGSZ = int(os.getenv("MODEL_IMGSZ", "640"))
+INFER_INT8 = os.getenv("INFER_INT8", "false").lower() == "true"  # INT8-квантизация (onnx/openvino)
+INFER_THREADS = int(os.getenv("INFER_THREADS", "0"))  # потоков внутри операции, 0 — по умолчанию библиотеки
+MODEL_CACHE = os.path.join(DATA_DIR, "models")  # экспортированные модели
+CALIBRATION_DIR = os.path.join(DATA_DIR, "filtered")  # кадры для калибровки INT8
+CALIBRATION_FRAMES = int(os.getenv("CALIBRATION_FRAMES", "200"))
+BASE_CONFIDENCE = 0.1  # базовый очень низкий порог, пороги классов применяются позже
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+# -----------------
+
+
+def letterbox(frame, size):
+    # как в ultralytics: пропорциональное уменьшение и серые поля до квадрата size x size
+    h, w = frame.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    if (new_w, new_h) != (w, h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, left = round(pad_y - 0.1), round(pad_x - 0.1)
+    canvas = cv2.copyMakeBorder(frame, top, size - new_h - top, left, size - new_w - left,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return canvas, ratio, left, top
+
+
+def preprocess(frames, size):
+    # BGR-кадры -> NCHW float32 RGB 0..1 и параметры обратного пересчёта боксов
+    blob = np.empty((len(frames), 3, size, size), dtype=np.float32)
+    metas = []
+    for i, frame in enumerate(frames):
+        canvas, ratio, left, top = letterbox(frame, size)
+        blob[i] = canvas[:, :, ::-1].transpose(2, 0, 1) / 255.0
+        metas.append((ratio, left, top, frame.shape[1], frame.shape[0]))
+    return blob, metas
+
+
+def box_iou(a, b):
+    # попарный IoU боксов xyxy: (N, 4) x (M, 4) -> (N, M)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def nms(classes, confidences, xyxy, conf=BASE_CONFIDENCE, iou=NMS_IOU, max_det=MAX_DETECTIONS):
+    # индексы оставшихся боксов; сдвиг по классу, чтобы NMS не подавлял боксы разных классов друг другом
+    if not len(xyxy):
+        return np.zeros(0, dtype=np.intp)
+    offset = classes[:, None].astype(np.float32) * 7680
+    shifted = xyxy + offset
+    wh_boxes = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    indices = cv2.dnn.NMSBoxes(wh_boxes.tolist(), confidences.tolist(), conf, iou)
+    return np.array(indices, dtype=np.intp).reshape(-1)[:max_det]
+
+
+def postprocess(output, metas, conf=BASE_CONFIDENCE, iou=NMS_IOU, max_det=MAX_DETECTIONS):
+    # выход YOLOv8 (N, 4 + классы, якоря) -> по каждому кадру (cls, conf, xyxy) после NMS по классам
+    outputs = []
+    for prediction, (ratio, left, top, width, height) in zip(output, metas):
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences >= conf
+        boxes, classes, confidences = prediction[keep, :4], classes[keep], confidences[keep]
+
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+
+        indices = nms(classes, confidences, xyxy, conf, iou, max_det)
+        xyxy, classes, confidences = xyxy[indices], classes[indices], confidences[indices]
+
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - left) / ratio).clip(0, width)
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - top) / ratio).clip(0, height)
+        outputs.append((classes.astype(np.intp), confidences.astype(np.float32), xyxy.astype(np.float32)))
+    return outputs
+
+
+class TorchBackend:
+    name = "pytorch"
+
+    def __init__(self, weights=MODEL_WEIGHTS, imgsz=MODEL_IMGSZ, threads=INFER_THREADS):
+        from ultralytics import YOLO
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(weights)
+        self.names = self.model.names
+        self.imgsz = imgsz
+
+    def predict(self, frames, imgsz=None):
+        results = self.model(frames, conf=BASE_CONFIDENCE, imgsz=imgsz or self.imgsz, batch=len(frames))
+        outputs = []
+        for r in results:
+            boxes = r.boxes.cpu().numpy()
+            outputs.append((boxes.cls.astype(np.intp), boxes.conf.astype(np.float32), boxes.xyxy.astype(np.float32)))
+        return outputs
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_path, names, imgsz=MODEL_IMGSZ, threads=INFER_THREADS):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = names
+        self.imgsz = imgsz
+
+    def predict(self, frames, imgsz=None):
+        blob, metas = preprocess(frames, imgsz or self.imgsz)
+        output = self.session.run(None, {self.input_name: blob})[0]
+        return postprocess(output, metas)
+
+
+class OpenVinoBackend:
+    name = "openvino"
+
+    def __init__(self, model_path, names, imgsz=MODEL_IMGSZ, threads=INFER_THREADS):
+        import openvino as ov
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = ov.Core().compile_model(model_path, "CPU", config)
+        self.output = self.compiled.output(0)
+        self.names = names
+        self.imgsz = imgsz
+
+    def predict(self, frames, imgsz=None):
+        blob, metas = preprocess(frames, imgsz or self.imgsz)
+        output = self.compiled(blob)[self.output]
+        return postprocess(output, metas)
+
+
+def calibration_frames(directory=CALIBRATION_DIR, limit=CALIBRATION_FRAMES):
+    # исходные кадры (без аннотированных копий) с наших камер
+    paths = []
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")) and "_with_detections" not in filename:
+                paths.append(os.path.join(root, filename))
+                if len(paths) >= limit:
+                    return paths
+    return paths
+
+
+def iter_calibration_blobs(imgsz, directory=CALIBRATION_DIR):
+    for path in calibration_frames(directory):
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield preprocess([frame], imgsz)[0]
+
+
+def quantize_onnx(source, target, imgsz, calibration_dir=CALIBRATION_DIR):
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(source, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.blobs = iter_calibration_blobs(imgsz, calibration_dir)
+
+        def get_next(self):
+            blob = next(self.blobs, None)
+            return None if blob is None else {input_name: blob}
+
+    quantize_static(source, target, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def quantize_openvino(source, target, imgsz, calibration_dir=CALIBRATION_DIR):
+    import nncf
+    import openvino as ov
+
+    model = ov.Core().read_model(source)
+    dataset = nncf.Dataset(list(iter_calibration_blobs(imgsz, calibration_dir)))
+    quantized = nncf.quantize(model, dataset, preset=nncf.QuantizationPreset.MIXED, subset_size=CALIBRATION_FRAMES)
+    ov.save_model(quantized, target)
+
+
+def export_model(backend, weights=MODEL_WEIGHTS, imgsz=MODEL_IMGSZ, int8=INFER_INT8, calibration_dir=CALIBRATION_DIR):
+    # экспорт выполняется один раз, результат кешируется в MODEL_CACHE; -> (путь к модели, имена классов).
+    # calibration_dir — кадры для INT8-калибровки, нужны только при первом экспорте
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    cache_dir = os.path.join(MODEL_CACHE, f"{stem}_{backend}_{imgsz}{'_int8' if int8 else ''}")
+    model_file = os.path.join(cache_dir, "model.onnx" if backend == "onnx" else "model.xml")
+    names_file = os.path.join(cache_dir, "names.json")
+
+    if not (os.path.exists(model_file) and os.path.exists(names_file)):
+        from ultralytics import YOLO
+        print(f"[*] Экспорт {weights} в {backend} (imgsz={imgsz}, int8={int8})...")
+        yolo = YOLO(weights)
+        exported = yolo.export(format=backend, imgsz=imgsz, dynamic=True)
+        tmp_dir = cache_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        tmp_model = os.path.join(tmp_dir, os.path.basename(model_file))
+
+        if backend == "onnx":
+            shutil.move(exported, tmp_model)
+        else:
+            xml = next(f for f in os.listdir(exported) if f.endswith(".xml"))
+            shutil.move(os.path.join(exported, xml), tmp_model)
+            shutil.move(os.path.join(exported, xml[:-4] + ".bin"), tmp_model[:-4] + ".bin")
+            shutil.rmtree(exported, ignore_errors=True)
+
+        if int8:
+            if not calibration_frames(calibration_dir, limit=1):
+                raise RuntimeError(f"нет кадров для калибровки INT8 в {calibration_dir}")
+            print(f"[*] INT8-калибровка на кадрах из {calibration_dir}...")
+            fp32_model = tmp_model.replace("model.", "model_fp32.")
+            os.replace(tmp_model, fp32_model)
+            if backend == "onnx":
+                quantize_onnx(fp32_model, tmp_model, imgsz, calibration_dir)
+            else:
+                os.replace(tmp_model[:-4] + ".bin", fp32_model[:-4] + ".bin")
+                quantize_openvino(fp32_model, tmp_model, imgsz, calibration_dir)
+                os.remove(fp32_model[:-4] + ".bin")
+            os.remove(fp32_model)
+
+        with open(os.path.join(tmp_dir, "names.json"), "w") as f:
+            json.dump({str(k): v for k, v in yolo.names.items()}, f)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+        print(f"[+] Модель сохранена в {cache_dir}")
+
+    with open(names_file) as f:
+        names = {int(k): v for k, v in json.load(f).items()}
+    return model_file, names
+
+
+def load_backend(name=INFER_BACKEND, weights=MODEL_WEIGHTS, imgsz=MODEL_IMGSZ, int8=INFER_INT8, threads=INFER_THREADS,
+                 calibration_dir=CALIBRATION_DIR):
+    if ":" in name:
+        # внешний класс с тем же интерфейсом (imgsz, names, predict), например заменитель модели в замерах
+        module_name, _, class_name = name.partition(":")
+        backend = getattr(importlib.import_module(module_name), class_name)(imgsz)
+        print(f"[*] Бэкенд инференса: {name}")
+        return backend
+    name = name.lower()
+    if name in ("onnx", "openvino"):
+        try:
+            model_file, names = export_model(name, weights, imgsz, int8, calibration_dir)
+            backend_class = OnnxBackend if name == "onnx" else OpenVinoBackend
+            backend = backend_class(model_file, names, imgsz, threads)
+            print(f"[*] Бэкенд инференса: {name}{' INT8' if int8 else ''}, {model_file}")
+            return backend
+        except Exception as e:
+            print(f"[-] Бэкенд {name} недоступен ({e}), используем PyTorch.")
+    elif name != "pytorch":
+        print(f"[-] Неизвестный бэкенд {name}, используем PyTorch.")
+    print(f"[*] Бэкенд инференса: pytorch, {weights}")
+    return TorchBackend(weights, imgsz, threads)
+
+
+def warmup(backend, imgsz=None, runs=2):
+    # первые проходы медленные (выделение памяти, JIT), делаем их до первого реального кадра
+    size = imgsz or backend.imgsz
+    frame = np.full((size, size, 3), 114, dtype=np.uint8)
+    for _ in range(runs):
+        backend.predict([frame], size)
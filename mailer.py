@@ -2,54 +2,250 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
+from email import encoders, policy
 import os
+import time
+import json
+import threading
+from metrics import STAGE_SECONDS, MAILS_SENT, MAIL_SPOOL_DEPTH, count_files
 
 # --- НАСТРОЙКИ (переменные окружения) ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
 EMAIL_HOST = os.getenv("SMTP_SERVER_OUT")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT_OUT", 587))
 EMAIL_ACCOUNT = os.getenv("EMAIL_ACCOUNT_OUT")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD_OUT")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"  # false — для локального тестового SMTP
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_IDLE_CHECK = 30  # после стольких секунд простоя соединение проверяется через NOOP
+MAIL_SPOOL = os.path.join(DATA_DIR, "mail-spool")  # письма, ожидающие отправки
+MAIL_RETRY_BASE = 30
+MAIL_RETRY_MAX = 1800
+MAIL_POLL_INTERVAL = 2  # проверка спула на письма, поставленные другими процессами
 # -------------------------------------
 
-# Изменена функция: теперь она принимает список recipients
-def send_mail(subject, body, recipients, attachments=[]):
+
+def build_message(subject, body, attachments):
+    # MIME и base64 вложений собираются один раз; заголовок To добавляется на каждого получателя отдельно
+    # policy.SMTP уже при сборке: заголовки по-русски кодируются (RFC 2047), а не роняют as_bytes
+    msg = MIMEMultipart(policy=policy.SMTP)
+    msg['From'] = EMAIL_ACCOUNT
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+
+    # Прикрепляем файлы
+    for attachment_path in attachments:
+        if not os.path.exists(attachment_path):
+            print(f"[-] Файл вложения не найден: {attachment_path}")
+            continue
+
+        part = MIMEBase('application', 'octet-stream')
+        with open(attachment_path, 'rb') as file:
+            part.set_payload(file.read())
+
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(attachment_path)}")
+        msg.attach(part)
+
+    return msg.as_bytes(policy=policy.SMTP)
+
+
+def with_recipients(message, recipients):
+    return f"To: {', '.join(recipients)}\r\n".encode() + message
+
+
+# одно авторизованное SMTP-соединение на процесс, переподключение при обрыве
+class SMTPSession:
+    def __init__(self):
+        self.server = None
+        self.last_used = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.close()
+        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        server.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
+        self.server = server
+
+    def _ensure_connected(self):
+        if self.server is not None and time.monotonic() - self.last_used > SMTP_IDLE_CHECK:
+            try:
+                if self.server.noop()[0] != 250:
+                    self.server = None
+            except (smtplib.SMTPException, OSError):
+                self.server = None
+        if self.server is None:
+            self._connect()
+
+    def sendmail(self, recipients, message):
+        # recipients и message — один конверт; при обрыве соединения одна попытка переподключиться
+        with self._lock:
+            for attempt in range(2):
+                self._ensure_connected()
+                try:
+                    with STAGE_SECONDS.time(stage="smtp"):
+                        self.server.sendmail(EMAIL_ACCOUNT, recipients, message)
+                    self.last_used = time.monotonic()
+                    return
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self.server = None
+                    if attempt:
+                        raise
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+_session = SMTPSession()
+
+
+def settings_complete(recipients):
     # Проверяем, что все нужные переменные окружения заданы
     if not all([EMAIL_HOST, EMAIL_ACCOUNT, EMAIL_PASSWORD, recipients]):
         print("[-] Ошибка: Настройки email неполные. Проверьте переменные окружения.")
-        return
+        return False
+    return True
 
-    try:
-        # Создаем сообщение
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_ACCOUNT
-        # Объединяем список получателей в одну строку через запятую
-        msg['To'] = ", ".join(recipients) 
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Прикрепляем файлы
-        for attachment_path in attachments:
-            if not os.path.exists(attachment_path):
-                print(f"[-] Файл вложения не найден: {attachment_path}")
+
+# фоновая отправка: письмо собирается один раз, сохраняется в MAIL_SPOOL и
+# рассылается отдельными конвертами каждому получателю по общему соединению
+class MailOutbox:
+    def __init__(self, spool=MAIL_SPOOL, session=None):
+        self.spool = spool
+        self.session = session or _session
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(spool, exist_ok=True)
+
+    def start(self):
+        MAIL_SPOOL_DEPTH.set_function(lambda: count_files(self.spool, ".json"))
+        self._thread = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+        self.session.close()
+
+    def submit(self, subject, body, recipients, attachments=[]):
+        recipients = [r.strip() for r in recipients if r and r.strip()]  # пустые адреса пропускаем
+        if not settings_complete(recipients):
+            return None
+
+        # в спул пишут все процессы детектора: к времени (по нему flush сортирует очередь) добавляются pid и случайный суффикс
+        entry_id = f"{time.time_ns()}_{os.getpid()}_{os.urandom(4).hex()}"
+        message_path = os.path.join(self.spool, f"{entry_id}.eml")
+        with open(message_path, "xb") as f:
+            f.write(build_message(subject, body, attachments))
+        self._write_entry(entry_id, {"subject": subject, "recipients": recipients, "attempts": 0, "next_try": 0})
+        self._wake.set()
+        return entry_id
+
+    def _write_entry(self, entry_id, data):
+        tmp_path = os.path.join(self.spool, f".{entry_id}.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(self.spool, f"{entry_id}.json"))
+
+    def _remove_entry(self, entry_id):
+        for ext in (".json", ".eml"):
+            try:
+                os.remove(os.path.join(self.spool, entry_id + ext))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        # один проход по спулу; возвращает время до ближайшей повторной попытки или None
+        with os.scandir(self.spool) as entries:
+            entry_ids = sorted(e.name[:-len(".json")] for e in entries if e.name.endswith(".json") and not e.name.startswith('.'))
+
+        next_due = None
+        for entry_id in entry_ids:
+            if self._stop.is_set():
+                break
+            try:
+                with open(os.path.join(self.spool, f"{entry_id}.json")) as f:
+                    data = json.load(f)
+                with open(os.path.join(self.spool, f"{entry_id}.eml"), "rb") as f:
+                    message = f.read()
+            except (OSError, ValueError) as e:
+                print(f"[-] Повреждённое письмо в спуле {entry_id}: {e}. Удаляем.")
+                self._remove_entry(entry_id)
                 continue
-            
-            part = MIMEBase('application', 'octet-stream')
-            with open(attachment_path, 'rb') as file:
-                part.set_payload(file.read())
-            
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(attachment_path)}")
-            msg.attach(part)
-
-        # Подключаемся к серверу, входим в аккаунт и отправляем письмо
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-            # Отправляем письмо всем получателям
-            server.sendmail(EMAIL_ACCOUNT, recipients, msg.as_string())
-        
-        print("[+] Письмо успешно отправлено.")
 
+            wait = data["next_try"] - time.time()
+            if wait > 0:
+                next_due = wait if next_due is None else min(next_due, wait)
+                continue
+
+            remaining = []
+            for receiver in data["recipients"]:
+                try:
+                    self.session.sendmail([receiver], with_recipients(message, [receiver]))
+                    MAILS_SENT.inc(result="ok")
+                    print(f"[+] Письмо '{data['subject']}' отправлено: {receiver}.")
+                except smtplib.SMTPRecipientsRefused as e:
+                    MAILS_SENT.inc(result="refused")
+                    print(f"[-] Получатель {receiver} отклонён сервером: {e}")
+                except Exception as e:
+                    MAILS_SENT.inc(result="failed")
+                    print(f"[-] Ошибка при отправке письма {receiver}: {e}")
+                    remaining.append(receiver)
+
+            if not remaining:
+                self._remove_entry(entry_id)
+                continue
+
+            data["attempts"] += 1
+            delay = min(MAIL_RETRY_BASE * 2 ** (data["attempts"] - 1), MAIL_RETRY_MAX)
+            data.update(recipients=remaining, next_try=time.time() + delay)
+            self._write_entry(entry_id, data)
+            print(f"[!] Письмо '{data['subject']}' осталось в спуле, повтор через {delay} с.")
+            next_due = delay if next_due is None else min(next_due, delay)
+        return next_due
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                next_due = self.flush()
+            except Exception as e:
+                print(f"[-] Ошибка обработки спула писем: {e}")
+                next_due = MAIL_RETRY_BASE
+            self._wake.wait(MAIL_POLL_INTERVAL if next_due is None else min(next_due, MAIL_POLL_INTERVAL))
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox(start=True):
+    # start=False — процесс только кладёт письма в спул, отправляет их другой процесс на том же /data
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = MailOutbox()
+        if start and _outbox._thread is None:
+            _outbox.start()
+        return _outbox
+
+
+def queue_mail(subject, body, recipients, attachments=[], send=True):
+    # не блокирует вызывающий поток: письмо уходит в спул и отправляется фоновым потоком
+    try:
+        return get_outbox(start=send).submit(subject, body, recipients, attachments)
     except Exception as e:
-        print(f"[-] Ошибка при отправке письма: {e}")
+        # письмо не должно мешать остальным уведомлениям (Telegram отправляется после)
+        print(f"[-] Не удалось поставить письмо '{subject}' в спул: {e}")
+        return None
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- НАСТРОЙКИ ---
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # /metrics в формате Prometheus, 0 — без HTTP
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))  # JSON-строка со сводкой, 0 — не писать
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG включает подробный вывод в горячих местах
+METRICS_PREFIX = "fotomon_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# -----------------
+
+REGISTRY = []
+
+
+def setup_logging():
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), format="%(message)s")
+
+
+def format_labels(labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}" if labels else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = METRICS_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + "_total", self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        # значение считается при чтении метрик (например, число файлов в папке), а не в горячем пути
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [(self.name, [], self._function())]
+            except OSError:
+                return []
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = state[0]
+            index = 0
+            while index < len(self.buckets) and value > self.buckets[index]:
+                index += 1
+            counts[index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q, counts, total):
+        # оценка по корзинам с линейной интерполяцией внутри корзины, как histogram_quantile в Prometheus
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total_sum, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                result.append((self.name + "_bucket", labels + [("le", f"{upper:g}")], cumulative))
+            result.append((self.name + "_bucket", labels + [("le", "+Inf")], count))
+            result.append((self.name + "_sum", labels, total_sum))
+            result.append((self.name + "_count", labels, count))
+        return result
+
+    def summary(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        return {",".join(key) or "all": {"count": count, "sum": round(total_sum, 4),
+                                         "p50": round(self.quantile(0.5, counts, count), 4),
+                                         "p99": round(self.quantile(0.99, counts, count), 4)}
+                for key, counts, total_sum, count in items if count}
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        samples = metric.samples()
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in samples:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    # сводка для JSON-строки журнала: счётчики и датчики как есть, гистограммы — count/sum/p50/p99
+    result = {}
+    for metric in REGISTRY:
+        short_name = metric.name[len(METRICS_PREFIX):]
+        if isinstance(metric, Histogram):
+            summary = metric.summary()
+            if summary:
+                result[short_name] = summary
+            continue
+        samples = metric.samples()
+        if not samples:
+            continue
+        if metric.labelnames:
+            result[short_name] = {",".join(str(v) for _, v in labels): value for _, labels, value in samples}
+        else:
+            result[short_name] = samples[0][2]
+    return result
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _log_loop(service, interval):
+    logger = logging.getLogger("metrics")
+    while True:
+        time.sleep(interval)
+        logger.info(json.dumps({"ts": round(time.time(), 3), "service": service, "pid": os.getpid(),
+                                "metrics": snapshot()}, ensure_ascii=False))
+
+
+def start_metrics(service, port=METRICS_PORT, log_interval=METRICS_LOG_INTERVAL):
+    # HTTP /metrics и периодическая JSON-сводка в журнал, оба в фоновых потоках
+    setup_logging()
+    if port:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[*] Метрики {service}: http://{METRICS_HOST}:{port}/metrics")
+        except OSError as e:
+            print(f"[-] Не удалось открыть порт метрик {port}: {e}")
+    if log_interval:
+        threading.Thread(target=_log_loop, args=(service, log_interval), name="metrics-log", daemon=True).start()
+
+
+def count_files(path, suffix=""):
+    # файлов в папке без временных (".имя", ".part")
+    with os.scandir(path) as entries:
+        return sum(1 for entry in entries
+                   if entry.name.endswith(suffix) and not entry.name.startswith('.') and not entry.name.endswith('.part'))
+
+
+# --- метрики конвейера ---
+STAGE_SECONDS = Histogram("stage_seconds", "Длительность этапа обработки, с", ["stage"])
+EMAILS_FETCHED = Counter("emails_fetched", "Писем с камер забрано из IMAP")
+IMAGES_SAVED = Counter("images_saved", "Кадров сохранено в INBOX")
+IMAGES_DEDUPLICATED = Counter("images_deduplicated", "Кадров отброшено как визуальные дубликаты")
+IMAGES_PROCESSED = Counter("images_processed", "Кадров обработано детектором", ["result"])
+ALERTS_SUPPRESSED = Counter("alerts_suppressed", "Кадров без уведомления: объекты на прежних местах")
+NOTIFICATIONS = Counter("notifications", "Уведомлений о событиях поставлено в отправку", ["channel"])
+TELEGRAM_CALLS = Counter("telegram_calls", "Вызовов Telegram Bot API", ["method", "result"])
+MAILS_SENT = Counter("mails_sent", "Писем отправлено получателям", ["result"])
+INBOX_DEPTH = Gauge("inbox_depth", "Файлов в INBOX")
+TELEGRAM_QUEUE_DEPTH = Gauge("telegram_queue_depth", "Уведомлений в очереди повтора Telegram")
+MAIL_SPOOL_DEPTH = Gauge("mail_spool_depth", "Писем в спуле")
+NOTIFY_PENDING = Gauge("notify_pending", "Событий в окне объединения и в отправке Telegram")
@@ -0,0 +1,182 @@
+import os
+import io
+import json
+import time
+import fcntl
+import random
+import threading
+from contextlib import contextmanager
+import cv2
+import numpy as np
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+MOTION_GATE = os.getenv("MOTION_GATE", "true").lower() == "true"  # не гонять через YOLO кадры без изменений
+MOTION_WIDTH = int(os.getenv("MOTION_WIDTH", "160"))  # ширина уменьшенного серого кадра
+MOTION_ALPHA = float(os.getenv("MOTION_ALPHA", "0.1"))  # скорость обновления фона
+MOTION_PIXEL_DIFF = int(os.getenv("MOTION_PIXEL_DIFF", "25"))  # разница яркости, с которой пиксель считается изменившимся
+MOTION_MIN_AREA = float(os.getenv("MOTION_MIN_AREA", "0.003"))  # доля кадра под самым крупным изменившимся пятном
+MOTION_MAX_AGE = float(os.getenv("MOTION_MAX_AGE", "1800"))  # фон старше стольких секунд не используется
+MOTION_AUDIT_RATE = float(os.getenv("MOTION_AUDIT_RATE", "0.05"))  # доля пропускаемых кадров, которые всё же проверяются моделью
+MOTION_SAVE_INTERVAL = 60
+MOTION_STATE = os.path.join(DATA_DIR, "motion-state.npz")
+MOTION_LOG = os.path.join(DATA_DIR, "motion-log")  # решения по камерам, JSON lines
+# -----------------
+
+
+# фон каждой камеры — скользящее среднее уменьшенных серых кадров; кадр считается
+# изменившимся, если самое крупное пятно разницы с фоном занимает не меньше min_area кадра.
+# Файл состояния общий для всех обработчиков: сохранение идёт под flock и сливается с тем,
+# что записали другие процессы (по каждой камере остаётся фон с более поздним кадром)
+class MotionGate:
+    def __init__(self, state_path=MOTION_STATE, log_dir=MOTION_LOG):
+        self.state_path = state_path
+        self.log_dir = log_dir
+        self.backgrounds = {}  # камера -> (фон float32, время последнего кадра)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self._mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+        self.load()
+
+    @contextmanager
+    def _locked(self):
+        with open(f"{self.state_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @staticmethod
+    def prepare(frame, bounds=None):
+        if bounds is not None:
+            x1, y1, x2, y2 = bounds
+            frame = frame[y1:y2, x1:x2]
+        height = max(round(frame.shape[0] * MOTION_WIDTH / frame.shape[1]), 1)
+        small = cv2.resize(frame, (MOTION_WIDTH, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def check(self, camera_name, frame, bounds=None, min_area=MOTION_MIN_AREA, now=None):
+        # -> запись решения: changed, area (доля кадра), пороги и audit для пропускаемых кадров
+        now = time.time() if now is None else now
+        gray = self.prepare(frame, bounds)
+        record = {"time": round(now, 3), "pixel_diff": MOTION_PIXEL_DIFF, "min_area": min_area}
+
+        with self._lock:
+            background, seen = self.backgrounds.get(camera_name, (None, 0))
+            if background is None or background.shape != gray.shape or now - seen > MOTION_MAX_AGE:
+                record.update(changed=True, area=None, reason="no_background")
+                background = gray.astype(np.float32)
+            else:
+                diff = cv2.absdiff(gray, cv2.convertScaleAbs(background))
+                _, changed = cv2.threshold(diff, MOTION_PIXEL_DIFF, 255, cv2.THRESH_BINARY)
+                changed = cv2.dilate(changed, None, iterations=2)
+                contours, _ = cv2.findContours(changed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                area = max((cv2.contourArea(c) for c in contours), default=0.0) / gray.size
+                record.update(changed=area >= min_area, area=round(area, 5))
+                cv2.accumulateWeighted(gray, background, MOTION_ALPHA)
+            self.backgrounds[camera_name] = (background, now)
+            self.dirty = True
+
+        if not record["changed"]:
+            record["audit"] = random.random() < MOTION_AUDIT_RATE
+        return record
+
+    def log(self, camera_name, record):
+        try:
+            with open(os.path.join(self.log_dir, f"{camera_name}.jsonl"), "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[-] Не удалось записать журнал детектора движения {camera_name}: {e}")
+
+    def _read(self):
+        # -> фон камер из файла, если его изменил другой процесс, иначе {}
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime == self._mtime:
+            return {}
+        backgrounds = {}
+        try:
+            with np.load(self.state_path) as state:
+                for key in state.files:
+                    if key.endswith("/seen"):
+                        continue
+                    backgrounds[key] = (state[key].astype(np.float32), float(state[f"{key}/seen"]))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[-] Не удалось загрузить фон камер {self.state_path}: {e}")
+            return {}
+        self._mtime = mtime
+        return backgrounds
+
+    def _merge(self, backgrounds):
+        for camera_name, (background, seen) in backgrounds.items():
+            if seen > self.backgrounds.get(camera_name, (None, 0))[1]:
+                self.backgrounds[camera_name] = (background, seen)
+
+    def load(self):
+        with self._locked():
+            backgrounds = self._read()
+        with self._lock:
+            self._merge(backgrounds)
+
+    def save(self, force=False):
+        # не чаще раза в MOTION_SAVE_INTERVAL секунд, фон меняется медленно
+        with self._lock:
+            if not self.dirty or (not force and time.monotonic() - self.saved_at < MOTION_SAVE_INTERVAL):
+                return
+        with self._locked():
+            backgrounds = self._read()
+            with self._lock:
+                self._merge(backgrounds)
+                arrays = {}
+                for camera_name, (background, seen) in self.backgrounds.items():
+                    arrays[camera_name] = background
+                    arrays[f"{camera_name}/seen"] = np.float64(seen)
+                self.dirty = False
+                self.saved_at = time.monotonic()
+            buffer = io.BytesIO()
+            np.savez(buffer, **arrays)
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(buffer.getvalue())
+                os.replace(tmp_path, self.state_path)
+                self._mtime = os.stat(self.state_path).st_mtime_ns
+            except OSError as e:
+                print(f"[-] Не удалось сохранить фон камер {self.state_path}: {e}")
+
+
+def summarize(log_dir=MOTION_LOG, since=0):
+    # сэкономленные проходы модели и пропущенные события (по выборочной проверке) на камеру
+    print(f"{'камера':<12}{'кадров':>8}{'пропущено':>11}{'экономия':>10}{'проверено':>11}{'с объектами':>13}{'оценка потерь':>15}")
+    for filename in sorted(os.listdir(log_dir)):
+        if not filename.endswith(".jsonl"):
+            continue
+        total = skipped = audited = missed = 0
+        with open(os.path.join(log_dir, filename)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["time"] < since:
+                    continue
+                total += 1
+                if record["changed"]:
+                    continue
+                skipped += 1
+                if record.get("audit"):
+                    audited += 1
+                    missed += bool(record.get("found"))
+        saved = (skipped - audited) / total if total else 0.0
+        miss_rate = missed / audited if audited else 0.0
+        print(f"{filename[:-6]:<12}{total:>8}{skipped:>11}{saved:>10.0%}{audited:>11}{missed:>13}{miss_rate:>15.1%}")
+
+
+if __name__ == "__main__":
+    import sys
+    # python motion_gate.py [часов] — сводка по журналам решений за последние N часов
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    summarize(since=time.time() - hours * 3600)
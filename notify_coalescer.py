@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+
+# --- НАСТРОЙКИ ---
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "3"))  # секунд ожидания остальных кадров события, 0 — без объединения
+NOTIFY_COALESCE_MAX = 10  # кадров в событии, после которых оно отправляется сразу (предел sendMediaGroup)
+# -----------------
+
+
+# кадры одного тревожного письма (камера, дата и время события) собираются в одно уведомление:
+# первое появление события открывает окно, по его истечении deliver получает все кадры и объединённые метки.
+# События живут только в памяти процесса: перед выходом нужен stop(), он отправляет всё накопленное
+class NotificationCoalescer:
+    def __init__(self, deliver, window=NOTIFY_COALESCE_WINDOW, max_frames=NOTIFY_COALESCE_MAX):
+        self.deliver = deliver
+        self.window = window
+        self.max_frames = max_frames
+        self._events = {}  # ключ события -> {"deadline", "frames", "labels", "context"}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._delivering = 0  # событий, переданных в deliver и ещё не вернувшихся
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="notify-coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def add(self, key, frame, labels, context=None):
+        # frame — (путь, байты или None); context передаётся в deliver как есть (например, настройки камеры)
+        with self._cond:
+            if self._thread is None and self.window > 0:
+                self.start()
+            event = self._events.get(key)
+            if event is None:
+                event = {"deadline": time.monotonic() + self.window, "frames": [], "labels": [], "context": context}
+                self._events[key] = event
+                self._cond.notify()
+            event["frames"].append(frame)
+            event["labels"].extend(label for label in labels if label not in event["labels"])
+            ready = self.window <= 0 or len(event["frames"]) >= self.max_frames
+            if ready:
+                del self._events[key]
+                self._delivering += 1
+        if ready:
+            self._deliver(key, event)
+
+    def has(self, key):
+        with self._cond:
+            return key in self._events
+
+    def pending(self):
+        # события в окне и в deliver: пока не 0, уведомления ещё будут
+        with self._cond:
+            return len(self._events) + self._delivering
+
+    def flush(self):
+        with self._cond:
+            events = list(self._events.items())
+            self._events.clear()
+            self._delivering += len(events)
+        for key, event in events:
+            self._deliver(key, event)
+
+    def _deliver(self, key, event):
+        # счётчик _delivering увеличивается там же, где событие забирается из _events,
+        # чтобы pending() не видел промежутка между ними
+        try:
+            self.deliver(key, event["frames"], event["labels"], event["context"])
+        except Exception as e:
+            print(f"[-] Ошибка отправки уведомления {key}: {e}")
+        finally:
+            with self._cond:
+                self._delivering -= 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.monotonic()
+                    due = [key for key, event in self._events.items() if event["deadline"] <= now]
+                    if due:
+                        break
+                    next_deadline = min((event["deadline"] for event in self._events.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                if self._stop:
+                    return
+                events = [(key, self._events.pop(key)) for key in due]
+                self._delivering += len(events)
+            for key, event in events:
+                self._deliver(key, event)
@@ -0,0 +1,114 @@
+import os
+import io
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+from inference_backend import box_iou
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+OBJECT_TRACKING = os.getenv("OBJECT_TRACKING", "true").lower() == "true"  # не уведомлять о стоящих на месте объектах
+TRACK_IOU = float(os.getenv("TRACK_IOU", "0.6"))  # IoU с прежним боксом того же класса, при котором объект «на месте»
+TRACK_TTL = float(os.getenv("TRACK_TTL", "1800"))  # объект, не виденный столько секунд, снова считается новым
+TRACK_MAX = 200  # треков на камеру, сверх — забываются давно не виденные
+TRACK_STATE = os.path.join(DATA_DIR, "tracks.npz")
+# -----------------
+
+
+# треки камеры — три массива одной длины: боксы (N, 4), классы (N,), время последнего появления (N,).
+# Состояние лежит в файле и общее для всех обработчиков: каждое обновление идёт под flock,
+# файл перечитывается, только если его изменил другой процесс
+class ObjectTracker:
+    def __init__(self, path=TRACK_STATE, iou=TRACK_IOU, ttl=TRACK_TTL, max_tracks=TRACK_MAX):
+        self.path = path
+        self.iou = iou
+        self.ttl = ttl
+        self.max_tracks = max_tracks
+        self.cameras = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _tracks(self, camera_name):
+        empty = (np.zeros((0, 4), np.float32), np.zeros(0, np.int32), np.zeros(0, np.float64))
+        return self.cameras.get(camera_name, empty)
+
+    def update(self, camera_name, classes, boxes, now=None):
+        # -> маска новых или сдвинувшихся объектов среди boxes; совпавшие треки продлеваются
+        now = time.time() if now is None else now
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        classes = np.asarray(classes, dtype=np.int32)
+        with self._locked():
+            self._reload()
+            tracked_boxes, tracked_classes, last_seen = self._tracks(camera_name)
+            alive = last_seen >= now - self.ttl
+            tracked_boxes, tracked_classes, last_seen = tracked_boxes[alive], tracked_classes[alive], last_seen[alive]
+
+            new = np.ones(len(boxes), dtype=bool)
+            if len(boxes) and len(tracked_boxes):
+                iou = box_iou(boxes, tracked_boxes)
+                iou[classes[:, None] != tracked_classes[None, :]] = 0
+                # жадно по убыванию IoU: каждый трек подтверждает не больше одного бокса
+                while True:
+                    i, j = np.unravel_index(iou.argmax(), iou.shape)
+                    if iou[i, j] < self.iou:
+                        break
+                    new[i] = False
+                    tracked_boxes[j] = boxes[i]
+                    last_seen[j] = now
+                    iou[i, :] = 0
+                    iou[:, j] = 0
+
+            tracked_boxes = np.concatenate([tracked_boxes, boxes[new]])
+            tracked_classes = np.concatenate([tracked_classes, classes[new]])
+            last_seen = np.concatenate([last_seen, np.full(new.sum(), now)])
+            if len(last_seen) > self.max_tracks:
+                keep = np.argsort(last_seen)[-self.max_tracks:]
+                tracked_boxes, tracked_classes, last_seen = tracked_boxes[keep], tracked_classes[keep], last_seen[keep]
+            self.cameras[camera_name] = (tracked_boxes, tracked_classes, last_seen)
+            self._save()
+        return new
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with np.load(self.path) as state:
+                cameras = {}
+                for key in state.files:
+                    camera_name, _, field = key.rpartition("/")
+                    if field == "boxes":
+                        cameras[camera_name] = (state[key], state[f"{camera_name}/classes"], state[f"{camera_name}/last_seen"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[-] Не удалось загрузить треки объектов {self.path}: {e}")
+            return
+        self.cameras = cameras
+        self._mtime = mtime
+
+    def _save(self):
+        arrays = {}
+        for camera_name, (boxes, classes, last_seen) in self.cameras.items():
+            arrays[f"{camera_name}/boxes"] = boxes
+            arrays[f"{camera_name}/classes"] = classes
+            arrays[f"{camera_name}/last_seen"] = last_seen
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"[-] Не удалось сохранить треки объектов {self.path}: {e}")
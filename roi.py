@@ -0,0 +1,118 @@
+import os
+import math
+import cv2
+import numpy as np
+from inference_backend import nms
+
+# --- НАСТРОЙКИ ---
+TILE_MAX_ASPECT = float(os.getenv("ROI_TILE_MAX_ASPECT", "2.0"))  # вытянутая зона режется на тайлы
+TILE_OVERLAP = float(os.getenv("ROI_TILE_OVERLAP", "0.1"))  # перекрытие соседних тайлов
+MAX_TILES = 4
+MASK_COLOR = (114, 114, 114)  # как поля letterbox, модель на нём ничего не находит
+# -----------------
+
+# Зона интереса камеры — ключ "roi" в CAMERA_SETTINGS, список областей:
+#   [x1, y1, x2, y2]              — прямоугольник
+#   [[x, y], [x, y], [x, y], ...] — многоугольник
+# Координаты в долях кадра (все значения <= 1) или в пикселях.
+# Модель получает только вырез по общей рамке областей, вне многоугольников кадр закрашивается.
+
+
+def region_polygon(region, width, height):
+    points = np.asarray(region, dtype=np.float32)
+    if points.ndim == 1:
+        x1, y1, x2, y2 = points
+        points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+    if points.max() <= 1.0:
+        points = points * (width, height)
+    return np.round(points).astype(np.int32)
+
+
+def is_rectangle(region):
+    return np.asarray(region).ndim == 1
+
+
+class RoiPlan:
+    # как резать кадр камеры заданного размера: тайлы (x1, y1, x2, y2) и маска зоны
+    def __init__(self, regions, width, height, tiles=None):
+        self.width = width
+        self.height = height
+        self.polygons = [region_polygon(region, width, height) for region in regions]
+        points = np.concatenate(self.polygons)
+        x1, y1 = np.clip(points.min(axis=0), 0, (width, height))
+        x2, y2 = np.clip(points.max(axis=0), 0, (width, height))
+        self.bounds = (int(x1), int(y1), int(x2), int(y2))
+
+        self.mask = None
+        if not all(is_rectangle(region) for region in regions):
+            self.mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+            cv2.fillPoly(self.mask, [p - (x1, y1) for p in self.polygons], 255)
+        self.tiles = plan_tiles(self.bounds, tiles)
+
+    def crops(self, frame):
+        # -> [(вырез, (сдвиг_x, сдвиг_y))]
+        x1, y1, x2, y2 = self.bounds
+        area = frame[y1:y2, x1:x2]
+        if self.mask is not None:
+            area = area.copy()
+            area[self.mask == 0] = MASK_COLOR
+        return [(area[ty1 - y1:ty2 - y1, tx1 - x1:tx2 - x1], (tx1, ty1)) for tx1, ty1, tx2, ty2 in self.tiles]
+
+    def inside(self, xyxy):
+        # центр бокса внутри одной из областей
+        centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+        keep = np.zeros(len(xyxy), dtype=bool)
+        for polygon in self.polygons:
+            contour = polygon.reshape(-1, 1, 2).astype(np.float32)
+            keep |= [cv2.pointPolygonTest(contour, (float(x), float(y)), False) >= 0 for x, y in centers]
+        return keep
+
+    def merge(self, outputs, offsets):
+        # детекции тайлов -> координаты полного кадра, NMS на стыках тайлов, только боксы в зоне
+        classes = np.concatenate([o[0] for o in outputs])
+        confidences = np.concatenate([o[1] for o in outputs])
+        xyxy = np.concatenate([o[2] + np.tile(offset, 2).astype(np.float32) for o, offset in zip(outputs, offsets)])
+        if len(outputs) > 1:
+            keep = nms(classes, confidences, xyxy)
+            classes, confidences, xyxy = classes[keep], confidences[keep], xyxy[keep]
+        if len(xyxy):
+            keep = self.inside(xyxy)
+            classes, confidences, xyxy = classes[keep], confidences[keep], xyxy[keep]
+        return classes, confidences, xyxy
+
+
+def plan_tiles(bounds, tiles=None):
+    # вдоль длинной стороны, чтобы каждый тайл был близок к квадрату и не терял разрешение в letterbox
+    x1, y1, x2, y2 = bounds
+    width, height = x2 - x1, y2 - y1
+    long_side, short_side = max(width, height), max(min(width, height), 1)
+    if tiles is None:
+        tiles = 1 if long_side / short_side <= TILE_MAX_ASPECT else min(math.ceil(long_side / short_side), MAX_TILES)
+    if tiles <= 1:
+        return [bounds]
+
+    # tiles тайлов длины size с перекрытием TILE_OVERLAP покрывают long_side
+    size = math.ceil(long_side / (tiles - (tiles - 1) * TILE_OVERLAP))
+    step = (long_side - size) / (tiles - 1)
+    result = []
+    for i in range(tiles):
+        start = round(i * step)
+        if width >= height:
+            result.append((x1 + start, y1, x1 + start + size, y2))
+        else:
+            result.append((x1, y1 + start, x2, y1 + start + size))
+    return result
+
+
+_plans = {}
+
+
+def roi_plan(camera_settings, width, height):
+    # план кешируется по настройкам камеры и размеру кадра: маска и тайлы считаются один раз
+    regions = camera_settings.get("roi")
+    if not regions:
+        return None
+    key = (id(camera_settings), width, height)
+    if key not in _plans:
+        _plans[key] = RoiPlan(regions, width, height, camera_settings.get("tiles"))
+    return _plans[key]
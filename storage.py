@@ -0,0 +1,248 @@
+import os
+import time
+import fcntl
+import shutil
+import tarfile
+import argparse
+import threading
+from datetime import datetime, date, timedelta
+
+# --- НАСТРОЙКИ ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+STORAGE_BUCKETS = {name: os.path.join(DATA_DIR, name) for name in ("filtered", "rejected", "skipped")}
+# сколько дней хранить кадры в каждой папке, 0 — бессрочно
+RETENTION_DAYS = {
+    "filtered": int(os.getenv("RETENTION_FILTERED_DAYS", "0")),
+    "rejected": int(os.getenv("RETENTION_REJECTED_DAYS", "14")),
+    "skipped": int(os.getenv("RETENTION_SKIPPED_DAYS", "3")),
+}
+COMPACT_AFTER_DAYS = int(os.getenv("COMPACT_AFTER_DAYS", "7"))  # дни старше упаковываются в .tar, 0 — не упаковывать
+MAINTENANCE_INTERVAL = float(os.getenv("STORAGE_MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_LOCK = os.path.join(DATA_DIR, ".storage-maintenance.lock")
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%Y.%m.%d", "%d.%m.%Y", "%Y%m%d", "%d%m%Y")
+UNKNOWN_CAMERA = "unknown"
+# -----------------
+
+# Раскладка: <папка>/<камера>/<ГГГГ-ММ-ДД>/<файл> по имени camera_date_time_index.ext;
+# упакованный день — <папка>/<камера>/<ГГГГ-ММ-ДД>.tar. Любая операция затрагивает одну камеру
+# и один день, а не всю историю.
+
+
+def normalize_date(event_date, fallback=None):
+    # дата из письма регистратора в ГГГГ-ММ-ДД; нераспознанная — дата fallback (время в секундах) или сегодня
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(event_date.strip(), fmt).strftime("%Y-%m-%d")
+        except (ValueError, AttributeError):
+            continue
+    return time.strftime("%Y-%m-%d", time.localtime(fallback))
+
+
+def shard_of(filename, fallback=None):
+    # -> (камера, день) для файла
+    parts = filename.split('_')
+    if len(parts) < 4:
+        return UNKNOWN_CAMERA, normalize_date("", fallback)
+    return parts[0] or UNKNOWN_CAMERA, normalize_date(parts[1], fallback)
+
+
+def shard_path(base, filename, fallback=None):
+    # путь файла в шарде, папка создаётся при необходимости
+    camera_name, day = shard_of(filename, fallback)
+    directory = os.path.join(base, camera_name, day)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def store_file(path, base):
+    # переместить файл в шард папки base; -> новый путь
+    target = shard_path(base, os.path.basename(path), os.path.getmtime(path))
+    shutil.move(path, target)
+    return target
+
+
+def days_of(base, camera_name):
+    # -> [(день, путь к папке или .tar)] по возрастанию; без чтения содержимого дней
+    try:
+        with os.scandir(os.path.join(base, camera_name)) as entries:
+            days = []
+            for entry in entries:
+                name = entry.name[:-len(".tar")] if entry.name.endswith(".tar") else entry.name
+                if len(name) == 10 and name[4] == name[7] == "-" and (entry.is_dir() or entry.name.endswith(".tar")):
+                    days.append((name, entry.path))
+    except FileNotFoundError:
+        return []
+    return sorted(days)
+
+
+def cameras_of(base):
+    try:
+        with os.scandir(base) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+    except FileNotFoundError:
+        return []
+
+
+def iter_history(base, camera=None, since=None, until=None):
+    # потоковый обход: (камера, день, имя файла, путь или (архив, член архива)) по дням, без полного листинга.
+    # since/until — "ГГГГ-ММ-ДД" включительно
+    for camera_name in ([camera] if camera else cameras_of(base)):
+        for day, path in days_of(base, camera_name):
+            if (since and day < since) or (until and day > until):
+                continue
+            if path.endswith(".tar"):
+                with tarfile.open(path) as archive:
+                    for member in archive:
+                        if member.isfile():
+                            yield camera_name, day, os.path.basename(member.name), (path, member.name)
+            else:
+                with os.scandir(path) as entries:
+                    names = sorted(entry.name for entry in entries if entry.is_file())
+                for name in names:
+                    yield camera_name, day, name, os.path.join(path, name)
+
+
+def migrate(base):
+    # разложить по шардам файлы, лежащие прямо в base (старая плоская раскладка); -> сколько перенесено
+    moved = 0
+    with os.scandir(base) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.'):
+                store_file(entry.path, base)
+                moved += 1
+    return moved
+
+
+def compact_day(directory):
+    # папка дня -> <день>.tar рядом; архив пишется во временный файл и появляется атомарно.
+    # Кадры, пришедшие за уже упакованный день (письмо с опозданием), дописываются к копии архива.
+    # Удаляются только упакованные файлы: кадр, записанный во время упаковки, остаётся до следующего раза
+    archive_path = directory + ".tar"
+    tmp_path = archive_path + ".part"
+    with os.scandir(directory) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file())
+    mode = "w"
+    if os.path.exists(archive_path):
+        shutil.copyfile(archive_path, tmp_path)
+        mode = "a"
+    with tarfile.open(tmp_path, mode) as archive:  # JPEG уже сжат, архив без сжатия
+        for name in names:
+            archive.add(os.path.join(directory, name), arcname=name)
+    os.replace(tmp_path, archive_path)
+    for name in names:
+        os.remove(os.path.join(directory, name))
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass  # в папке появились новые кадры
+
+
+def apply_retention(base, keep_days, today=None):
+    # удалить дни старше keep_days; -> сколько дней удалено
+    today = today or date.today()
+    cutoff = (today - timedelta(days=keep_days)).isoformat()
+    removed = 0
+    for camera_name in cameras_of(base):
+        for day, path in days_of(base, camera_name):
+            if day >= cutoff:
+                break
+            if path.endswith(".tar"):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+            removed += 1
+    return removed
+
+
+def compact(base, after_days, today=None):
+    # упаковать дни старше after_days; -> сколько дней упаковано
+    today = today or date.today()
+    cutoff = (today - timedelta(days=after_days)).isoformat()
+    packed = 0
+    for camera_name in cameras_of(base):
+        for day, path in days_of(base, camera_name):
+            if day >= cutoff:
+                break
+            if not path.endswith(".tar"):
+                compact_day(path)
+                packed += 1
+    return packed
+
+
+def maintain(buckets=STORAGE_BUCKETS, retention=RETENTION_DAYS, compact_after=COMPACT_AFTER_DAYS, lock_path=MAINTENANCE_LOCK):
+    # перенос плоских файлов, удаление по сроку и упаковка; одновременно выполняется только в одном процессе
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("[*] Обслуживание хранилища уже выполняется другим процессом.")
+            return
+        for name, base in buckets.items():
+            if not os.path.isdir(base):
+                continue
+            moved = migrate(base)
+            removed = apply_retention(base, retention[name]) if retention.get(name) else 0
+            packed = compact(base, compact_after) if compact_after else 0
+            if moved or removed or packed:
+                print(f"[*] Хранилище {name}: разложено {moved} файлов, удалено дней {removed}, упаковано дней {packed}.")
+
+
+# периодическое обслуживание хранилища в фоне (в ведущем процессе детектора)
+class StorageMaintenance:
+    def __init__(self, interval=MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="storage-maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                maintain()
+            except OSError as e:
+                print(f"[-] Ошибка обслуживания хранилища: {e}")
+            self._stop.wait(self.interval)
+
+
+def main():
+    # python storage.py maintain
+    # python storage.py migrate
+    # python storage.py ls filtered --camera vorota2 --since 2024-05-01 --until 2024-05-07
+    parser = argparse.ArgumentParser(description="Хранилище кадров по камерам и дням")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("maintain", help="перенос, удаление по сроку и упаковка старых дней")
+    commands.add_parser("migrate", help="разложить плоские папки по камерам и дням")
+    ls = commands.add_parser("ls", help="кадры за период")
+    ls.add_argument("bucket", choices=sorted(STORAGE_BUCKETS))
+    ls.add_argument("--camera")
+    ls.add_argument("--since")
+    ls.add_argument("--until")
+    args = parser.parse_args()
+
+    if args.command == "maintain":
+        maintain()
+    elif args.command == "migrate":
+        for name, base in STORAGE_BUCKETS.items():
+            if os.path.isdir(base):
+                print(f"[*] {name}: разложено {migrate(base)} файлов.")
+    else:
+        count = 0
+        for camera_name, day, name, location in iter_history(STORAGE_BUCKETS[args.bucket], args.camera, args.since, args.until):
+            count += 1
+            if not isinstance(location, str):
+                location = f"{location[0]}:{location[1]}"
+            print(f"{day}  {camera_name:<10} {name}  {location}")
+        print(f"[*] Кадров: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,545 @@
+import os
+import re
+import time
+import json
+import heapq
+import fcntl
+import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import STAGE_SECONDS, TELEGRAM_CALLS
+
+# --- НАСТРОЙКИ TELEGRAM ---
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# адрес Bot API; для проверки можно указать локальный фейковый сервер
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip('/')
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", "4"))  # параллельные отправки по чатам
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "25"))  # запросов в секунду на одного бота (лимит Telegram ~30)
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "30"))
+TELEGRAM_MAX_RETRIES = 2  # повторы после 429 Too Many Requests
+TELEGRAM_QUEUE = os.path.join(DATA_DIR, "telegram-queue")
+MEDIA_GROUP_LIMIT = 10  # максимум фото в одном sendMediaGroup
+
+# --- повторная отправка из очереди ---
+REPLAY_CONCURRENCY = int(os.getenv("TELEGRAM_REPLAY_CONCURRENCY", "2"))  # чатов одновременно
+REPLAY_BATCH = int(os.getenv("TELEGRAM_REPLAY_BATCH", "200"))  # записей очереди за один проход
+REPLAY_RESERVE = float(os.getenv("TELEGRAM_REPLAY_RESERVE", "5"))  # токены лимитера, оставляемые живым уведомлениям
+REPLAY_BACKOFF_BASE = 5
+REPLAY_BACKOFF_MAX = 600
+REPLAY_IDLE_INTERVAL = 60  # пересмотр очереди, даже если новых записей не было
+# -------------------------------------
+
+
+# имена записей очереди: "<ns>_<фото>.json" (time.time_ns — 19 цифр) и старое "<фото>_<сек>.json"
+QUEUE_NAME_RE = re.compile(r"^(\d{19})_(.+)\.json$")
+LEGACY_QUEUE_NAME_RE = re.compile(r"^(.+\.\w+)_(\d+)\.json$")
+BUCKET_STATE = struct.Struct("dd")  # токены, время последнего пополнения (time.monotonic — общее для процессов хоста)
+
+
+# token bucket: не больше rate запросов в секунду, всплеск до burst.
+# С path состояние ведра лежит в файле под flock — один бюджет на все процессы детектора
+class RateLimiter:
+    def __init__(self, rate, burst=None, path=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.path = path
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _take(self, reserve):
+        # -> 0, если токен взят, иначе сколько ждать
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0
+        return (1 + reserve - self.tokens) / self.rate
+
+    def _take_shared(self, reserve):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            state = os.pread(self._fd, BUCKET_STATE.size, 0)
+            if len(state) == BUCKET_STATE.size:
+                self.tokens, self.updated = BUCKET_STATE.unpack(state)
+            wait = self._take(reserve)
+            os.pwrite(self._fd, BUCKET_STATE.pack(self.tokens, self.updated), 0)
+            return wait
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def acquire(self, reserve=0):
+        # reserve > 0 — низкий приоритет: берём токен, только если после него останется reserve
+        while True:
+            with self._lock:
+                if self.path is None:
+                    wait = self._take(reserve)
+                else:
+                    try:
+                        wait = self._take_shared(reserve)
+                    except OSError as e:
+                        print(f"[-] Общий лимит Telegram недоступен ({e}), лимит только на этот процесс.")
+                        self.path = None
+                        wait = self._take(reserve)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(token):
+    # один лимитер на бота, общий для всех отправителей в процессе и (через файл в DATA_DIR)
+    # для всех процессов детектора; в имени файла — хеш, а не сам токен
+    with _limiters_lock:
+        if token not in _limiters:
+            path = os.path.join(DATA_DIR, f".telegram-rate-{hashlib.sha256(str(token).encode()).hexdigest()[:16]}")
+            _limiters[token] = RateLimiter(TELEGRAM_RATE, burst=max(TELEGRAM_RATE, REPLAY_RESERVE + 1), path=path)
+        return _limiters[token]
+
+
+def make_caption(camera_name, event_date, event_time, detected_labels):
+    return f"*{camera_name}*: {', '.join(detected_labels)}\n`{event_date} {event_time.replace('-', ':')}`"
+
+
+_queue_event = threading.Event()
+
+
+def queue_entry_key(filename):
+    # порядок очереди: время постановки из имени файла. Старое имя узнаётся по хвосту "<расширение фото>_<сек>" —
+    # у нового имя заканчивается самим фото, поэтому камера из одних цифр не путает разбор
+    legacy = LEGACY_QUEUE_NAME_RE.match(filename)
+    if legacy:
+        return int(legacy.group(2)) * 10**9, filename
+    match = QUEUE_NAME_RE.match(filename)
+    if match:
+        return int(match.group(1)), filename
+    return 0, filename
+
+
+def write_queue_entry(queue_file_path, data):
+    # атомарная запись: обработчик очереди никогда не прочитает недописанный JSON
+    tmp_path = os.path.join(os.path.dirname(queue_file_path), f".{os.path.basename(queue_file_path)}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, queue_file_path)
+
+
+def save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, chat_ids):
+    queue_file_name = f"{time.time_ns()}_{os.path.basename(photo_path)}.json"
+    queue_file_path = os.path.join(TELEGRAM_QUEUE, queue_file_name)
+
+    data_to_save = {
+        "photo_path": photo_path,
+        "camera_name": camera_name,
+        "event_date": event_date,
+        "event_time": event_time,
+        "detected_labels": detected_labels,
+        "chat_ids": chat_ids
+    }
+
+    write_queue_entry(queue_file_path, data_to_save)
+    _queue_event.set()
+
+    print(f"[!] Уведомление сохранено в очередь: {queue_file_path}")
+
+
+class TelegramError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def permanent(self):
+        # 400/403: чат не найден, бот заблокирован и т.п. — повтор не поможет
+        return self.status_code in (400, 403)
+
+
+def largest_file_id(message):
+    sizes = (message or {}).get("photo") or []
+    return sizes[-1].get("file_id") if sizes else None
+
+
+# отправка уведомлений в фоне: пул keep-alive соединений, параллельная рассылка по чатам,
+# фото загружается один раз, остальным чатам уходит полученный file_id
+class TelegramDispatcher:
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, api_url=TELEGRAM_API_URL, workers=TELEGRAM_WORKERS):
+        self.token = token
+        self.api_url = api_url
+        self.limiter = get_rate_limiter(token)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._jobs = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telegram-job")
+        self._sends = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telegram-send")
+        self._pending = 0  # заданий в пуле, ещё не завершённых
+        self._pending_lock = threading.Lock()
+
+    def close(self, wait=True):
+        self._jobs.shutdown(wait=wait)
+        self._sends.shutdown(wait=wait)
+        self.session.close()
+
+    def pending(self):
+        with self._pending_lock:
+            return self._pending
+
+    def _submit(self, function, *args):
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            future = self._jobs.submit(function, *args)
+        except RuntimeError:
+            self._job_done(None)
+            raise
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def call(self, method, data, files=None, reserve=0, retries=TELEGRAM_MAX_RETRIES):
+        # вызов Bot API с учётом лимита и retry_after; возвращает поле result
+        url = f"{self.api_url}/bot{self.token}/{method}"
+        for attempt in range(retries + 1):
+            self.limiter.acquire(reserve)
+            try:
+                with STAGE_SECONDS.time(stage="telegram"):
+                    response = self.session.post(url, data=data, files=files, timeout=TELEGRAM_TIMEOUT)
+            except requests.RequestException:
+                TELEGRAM_CALLS.inc(method=method, result="error")
+                raise
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = {}
+            if response.status_code == 200 and payload.get("ok", False):
+                TELEGRAM_CALLS.inc(method=method, result="ok")
+                return payload.get("result")
+            TELEGRAM_CALLS.inc(method=method, result=str(response.status_code))
+
+            retry_after = (payload.get("parameters") or {}).get("retry_after")
+            error = TelegramError(payload.get("description") or response.text, response.status_code, retry_after)
+            if response.status_code != 429 or attempt == retries:
+                raise error
+            time.sleep(retry_after or 1)
+
+    def send_photo(self, chat_id, photo, caption, **call_options):
+        # photo — либо (имя, байты) для загрузки, либо строка file_id
+        data = {'chat_id': chat_id, 'caption': caption, 'parse_mode': 'Markdown'}
+        if isinstance(photo, str):
+            data['photo'] = photo
+            result = self.call("sendPhoto", data, **call_options)
+        else:
+            result = self.call("sendPhoto", data, files={'photo': photo}, **call_options)
+        return largest_file_id(result)
+
+    def send_media_group(self, chat_id, photos, **call_options):
+        # photos — список (фото, подпись), от 2 до MEDIA_GROUP_LIMIT штук; возвращает file_id каждого фото
+        media = []
+        files = {}
+        attach_names = {}  # одно и то же фото в группе загружается одной частью
+        for index, (photo, caption) in enumerate(photos):
+            item = {'type': 'photo', 'caption': caption, 'parse_mode': 'Markdown'}
+            if isinstance(photo, str):
+                item['media'] = photo
+            else:
+                name = attach_names.setdefault(id(photo), f"photo{index}")
+                item['media'] = f"attach://{name}"
+                files[name] = photo
+            media.append(item)
+        data = {'chat_id': chat_id, 'media': json.dumps(media)}
+        result = self.call("sendMediaGroup", data, files=files or None, **call_options)
+        return [largest_file_id(message) for message in (result or [])]
+
+    def notify(self, photo_path, camera_name, event_date, event_time, detected_labels, chat_ids, photo_bytes=None):
+        chat_ids = [chat_id for chat_id in (chat_ids or []) if chat_id]
+        if not self.token or not chat_ids:
+            print(f"[-] Ошибка: токен или ID чатов для камеры {camera_name} не настроены.")
+            return None
+        return self._submit(self._deliver, photo_path, camera_name, event_date, event_time,
+                            detected_labels, chat_ids, photo_bytes)
+
+    def _deliver(self, photo_path, camera_name, event_date, event_time, detected_labels, chat_ids, photo_bytes):
+        caption = make_caption(camera_name, event_date, event_time, detected_labels)
+
+        def failed(chat_id, error):
+            print(f"[-] Ошибка Telegram ({chat_id}): {error}")
+            save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, [chat_id])
+
+        try:
+            if photo_bytes is None:
+                with open(photo_path, "rb") as photo_file:
+                    photo_bytes = photo_file.read()
+        except OSError as e:
+            for chat_id in chat_ids:
+                failed(chat_id, e)
+            return
+
+        # загружаем фото, пока один из чатов не примет его и не вернёт file_id
+        remaining = list(chat_ids)
+        file_id = None
+        while remaining and file_id is None:
+            chat_id = remaining.pop(0)
+            try:
+                file_id = self.send_photo(chat_id, (os.path.basename(photo_path), photo_bytes), caption)
+                print(f"[+] Уведомление для {camera_name} отправлено в чат {chat_id}.")
+            except Exception as e:
+                failed(chat_id, e)
+
+        # остальным чатам параллельно отправляем уже загруженное фото
+        photo = file_id or (os.path.basename(photo_path), photo_bytes)
+        futures = [(chat_id, self._sends.submit(self.send_photo, chat_id, photo, caption)) for chat_id in remaining]
+        for chat_id, future in futures:
+            try:
+                future.result()
+                print(f"[+] Уведомление для {camera_name} отправлено в чат {chat_id}.")
+            except Exception as e:
+                failed(chat_id, e)
+
+
+    def notify_group(self, photos, camera_name, event_date, event_time, detected_labels, chat_ids):
+        # photos — кадры одного события [(путь, байты или None)]: один sendMediaGroup на чат
+        chat_ids = [chat_id for chat_id in (chat_ids or []) if chat_id]
+        if not self.token or not chat_ids:
+            print(f"[-] Ошибка: токен или ID чатов для камеры {camera_name} не настроены.")
+            return None
+        if len(photos) == 1:
+            photo_path, photo_bytes = photos[0]
+            return self.notify(photo_path, camera_name, event_date, event_time, detected_labels, chat_ids, photo_bytes)
+        return self._submit(self._deliver_group, photos, camera_name, event_date, event_time,
+                            detected_labels, chat_ids)
+
+    def _deliver_group(self, photos, camera_name, event_date, event_time, detected_labels, chat_ids):
+        caption = make_caption(camera_name, event_date, event_time, detected_labels)
+
+        def failed(chat_id, paths, error):
+            print(f"[-] Ошибка Telegram ({chat_id}): {error}")
+            for photo_path in paths:
+                save_to_telegram_queue(photo_path, camera_name, event_date, event_time, detected_labels, [chat_id])
+
+        uploads = []
+        for photo_path, photo_bytes in photos:
+            try:
+                if photo_bytes is None:
+                    with open(photo_path, "rb") as photo_file:
+                        photo_bytes = photo_file.read()
+                uploads.append((photo_path, (os.path.basename(photo_path), photo_bytes)))
+            except OSError as e:
+                for chat_id in chat_ids:
+                    failed(chat_id, [photo_path], e)
+
+        for start in range(0, len(uploads), MEDIA_GROUP_LIMIT):
+            chunk = uploads[start:start + MEDIA_GROUP_LIMIT]
+            paths = [photo_path for photo_path, _ in chunk]
+            if len(chunk) == 1:
+                self._deliver(paths[0], camera_name, event_date, event_time, detected_labels, chat_ids, chunk[0][1][1])
+                continue
+
+            # группа загружается в первый принявший её чат, остальным уходят полученные file_id
+            remaining = list(chat_ids)
+            file_ids = None
+            while remaining and file_ids is None:
+                chat_id = remaining.pop(0)
+                try:
+                    group = [(photo, caption if i == 0 else "") for i, (_, photo) in enumerate(chunk)]
+                    file_ids = self.send_media_group(chat_id, group)
+                    print(f"[+] Уведомление для {camera_name} ({len(chunk)} фото) отправлено в чат {chat_id}.")
+                except Exception as e:
+                    failed(chat_id, paths, e)
+
+            if file_ids is None or len(file_ids) != len(chunk) or not all(file_ids):
+                file_ids = [photo for _, photo in chunk]
+            group = [(photo, caption if i == 0 else "") for i, photo in enumerate(file_ids)]
+            futures = [(chat_id, self._sends.submit(self.send_media_group, chat_id, group)) for chat_id in remaining]
+            for chat_id, future in futures:
+                try:
+                    future.result()
+                    print(f"[+] Уведомление для {camera_name} ({len(chunk)} фото) отправлено в чат {chat_id}.")
+                except Exception as e:
+                    failed(chat_id, paths, e)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TelegramDispatcher()
+        return _dispatcher
+
+
+def close_dispatcher():
+    # при остановке процесса: дождаться начатых отправок (неудачные уходят в очередь повтора)
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.close(wait=True)
+
+
+def pending_jobs():
+    # незавершённые отправки в этом процессе; диспетчер не создаётся ради метрики
+    return _dispatcher.pending() if _dispatcher is not None else 0
+
+
+def send_telegram_event(photos, camera_name, event_date, event_time, detected_labels, chat_ids):
+    # все кадры одного события одним альбомом на чат, не блокирует вызывающий поток
+    return get_dispatcher().notify_group(photos, camera_name, event_date, event_time, detected_labels, chat_ids)
+
+
+# разбор /data/telegram-queue: доставка в порядке постановки, по чату — пачками через sendMediaGroup,
+# экспоненциальная пауза при сбоях с учётом retry_after
+class TelegramQueueWorker:
+    def __init__(self, dispatcher=None, path=TELEGRAM_QUEUE, concurrency=REPLAY_CONCURRENCY):
+        self.dispatcher = dispatcher or get_dispatcher()
+        self.path = path
+        self.concurrency = concurrency
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="telegram-queue", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        _queue_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def scan(self):
+        # самые старые REPLAY_BATCH записей; порядок берётся из имён, без stat каждого файла
+        try:
+            with os.scandir(self.path) as entries:
+                names = [entry.name for entry in entries if entry.name.endswith(".json") and not entry.name.startswith('.')]
+        except OSError as e:
+            print(f"[-] Ошибка чтения очереди {self.path}: {e}")
+            return []
+
+        loaded = []
+        for _, name in heapq.nsmallest(REPLAY_BATCH, (queue_entry_key(name) for name in names)):
+            entry_path = os.path.join(self.path, name)
+            try:
+                with open(entry_path) as f:
+                    loaded.append((entry_path, json.load(f)))
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                print(f"[-] Повреждённая запись очереди {name}: {e}")
+                os.replace(entry_path, entry_path + ".bad")
+        return loaded
+
+    def drain_once(self):
+        # один проход по очереди; возвращает (число записей, ошибка или None)
+        entries = self.scan()
+        if not entries:
+            return 0, None
+
+        by_chat = {}
+        delivered = {}
+        for entry_path, data in entries:
+            delivered[entry_path] = set()
+            if not os.path.exists(data.get("photo_path", "")):
+                print(f"[-] Фото {data.get('photo_path')} не найдено, запись очереди удалена.")
+                delivered[entry_path].update(data.get("chat_ids", []))
+                continue
+            for chat_id in data.get("chat_ids", []):
+                by_chat.setdefault(chat_id, []).append((entry_path, data))
+
+        uploaded = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="telegram-replay") as pool:
+            futures = {pool.submit(self._deliver_chat, chat_id, chat_entries, uploaded): chat_id
+                       for chat_id, chat_entries in by_chat.items()}
+            for future, chat_id in futures.items():
+                done_paths, chat_error = future.result()
+                for entry_path in done_paths:
+                    delivered[entry_path].add(chat_id)
+                if chat_error is not None:
+                    if isinstance(chat_error, TelegramError) and chat_error.permanent:
+                        print(f"[-] Чат {chat_id} отклонил уведомления из очереди: {chat_error}. Записи удалены.")
+                        for entry_path, _ in by_chat[chat_id]:
+                            delivered[entry_path].add(chat_id)
+                    else:
+                        error = chat_error
+
+        for entry_path, data in entries:
+            remaining = [chat_id for chat_id in data.get("chat_ids", []) if chat_id not in delivered[entry_path]]
+            try:
+                if remaining:
+                    if len(remaining) != len(data.get("chat_ids", [])):
+                        write_queue_entry(entry_path, dict(data, chat_ids=remaining))
+                else:
+                    os.remove(entry_path)
+            except OSError as e:
+                print(f"[-] Ошибка обновления записи очереди {entry_path}: {e}")
+        return len(entries), error
+
+    def _deliver_chat(self, chat_id, chat_entries, uploaded):
+        done_paths = []
+        loaded = {}
+        for start in range(0, len(chat_entries), MEDIA_GROUP_LIMIT):
+            chunk = chat_entries[start:start + MEDIA_GROUP_LIMIT]
+            try:
+                photos = []
+                for _, data in chunk:
+                    photo_path = data["photo_path"]
+                    photo = uploaded.get(photo_path) or loaded.get(photo_path)
+                    if photo is None:
+                        with open(photo_path, "rb") as photo_file:
+                            photo = loaded[photo_path] = (os.path.basename(photo_path), photo_file.read())
+                    caption = make_caption(data["camera_name"], data["event_date"], data["event_time"], data["detected_labels"])
+                    photos.append((photo, caption))
+
+                if len(photos) == 1:
+                    file_ids = [self.dispatcher.send_photo(chat_id, *photos[0], reserve=REPLAY_RESERVE, retries=0)]
+                else:
+                    file_ids = self.dispatcher.send_media_group(chat_id, photos, reserve=REPLAY_RESERVE, retries=0)
+            except Exception as e:
+                return done_paths, e
+
+            for (entry_path, data), file_id in zip(chunk, file_ids):
+                if file_id:
+                    uploaded[data["photo_path"]] = file_id
+            done_paths.extend(entry_path for entry_path, _ in chunk)
+            print(f"[+] Из очереди доставлено {len(chunk)} уведомлений в чат {chat_id}.")
+        return done_paths, None
+
+    def _run(self):
+        while not self._stop.is_set():
+            _queue_event.clear()
+            try:
+                count, error = self.drain_once()
+            except Exception as e:
+                count, error = 0, e
+
+            if error is not None:
+                self.failures += 1
+                delay = min(REPLAY_BACKOFF_BASE * 2 ** (self.failures - 1), REPLAY_BACKOFF_MAX)
+                retry_after = getattr(error, "retry_after", None)
+                if retry_after:
+                    delay = max(delay, retry_after)
+                print(f"[-] Ошибка доставки из очереди Telegram: {error}. Повтор через {delay} с.")
+                self._stop.wait(delay)
+            elif count:
+                # успешный проход: сразу берём следующую порцию
+                self.failures = 0
+            else:
+                _queue_event.wait(REPLAY_IDLE_INTERVAL)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# модули читают настройки из окружения при импорте: до импорта всё состояние уводим во временную папку,
+# а внешние сервисы подменяются локальными из bench_standins.py
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="fotomon-tests-")
+os.environ.setdefault("METRICS_LOG_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
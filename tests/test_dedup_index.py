@@ -0,0 +1,92 @@
+import random
+import numpy as np
+from dedup_index import HashIndex, DuplicateIndex
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_segments_cover_all_64_bits():
+    for max_distance in (0, 1, 4, 7, 63):
+        index = HashIndex(max_distance)
+        assert len(index.segments) == min(max_distance + 1, 64)
+        covered = 0
+        for shift, mask in index.segments:
+            assert covered >> shift == 0  # сегменты не перекрываются и идут подряд
+            covered |= mask << shift
+        assert covered == (1 << 64) - 1
+
+
+def test_find_respects_the_distance_limit():
+    index = HashIndex(4)
+    value = 0x0123456789ABCDEF
+    index.add(value, 0)
+    # граница сегментов 12|13: все отличия в соседних сегментах
+    assert index.find(flip(value, [11, 12, 13, 14])) == value
+    assert index.find(flip(value, [0, 20, 40, 63])) == value
+    assert index.find(flip(value, [0, 13, 26, 38, 51])) is None
+    assert index.find(flip(value, [11, 12, 13, 14, 15])) is None
+
+
+def test_find_matches_brute_force():
+    rng = random.Random(1)
+    index = HashIndex(4)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    for value in values:
+        index.add(value, 0)
+    for _ in range(500):
+        query = flip(rng.choice(values), rng.sample(range(64), rng.randint(0, 6)))
+        distances = [(value ^ query).bit_count() for value in values]
+        best = min(distances)
+        found = index.find(query)
+        if best <= 4:
+            assert (found ^ query).bit_count() == best
+        else:
+            assert found is None
+
+
+def test_evict_removes_oldest_first():
+    rng = random.Random(2)
+    values = [rng.getrandbits(64) for _ in range(4)]
+    index = HashIndex(4)
+    for n, value in enumerate(values):
+        index.add(value, 100 + n)
+    index.evict(oldest_allowed=101, max_entries=10)
+    assert list(index.entries) == values[1:]
+    index.evict(oldest_allowed=0, max_entries=2)
+    assert list(index.entries) == values[2:]
+    assert index.find(values[0]) is None and index.find(values[1]) is None
+    assert all(index.find(value) == value for value in index.entries)
+
+
+def test_repeats_do_not_extend_the_window(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "dedup.json"), window=60)
+    value = 0xFFFF0000FFFF0000
+    assert index.find("dvr5", value, now=0) is None
+    index.commit("dvr5", [value], now=0)
+    assert index.find("dvr5", flip(value, [1, 2]), now=50) == value
+    # стоящая сцена всё равно доходит до детектора через окно после первого кадра
+    assert index.find("dvr5", value, now=61) is None
+    assert index.find("vorota1", value, now=10) is None
+
+
+def test_find_does_not_insert_and_checks_pending(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "dedup.json"))
+    value = 0x00FF00FF00FF00FF
+    assert index.find("dvr5", value) is None
+    assert index.find("dvr5", value) is None
+    assert index.find("dvr5", flip(value, [5]), pending=[value]) == value
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / "dedup.json")
+    index = DuplicateIndex(path)
+    gray = np.tile(np.arange(64, dtype=np.uint8) * 4, (64, 1))
+    value = index.frame_hash(gray)
+    index.commit("dvr5", [value])
+    index.save()
+    assert DuplicateIndex(path).find("dvr5", value) == value
+    assert DuplicateIndex(path, hash_name="dhash").find("dvr5", value) is None
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+import cv2
+import numpy as np
+import pytest
+import bench_standins
+from bench_pipeline import BENCH_ENV, SYNTHETIC_BACKEND, ROOT, make_scene
+import detect_cars
+from inbox_watcher import InboxWatcher
+
+
+def test_single_frame_is_dispatched_without_waiting_for_a_full_batch(tmp_path):
+    watcher = InboxWatcher(str(tmp_path))
+    (tmp_path / "vorota1_2026-01-01_12-00-00_1.jpg").write_bytes(b"jpeg")
+    watcher._scan()
+    started = time.monotonic()
+    batch = detect_cars.collect_batch(watcher)
+    assert [os.path.basename(path) for path in batch] == ["vorota1_2026-01-01_12-00-00_1.jpg"]
+    assert time.monotonic() - started < detect_cars.BATCH_WAIT / 2
+
+
+def test_frames_arriving_together_share_a_batch(tmp_path):
+    watcher = InboxWatcher(str(tmp_path))
+    for index in range(1, 4):
+        (tmp_path / f"dvr5_2026-01-01_12-00-00_{index}.jpg").write_bytes(b"jpeg")
+    watcher._scan()
+    assert len(detect_cars.collect_batch(watcher)) == 3
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_stopped_worker_sends_the_open_event(tmp_path, workers):
+    # событие в окне объединения живёт только в памяти: SIGTERM должен его отправить, а не потерять
+    telegram = bench_standins.start(bench_standins.TelegramStandIn(), "telegram")
+    env = dict(os.environ, **BENCH_ENV, DATA_DIR=str(tmp_path), PYTHONUNBUFFERED="1", METRICS_PORT="0",
+               TELEGRAM_BOT_TOKEN="0:test", TELEGRAM_API_URL=telegram.url, INFER_BACKEND=SYNTHETIC_BACKEND,
+               NOTIFY_COALESCE_WINDOW="60", MOTION_GATE="false", OBJECT_TRACKING="false", WATCH_POLL_INTERVAL="0.2",
+               DETECT_WORKERS=workers)
+    env.pop("SMTP_SERVER_OUT", None)
+    log = open(tmp_path / "detector.log", "wb")
+    process = subprocess.Popen([sys.executable, "detect_cars.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        frame = make_scene(np.random.default_rng(1), 640, 360, "stop")
+        inbox = tmp_path / "inbox"
+        deadline = time.monotonic() + 30
+        while not inbox.is_dir() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        cv2.imwrite(str(tmp_path / "frame.jpg"), frame)
+        os.replace(tmp_path / "frame.jpg", inbox / "vorota1_2026-01-01_12-00-00_1.jpg")
+        while not any((tmp_path / "filtered").rglob("*_with_detections.jpg")) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert not telegram.received  # окно ещё открыто
+
+        process.send_signal(signal.SIGTERM)  # при нескольких обработчиках сигнал получает только supervise
+        assert process.wait(timeout=30) == 0
+        assert [chat_id for _, _, chat_id, _, _ in telegram.received]
+    finally:
+        if process.poll() is None:
+            process.kill()
+        log.close()
+        bench_standins.stop(telegram)
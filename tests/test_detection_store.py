@@ -0,0 +1,32 @@
+import numpy as np
+from detection_store import DetectionStore, content_digest, settings_fingerprint
+
+
+def record(digest, camera, fingerprint, found, event_date="2026-01-05"):
+    boxes = np.array([[10, 20, 110, 120]], dtype=np.int32) if found else None
+    return (digest, camera, fingerprint, event_date, "12-00-00", f"{camera}_{event_date}_12-00-00_1.jpg", found,
+            ["car"] if found else [], np.array([2]) if found else None, np.array([0.9], dtype=np.float32) if found else None,
+            boxes, ["car"] if found else [])
+
+
+def test_same_bytes_are_cached_per_camera_and_settings(tmp_path):
+    store = DetectionStore(str(tmp_path / "detections.sqlite3"))
+    digest = content_digest(b"frame")
+    cars = settings_fingerprint({"desired_classes": [2], "roi": None})
+    people = settings_fingerprint({"desired_classes": [0], "roi": None})
+    store.add_many([record(digest, "vorota1", cars, True), record(digest, "vorota2", cars, False)])
+
+    found, classes, _, boxes, labels = store.lookup(digest, "vorota1", cars)
+    assert found and classes.tolist() == [2] and boxes.tolist() == [[10, 20, 110, 120]] and labels == ["car"]
+    assert store.lookup(digest, "vorota2", cars)[0] is False
+    assert store.lookup(digest, "vorota1", people) is None  # другие классы камеры — кадр проходит модель заново
+
+
+def test_query_by_event_day(tmp_path):
+    store = DetectionStore(str(tmp_path / "detections.sqlite3"))
+    store.add_many([record(content_digest(b"a"), "vorota1", "f", True, "2026-01-01"),
+                    record(content_digest(b"b"), "vorota1", "f", True, "05.01.2026")])
+    rows = store.query(camera="vorota1", day_from="2026-01-03", day_to="2026-01-07").fetchall()
+    assert [row[2] for row in rows] == ["05.01.2026"]
+    assert len(store.query(label="car").fetchall()) == 2
+
@@ -0,0 +1,166 @@
+import os
+import io
+import time
+import email
+import base64
+import imaplib
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import bench_standins
+from bench_pipeline import make_alarm_email, make_scene
+import fetch_mail
+
+
+@pytest.fixture
+def imap():
+    server = bench_standins.start(bench_standins.ImapStandIn(), "imap")
+    mail = imaplib.IMAP4(*server.server_address)
+    mail.login("bench", "bench")
+    mail.select("inbox")
+    yield server, mail
+    mail.logout()
+    bench_standins.stop(server)
+
+
+@pytest.fixture(autouse=True)
+def clean_inbox():
+    for name in os.listdir(fetch_mail.SAVE_PATH):
+        os.remove(os.path.join(fetch_mail.SAVE_PATH, name))
+    yield
+
+
+def alarm(mailbox, seed, when, camera="vorota1", frames=2):
+    rng = np.random.default_rng(seed)
+    event_time = datetime(2026, 1, 1, 12) + timedelta(seconds=seed)
+    jpegs = [fetch_mail.cv2.imencode(".jpg", make_scene(rng, 640, 360, f"{seed}-{i}"))[1].tobytes() for i in range(frames)]
+    return mailbox.append(make_alarm_email(camera, 1, event_time, jpegs), when)
+
+
+def saved():
+    return sorted(os.listdir(fetch_mail.SAVE_PATH))
+
+
+@pytest.mark.parametrize("lean", [True, False])
+def test_saved_mail_is_deleted(imap, monkeypatch, lean):
+    server, mail = imap
+    monkeypatch.setattr(fetch_mail, "LEAN_FETCH", lean)
+    alarm(server.mailbox, 10 + lean, 1000)  # у каждого прогона свои кадры: индекс дубликатов общий
+    fetch_mail.process_unseen(mail)
+    assert len(saved()) == 2
+    assert len(server.mailbox) == 0
+
+
+def test_missing_part_keeps_mail_for_next_cycle(imap):
+    server, mail = imap
+    uid = alarm(server.mailbox, 2, 1000)
+    message = server.mailbox.messages[0]
+    image = message["sections"].pop("3")  # сервер отдаст пустой литерал вместо второго кадра
+
+    fetch_mail.process_unseen(mail)
+    assert len(server.mailbox) == 1
+    assert "\\Deleted" not in message["flags"]
+    assert saved() == []  # первый кадр не записан и не попал в индекс дубликатов
+
+    message["sections"]["3"] = image
+    fetch_mail.process_unseen(mail)
+    assert len(server.mailbox) == 0
+    assert message["uid"] == uid
+    # после повтора в INBOX оба разных кадра письма, каждый под номером своей части
+    names = saved()
+    assert [name.rsplit("_", 1)[1] for name in names] == ["1.jpg", "2.jpg"]
+    frames = [open(os.path.join(fetch_mail.SAVE_PATH, name), "rb").read() for name in names]
+    assert frames[0] != frames[1]
+
+
+def test_mail_is_saved_in_internaldate_order(imap, monkeypatch):
+    # письма с разной структурой забираются разными FETCH, но сохраняются по порядку прихода
+    server, mail = imap
+    for seed, when, frames in ((20, 1003, 1), (21, 1001, 2), (22, 1002, 1), (23, 1004, 2)):
+        alarm(server.mailbox, seed, when, frames=frames)
+    order = []
+    parse_event_info = fetch_mail.parse_event_info
+
+    def recorded(email_body):
+        result = parse_event_info(email_body)
+        order.append(result[2])
+        return result
+    monkeypatch.setattr(fetch_mail, "parse_event_info", recorded)
+
+    fetch_mail.process_unseen(mail)
+    assert order == ["12:00:21", "12:00:22", "12:00:20", "12:00:23"]
+    assert len(server.mailbox) == 0
+
+
+class SilentIdleHandler(bench_standins.ImapHandler):
+    # полуоткрытое соединение: IDLE принят, на DONE сервер уже не отвечает
+    def idle(self, tag):
+        self.send("+ idling\r\n")
+        time.sleep(2)
+
+
+def test_idle_times_out_on_silent_server(monkeypatch):
+    server = bench_standins.ImapStandIn()
+    server.RequestHandlerClass = SilentIdleHandler
+    bench_standins.start(server, "imap-silent")
+    host, port = server.server_address
+    monkeypatch.setattr(fetch_mail, "IMAP_SERVER", host)
+    monkeypatch.setattr(fetch_mail, "IMAP_PORT", port)
+    monkeypatch.setattr(fetch_mail, "IMAP_TIMEOUT", 0.2)
+    monkeypatch.setattr(fetch_mail, "EMAIL_ACCOUNT", "bench")
+    monkeypatch.setattr(fetch_mail, "EMAIL_PASSWORD", "bench")
+    mail = fetch_mail.connect()
+    try:
+        with pytest.raises(imaplib.IMAP4.abort):
+            fetch_mail.idle_wait(mail, 0.05)
+    finally:
+        mail.shutdown()
+        bench_standins.stop(server)
+
+
+def test_parse_fetch_response_splits_messages_and_literals():
+    # так imaplib отдаёт ответ на UID FETCH с несколькими литералами в одном письме
+    msg_data = [(b"1 (UID 5 BODY[1] {4}", b"text"), (b" BODY[2] {3}", b"img"), b")",
+                (b"2 (UID 7 FLAGS (\\Seen) BODY[1] {2}", b"hi"), b")"]
+    responses = fetch_mail.parse_fetch_response(msg_data)
+    assert sorted(responses) == [b"5", b"7"]
+    assert responses[b"5"]["literals"] == {b"BODY[1]": b"text", b"BODY[2]": b"img"}
+    assert responses[b"7"]["literals"] == {b"BODY[1]": b"hi"}
+    assert b"FLAGS" in responses[b"7"]["text"]
+
+
+def test_bodystructure_with_literal_filename():
+    # имя файла с пробелом сервер может прислать литералом внутри BODYSTRUCTURE
+    msg_data = [(b'3 (UID 9 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64" 120 2 NIL NIL NIL NIL)'
+                 b'("IMAGE" "JPEG" ("NAME" {9}', b"cam 1.jpg"),
+                b') NIL NIL "BASE64" 5000 NIL ("ATTACHMENT" ("FILENAME" "cam 1.jpg")) NIL NIL) "MIXED" ("BOUNDARY" "b") NIL NIL NIL))']
+    structure = fetch_mail.find_bodystructure(fetch_mail.parse_fetch_response(msg_data)[b"9"]["text"])
+    text_part, images = fetch_mail.plan_message_parts(structure)
+    assert text_part[:3] == ("1", "text", "plain") and text_part[3] == {"charset": "utf-8"}
+    number, main_type, sub_type, params, encoding, disposition = images[0]
+    assert (number, main_type, sub_type, params["name"], encoding) == ("2", "image", "jpeg", "cam 1.jpg", "base64")
+    assert fetch_mail.attachment_extension(params, disposition, main_type, sub_type) == ".jpg"
+
+
+def test_plan_of_nested_alarm_mail(monkeypatch):
+    # html-альтернатива во вложенном multipart, изображения сверх MAX_ATTACHMENTS не скачиваются
+    monkeypatch.setattr(fetch_mail, "MAX_ATTACHMENTS", 2)
+    raw = make_alarm_email("dvr5", 2, datetime(2026, 1, 1, 12), [b"a", b"b", b"c"])
+    message = email.message_from_bytes(raw)
+    alternative = email.message_from_string('Content-Type: multipart/alternative; boundary="alt"\n\n'
+                                            '--alt\nContent-Type: text/plain\n\nplain\n'
+                                            '--alt\nContent-Type: text/html\n\n<html></html>\n--alt--\n')
+    message.get_payload()[0] = alternative
+    structure = fetch_mail.tokenize_imap(bench_standins.body_structure(message))[0]
+    text_part, images = fetch_mail.plan_message_parts(structure)
+    assert text_part[:3] == ("1.1", "text", "plain")
+    assert [part[0] for part in images] == ["2", "3"]
+
+
+def test_base64_is_decoded_in_chunks(monkeypatch):
+    monkeypatch.setattr(fetch_mail, "DECODE_CHUNK", 7)  # граница куска посреди группы из 4 символов
+    data = bytes(range(256)) * 3
+    payload = b"\r\n".join(base64.encodebytes(data).splitlines())
+    out = io.BytesIO()
+    fetch_mail.write_decoded(payload, "base64", out)
+    assert out.getvalue() == data
@@ -0,0 +1,62 @@
+import os
+import json
+from email.header import decode_header, make_header
+import pytest
+import bench_standins
+import mailer
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    server = bench_standins.start(bench_standins.SmtpStandIn(), "smtp")
+    host, port = server.server_address
+    for name, value in (("EMAIL_HOST", host), ("EMAIL_PORT", port), ("EMAIL_ACCOUNT", "detector@bench.local"),
+                        ("EMAIL_PASSWORD", "bench"), ("SMTP_STARTTLS", False)):
+        monkeypatch.setattr(mailer, name, value)
+    yield server
+    bench_standins.stop(server)
+
+
+@pytest.fixture
+def outbox(smtp, tmp_path):
+    outbox = mailer.MailOutbox(spool=str(tmp_path / "mail-spool"), session=mailer.SMTPSession())
+    yield outbox
+    outbox.session.close()
+
+
+def received_subjects(server):
+    return [str(make_header(decode_header(subject))) for _, _, subject, _ in server.received]
+
+
+def test_cyrillic_subject_is_sent(outbox, smtp, tmp_path):
+    photo = tmp_path / "vorota2_2026-01-01_12-00-00_1.jpg"
+    photo.write_bytes(b"\xff\xd8jpeg")
+    subject = "Обнаружены объекты: vorota2"
+    assert outbox.submit(subject, "Время: 12:00:00", ["guard@bench.local"], [str(photo)])
+    assert outbox.flush() is None
+    assert received_subjects(smtp) == [subject]
+    assert smtp.received[0][3] == [photo.name]
+    assert os.listdir(outbox.spool) == []
+
+
+def test_spool_retries_after_smtp_outage(outbox, smtp, monkeypatch):
+    smtp.outage = True
+    entry_id = outbox.submit("Тест", "тело", ["a@bench.local", "b@bench.local"])
+    assert outbox.flush() == mailer.MAIL_RETRY_BASE
+    with open(os.path.join(outbox.spool, f"{entry_id}.json")) as f:
+        entry = json.load(f)
+    assert entry["attempts"] == 1 and entry["recipients"] == ["a@bench.local", "b@bench.local"]
+    assert outbox.flush() > 0  # до next_try письмо не трогаем
+    assert smtp.received == []
+
+    smtp.outage = False
+    entry["next_try"] = 0
+    outbox._write_entry(entry_id, entry)
+    assert outbox.flush() is None
+    assert sorted(recipients[0] for _, recipients, _, _ in smtp.received) == ["a@bench.local", "b@bench.local"]
+    assert os.listdir(outbox.spool) == []
+
+
+def test_entry_ids_keep_submission_order(outbox):
+    ids = [outbox.submit(f"письмо {n}", "", ["a@bench.local"]) for n in range(5)]
+    assert len(set(ids)) == 5 and sorted(ids) == ids
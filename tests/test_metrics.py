@@ -0,0 +1,78 @@
+import pytest
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # свои метрики теста, без метрик сервисов из общего REGISTRY
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+
+def test_histogram_quantile_interpolates_inside_buckets():
+    histogram = metrics.Histogram("test_seconds", "test", buckets=(1, 2, 4))
+    for value in (0.5, 0.5, 1.5, 1.5):
+        histogram.observe(value)
+    counts, _, total = histogram._values[()]
+    assert histogram.quantile(0.5, counts, total) == pytest.approx(1.0)
+    assert histogram.quantile(0.75, counts, total) == pytest.approx(1.5)
+    assert histogram.quantile(1.0, counts, total) == pytest.approx(2.0)
+
+    histogram.observe(2)  # граница корзины относится к ней (le)
+    histogram.observe(10)  # выше последней корзины — оценка упирается в неё
+    counts, _, total = histogram._values[()]
+    assert counts == [2, 3, 0, 1]
+    assert histogram.quantile(0.99, counts, total) == 4
+
+
+def test_render_exposition_format():
+    counter = metrics.Counter("frames", "Кадров", ["result"])
+    gauge = metrics.Gauge("depth", "Файлов")
+    histogram = metrics.Histogram("stage_seconds", "Этап", ["stage"], buckets=(0.1, 1))
+    metrics.Gauge("unused", "Без значений")
+    counter.inc(result="found")
+    counter.inc(2, result="found")
+    gauge.set_function(lambda: 7)
+    histogram.observe(0.05, stage="decode")
+    histogram.observe(0.5, stage="decode")
+    assert metrics.render() == (
+        "# HELP fotomon_frames Кадров\n"
+        "# TYPE fotomon_frames counter\n"
+        'fotomon_frames_total{result="found"} 3\n'
+        "# HELP fotomon_depth Файлов\n"
+        "# TYPE fotomon_depth gauge\n"
+        "fotomon_depth 7\n"
+        "# HELP fotomon_stage_seconds Этап\n"
+        "# TYPE fotomon_stage_seconds histogram\n"
+        'fotomon_stage_seconds_bucket{stage="decode",le="0.1"} 1\n'
+        'fotomon_stage_seconds_bucket{stage="decode",le="1"} 2\n'
+        'fotomon_stage_seconds_bucket{stage="decode",le="+Inf"} 2\n'
+        'fotomon_stage_seconds_sum{stage="decode"} 0.55\n'
+        'fotomon_stage_seconds_count{stage="decode"} 2\n'
+    )
+
+
+def test_gauge_function_errors_hide_the_sample():
+    gauge = metrics.Gauge("depth", "Файлов")
+
+    def missing():
+        raise FileNotFoundError("inbox")
+    gauge.set_function(missing)
+    assert gauge.samples() == []
+    assert metrics.render() == "\n"
+
+
+def test_snapshot_summarizes_every_kind():
+    counter = metrics.Counter("frames", "Кадров", ["result"])
+    gauge = metrics.Gauge("depth", "Файлов")
+    histogram = metrics.Histogram("stage_seconds", "Этап", ["stage"], buckets=(1, 2))
+    metrics.Histogram("idle_seconds", "Без наблюдений")
+    counter.inc(result="found")
+    counter.inc(result="rejected")
+    gauge.set(3)
+    for value in (0.5, 1.5):
+        histogram.observe(value, stage="inference")
+    assert metrics.snapshot() == {
+        "frames": {"found": 1, "rejected": 1},
+        "depth": 3,
+        "stage_seconds": {"inference": {"count": 2, "sum": 2.0, "p50": 1.0, "p99": 1.98}},
+    }
@@ -0,0 +1,25 @@
+import numpy as np
+from motion_gate import MotionGate
+
+
+def frame(value):
+    return np.full((90, 160, 3), value, dtype=np.uint8)
+
+
+def test_workers_merge_shared_state(tmp_path):
+    # два обработчика с общим файлом: сохранение одного не затирает камеры другого,
+    # по общей камере остаётся фон с более поздним кадром
+    path = str(tmp_path / "motion-state.npz")
+    first = MotionGate(path, str(tmp_path / "log"))
+    second = MotionGate(path, str(tmp_path / "log"))
+    first.check("vorota1", frame(50), now=100)
+    first.check("dvr5", frame(60), now=100)
+    second.check("vorota2", frame(70), now=110)
+    second.check("dvr5", frame(80), now=120)
+    first.save(force=True)
+    second.save(force=True)
+
+    restored = MotionGate(path, str(tmp_path / "log"))
+    assert sorted(restored.backgrounds) == ["dvr5", "vorota1", "vorota2"]
+    background, seen = restored.backgrounds["dvr5"]
+    assert seen == 120 and background.mean() == 80
@@ -0,0 +1,24 @@
+import threading
+from notify_coalescer import NotificationCoalescer
+
+
+def test_pending_covers_the_window_and_the_delivery():
+    entered, release = threading.Event(), threading.Event()
+    delivered = []
+
+    def deliver(key, frames, labels, context):
+        entered.set()
+        release.wait(5)
+        delivered.append(key)
+
+    coalescer = NotificationCoalescer(deliver, window=0.2)
+    coalescer.add(("dvr5", "2026-01-01", "12-00-00"), ("a.jpg", None), ["car"])
+    coalescer.add(("dvr5", "2026-01-01", "12-00-00"), ("b.jpg", None), ["car"])
+    assert coalescer.pending() == 1
+    assert entered.wait(5)
+    # окно закрыто, но deliver ещё идёт: событие всё ещё не отправлено
+    assert coalescer.pending() == 1
+    release.set()
+    coalescer.stop()
+    assert delivered == [("dvr5", "2026-01-01", "12-00-00")]
+    assert coalescer.pending() == 0
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from object_tracker import ObjectTracker
+from inference_backend import box_iou
+
+CAR, PERSON = 2, 0
+
+
+def tracker(tmp_path, **options):
+    return ObjectTracker(str(tmp_path / "tracks.npz"), **options)
+
+
+def test_box_iou():
+    a = np.array([[0, 0, 10, 10], [0, 0, 4, 4]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float32)
+    assert box_iou(a, b) == pytest.approx(np.array([[1, 50 / 150, 0], [0.16, 0, 0]]), abs=1e-6)
+
+
+def test_parked_object_is_not_new_and_moved_object_is(tmp_path):
+    tracks = tracker(tmp_path, iou=0.6)
+    assert tracks.update("vorota1", [CAR], [[100, 100, 200, 200]], now=0).tolist() == [True]
+    assert tracks.update("vorota1", [CAR], [[102, 101, 203, 199]], now=10).tolist() == [False]
+    assert tracks.update("vorota1", [CAR], [[300, 100, 400, 200]], now=20).tolist() == [True]
+    # другая камера и другой класс на том же месте — новые объекты
+    assert tracks.update("vorota2", [CAR], [[100, 100, 200, 200]], now=20).tolist() == [True]
+    assert tracks.update("vorota1", [PERSON], [[100, 100, 200, 200]], now=20).tolist() == [True]
+
+
+def test_each_track_confirms_one_box(tmp_path):
+    tracks = tracker(tmp_path)
+    tracks.update("dvr5", [CAR], [[0, 0, 100, 100]], now=0)
+    # две машины на месте одной: прежней считается лучше совпавшая, вторая — новая
+    new = tracks.update("dvr5", [CAR, CAR], [[5, 5, 105, 105], [0, 0, 100, 100]], now=1)
+    assert new.tolist() == [True, False]
+
+
+def test_tracks_expire_after_ttl(tmp_path):
+    tracks = tracker(tmp_path, ttl=60)
+    tracks.update("vorota1", [CAR], [[100, 100, 200, 200]], now=0)
+    assert tracks.update("vorota1", [CAR], [[100, 100, 200, 200]], now=50).tolist() == [False]
+    # подтверждение продлевает трек: от последнего появления, а не от первого
+    assert tracks.update("vorota1", [CAR], [[100, 100, 200, 200]], now=100).tolist() == [False]
+    assert tracks.update("vorota1", [CAR], [[100, 100, 200, 200]], now=161).tolist() == [True]
+
+
+def test_oldest_tracks_are_dropped_over_the_limit(tmp_path):
+    tracks = tracker(tmp_path, max_tracks=2)
+    for n in range(3):
+        tracks.update("dvr5", [CAR], [[n * 200, 0, n * 200 + 100, 100]], now=n)
+    assert tracks.update("dvr5", [CAR], [[0, 0, 100, 100]], now=3).tolist() == [True]
+    assert tracks.update("dvr5", [CAR], [[400, 0, 500, 100]], now=3).tolist() == [False]
+
+
+def test_state_is_shared_through_the_file(tmp_path):
+    first, second = tracker(tmp_path), tracker(tmp_path)
+    first.update("vorota1", [CAR], [[100, 100, 200, 200]], now=0)
+    assert second.update("vorota1", [CAR], [[100, 100, 200, 200]], now=1).tolist() == [False]
+    # перезапуск процесса: треки читаются из файла
+    assert tracker(tmp_path).update("vorota1", [CAR], [[101, 100, 200, 200]], now=2).tolist() == [False]
+    assert tracker(tmp_path).update("vorota1", np.zeros(0), np.zeros((0, 4)), now=3).tolist() == []
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import roi
+from inference_backend import warmup
+
+
+def detections(*boxes, cls=2, conf=0.9):
+    xyxy = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.full(len(xyxy), cls, dtype=np.intp), np.full(len(xyxy), conf, dtype=np.float32), xyxy
+
+
+def test_fractional_region_bounds():
+    plan = roi.RoiPlan([[0.25, 0.5, 0.75, 1.0]], 1280, 720)
+    assert plan.bounds == (320, 360, 960, 720)
+    assert plan.mask is None and plan.tiles == [plan.bounds]
+
+
+def test_polygon_bounds_are_clipped_and_masked():
+    plan = roi.RoiPlan([[[-10, 100], [300, 100], [-10, 400]]], 640, 360)
+    assert plan.bounds == (0, 100, 300, 360)
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    [(crop, offset)] = plan.crops(frame)
+    assert crop.shape == (260, 300, 3) and offset == (0, 100)
+    # вне треугольника кадр закрашен, внутри — как есть
+    assert tuple(crop[-1, -1]) == roi.MASK_COLOR and tuple(crop[5, 5]) == (0, 0, 0)
+
+
+@pytest.mark.parametrize("bounds, tiles", [((0, 0, 1280, 300), None), ((100, 50, 1100, 250), 4), ((0, 0, 200, 900), 3)])
+def test_tiles_cover_the_zone_with_overlap(bounds, tiles):
+    x1, y1, x2, y2 = bounds
+    result = roi.plan_tiles(bounds, tiles)
+    assert len(result) > 1
+    horizontal = x2 - x1 >= y2 - y1
+    axis = (0, 2) if horizontal else (1, 3)
+    spans = [(tile[axis[0]], tile[axis[1]]) for tile in result]
+    assert spans[0][0] == bounds[axis[0]] and spans[-1][1] == bounds[axis[1]]
+    size = spans[0][1] - spans[0][0]
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert end - start == size
+        assert end - next_start >= roi.TILE_OVERLAP * size - 1  # соседи перекрываются, без щелей
+    # поперечная сторона у всех тайлов — вся зона
+    cross = (1, 3) if horizontal else (0, 2)
+    assert all((tile[cross[0]], tile[cross[1]]) == (bounds[cross[0]], bounds[cross[1]]) for tile in result)
+
+
+def test_merge_maps_tile_boxes_to_frame_coordinates():
+    plan = roi.RoiPlan([[100, 50, 1100, 250]], 1280, 720, tiles=2)
+    offsets = [(x1, y1) for x1, y1, _, _ in plan.tiles]
+    assert offsets[0] == (100, 50)
+    second = offsets[1]
+    outputs = [detections([10, 20, 60, 80]),
+               detections([600 - second[0], 20, 650 - second[0], 80], cls=7)]
+    classes, _, xyxy = plan.merge(outputs, offsets)
+    assert classes.tolist() == [2, 7]
+    assert xyxy.tolist() == [[110, 70, 160, 130], [600, 70, 650, 130]]
+
+
+def test_merge_joins_a_box_seen_by_both_tiles_and_drops_boxes_outside_the_zone():
+    plan = roi.RoiPlan([[100, 50, 1100, 250]], 1280, 720, tiles=2)
+    offsets = [(x1, y1) for x1, y1, _, _ in plan.tiles]
+    seam = plan.tiles[1][0]  # объект на стыке виден в обоих тайлах
+    box = [seam - 5, 100, seam + 45, 160]
+    outputs = [detections([box[0] - offsets[0][0], 50, box[2] - offsets[0][0], 110], conf=0.8),
+               detections([box[0] - offsets[1][0], 50, box[2] - offsets[1][0], 110],
+                          [900 - offsets[1][0], 200, 1300 - offsets[1][0], 400])]
+    classes, confidences, xyxy = plan.merge(outputs, offsets)
+    assert xyxy.tolist() == [box]
+    assert confidences.tolist() == pytest.approx([0.9])
+
+
+def test_warmup_runs_at_the_requested_size():
+    class Recorder:
+        imgsz = 640
+
+        def __init__(self):
+            self.calls = []
+
+        def predict(self, frames, imgsz=None):
+            self.calls.append((frames[0].shape[0], imgsz))
+
+    backend = Recorder()
+    warmup(backend, 320)
+    warmup(backend)
+    assert backend.calls == [(320, 320), (320, 320), (640, 640), (640, 640)]
@@ -0,0 +1,84 @@
+import os
+import tarfile
+from datetime import date
+import storage
+
+
+def write(path, data=b"jpeg"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def tar_names(path):
+    with tarfile.open(path) as archive:
+        return sorted(archive.getnames())
+
+
+def test_shard_of_normalizes_dates_and_unknown_names():
+    assert storage.shard_of("vorota1_05.01.2026_12-00-00_1.jpg") == ("vorota1", "2026-01-05")
+    assert storage.shard_of("dvr5_2026-01-05_12-00-00_1_with_detections.jpg") == ("dvr5", "2026-01-05")
+    assert storage.shard_of("photo.jpg", fallback=0)[0] == storage.UNKNOWN_CAMERA
+
+
+def test_migrate_moves_flat_files_into_shards(tmp_path):
+    base = str(tmp_path)
+    write(os.path.join(base, "vorota1_2026-01-05_12-00-00_1.jpg"))
+    write(os.path.join(base, "dvr5_2026-01-06_08-00-00_2.jpg"))
+    write(os.path.join(base, ".hidden"))
+    assert storage.migrate(base) == 2
+    assert os.path.isfile(os.path.join(base, "vorota1", "2026-01-05", "vorota1_2026-01-05_12-00-00_1.jpg"))
+    assert os.path.isfile(os.path.join(base, "dvr5", "2026-01-06", "dvr5_2026-01-06_08-00-00_2.jpg"))
+    assert storage.migrate(base) == 0
+
+
+def test_compact_and_history_across_tar_and_directory(tmp_path):
+    base = str(tmp_path)
+    for day in ("2026-01-01", "2026-01-02", "2026-01-09"):
+        write(storage.shard_path(base, f"vorota1_{day}_12-00-00_1.jpg"))
+    assert storage.compact(base, after_days=7, today=date(2026, 1, 10)) == 2
+    camera = os.path.join(base, "vorota1")
+    assert sorted(os.listdir(camera)) == ["2026-01-01.tar", "2026-01-02.tar", "2026-01-09"]
+
+    # опоздавший кадр за упакованный день дописывается к архиву
+    write(storage.shard_path(base, "vorota1_2026-01-01_12-30-00_1.jpg"))
+    assert storage.compact(base, after_days=7, today=date(2026, 1, 10)) == 1
+    assert tar_names(os.path.join(camera, "2026-01-01.tar")) == ["vorota1_2026-01-01_12-00-00_1.jpg",
+                                                                   "vorota1_2026-01-01_12-30-00_1.jpg"]
+
+    history = list(storage.iter_history(base, since="2026-01-02"))
+    assert [(day, name) for _, day, name, _ in history] == [("2026-01-02", "vorota1_2026-01-02_12-00-00_1.jpg"),
+                                                           ("2026-01-09", "vorota1_2026-01-09_12-00-00_1.jpg")]
+    assert history[0][3] == (os.path.join(camera, "2026-01-02.tar"), "vorota1_2026-01-02_12-00-00_1.jpg")
+    assert history[1][3] == os.path.join(camera, "2026-01-09", "vorota1_2026-01-09_12-00-00_1.jpg")
+
+
+def test_frame_written_during_compaction_is_kept(tmp_path, monkeypatch):
+    base = str(tmp_path)
+    write(storage.shard_path(base, "dvr5_2026-01-01_12-00-00_1.jpg"))
+    late = storage.shard_path(base, "dvr5_2026-01-01_12-00-05_1.jpg")
+    replace = os.replace
+
+    def replace_then_deliver(src, dst):
+        replace(src, dst)
+        if dst.endswith(".tar"):
+            write(late)  # кадр пришёл между упаковкой и удалением папки
+    monkeypatch.setattr(storage.os, "replace", replace_then_deliver)
+
+    storage.compact_day(os.path.dirname(late))
+    assert os.path.isfile(late)
+    assert tar_names(os.path.dirname(late) + ".tar") == ["dvr5_2026-01-01_12-00-00_1.jpg"]
+
+    monkeypatch.setattr(storage.os, "replace", replace)
+    storage.compact_day(os.path.dirname(late))
+    assert not os.path.exists(os.path.dirname(late))
+    assert len(tar_names(os.path.dirname(late) + ".tar")) == 2
+
+
+def test_retention_removes_old_days_of_both_kinds(tmp_path):
+    base = str(tmp_path)
+    for day in ("2026-01-01", "2026-01-05", "2026-01-08"):
+        write(storage.shard_path(base, f"dvr5_{day}_12-00-00_1.jpg"))
+    storage.compact_day(os.path.join(base, "dvr5", "2026-01-01"))
+    assert storage.apply_retention(base, keep_days=3, today=date(2026, 1, 10)) == 2
+    assert os.listdir(os.path.join(base, "dvr5")) == ["2026-01-08"]
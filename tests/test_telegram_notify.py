@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import subprocess
+import pytest
+import bench_standins
+import telegram_notify
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_rate_limit_is_shared_between_processes(tmp_path):
+    # три процесса по 10 запросов при общем лимите 20/с и всплеске 5: не быстрее (30 - 5) / 20 с
+    path = tmp_path / "rate"
+    code = ("import sys; from telegram_notify import RateLimiter; "
+            "limiter = RateLimiter(20, burst=5, path=sys.argv[1]); "
+            "[limiter.acquire() for _ in range(10)]")
+    started = time.monotonic()
+    processes = [subprocess.Popen([sys.executable, "-c", code, str(path)], cwd=ROOT) for _ in range(3)]
+    assert all(process.wait(timeout=30) == 0 for process in processes)
+    assert time.monotonic() - started >= (30 - 5) / 20 * 0.95
+
+
+def test_reserve_leaves_tokens_for_live_notifications():
+    limiter = telegram_notify.RateLimiter(1, burst=3)
+    limiter.acquire(reserve=1)
+    limiter.acquire(reserve=1)
+    started = time.monotonic()
+    limiter.acquire()  # живое уведомление берёт последний токен без ожидания
+    assert time.monotonic() - started < 0.1
+
+
+@pytest.fixture
+def telegram(monkeypatch, tmp_path):
+    server = bench_standins.start(bench_standins.TelegramStandIn(), "telegram")
+    queue_path = tmp_path / "telegram-queue"
+    queue_path.mkdir()
+    monkeypatch.setattr(telegram_notify, "TELEGRAM_QUEUE", str(queue_path))
+    dispatcher = telegram_notify.TelegramDispatcher(token="bench", api_url=server.url, workers=2)
+    yield server, dispatcher, queue_path
+    dispatcher.close()
+    bench_standins.stop(server)
+
+
+def photos(tmp_path, count):
+    paths = []
+    for index in range(1, count + 1):
+        path = tmp_path / f"dvr5_2026-01-01_12-00-00_{index}.jpg"
+        path.write_bytes(b"\xff\xd8jpeg%d" % index)
+        paths.append(str(path))
+    return paths
+
+
+def test_photo_is_uploaded_once_for_all_chats(telegram, tmp_path):
+    server, dispatcher, queue_path = telegram
+    path, = photos(tmp_path, 1)
+    dispatcher.notify(path, "dvr5", "2026-01-01", "12-00-00", ["car"], ["-1", "-2", "-3"]).result(timeout=10)
+    calls = sorted((chat_id, method, uploads) for _, method, chat_id, _, uploads in server.received)
+    assert [method for _, method, _ in calls] == ["sendPhoto"] * 3
+    assert sum(uploads for _, _, uploads in calls) == 1
+    assert os.listdir(queue_path) == []
+
+
+def test_failed_event_is_queued_and_replayed_as_album(telegram, tmp_path):
+    server, dispatcher, queue_path = telegram
+    paths = photos(tmp_path, 3)
+    server.outage = True
+    dispatcher.notify_group([(path, None) for path in paths], "dvr5", "2026-01-01", "12-00-00", ["car"],
+                            ["-1", "-2"]).result(timeout=10)
+    assert len(os.listdir(queue_path)) == 6  # по записи на кадр и чат
+
+    worker = telegram_notify.TelegramQueueWorker(dispatcher, path=str(queue_path), concurrency=1)
+    count, error = worker.drain_once()
+    assert count == 6 and isinstance(error, telegram_notify.TelegramError)
+    assert len(os.listdir(queue_path)) == 6
+
+    server.outage = False
+    server.received.clear()
+    assert worker.drain_once() == (6, None)
+    assert os.listdir(queue_path) == []
+    assert sorted((chat_id, method, len(captions)) for _, method, chat_id, captions, _ in server.received) == [
+        ("-1", "sendMediaGroup", 3), ("-2", "sendMediaGroup", 3)]
+    # по одному чату за раз: фото загружаются в первый чат, второму уходят полученные file_id
+    assert sum(uploads for *_, uploads in server.received) == 3
+
+
+def test_replay_drops_entries_with_missing_photo(telegram, tmp_path):
+    server, dispatcher, queue_path = telegram
+    path, = photos(tmp_path, 1)
+    telegram_notify.save_to_telegram_queue(path, "dvr5", "2026-01-01", "12-00-00", ["car"], ["-1"])
+    os.remove(path)  # кадр уже удалён ротацией хранилища
+    worker = telegram_notify.TelegramQueueWorker(dispatcher, path=str(queue_path))
+    assert worker.drain_once() == (1, None)
+    assert os.listdir(queue_path) == [] and server.received == []
+
+
+def test_queue_order_with_numeric_camera_names():
+    names = [
+        "1792279930772208095_vorota1_2026-01-01_12-00-00_1.jpg.json",
+        "1234_2026-01-01_11-00-00_1.jpg_1792279000.json",  # старое имя, камера из одних цифр
+        "1792279930000000000_5678_2026-01-01_12-00-00_1.jpg.json",
+        "vorota2_2026-01-01_10-00-00_1.jpg_1792278000.json",
+    ]
+    assert [name for _, name in sorted(map(telegram_notify.queue_entry_key, names))] == [
+        names[3], names[1], names[2], names[0]]